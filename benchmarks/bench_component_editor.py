@@ -0,0 +1,95 @@
+# Benchmark of the component editor of the GUI, run offscreen.
+# Compares the time to open the editor with a combo box and a completer over the whole catalogue in every
+# row (the previous implementation, reproduced here) against ComponentEditor, which shares one catalogue
+# model and only creates a combo box for the cell being edited. Also compares the completion of a typed
+# lib_id: linear scan of the catalogue (the previous CustomCompleter.splitPath) against the substring index.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_component_editor [--rows 10 50 200]
+
+import argparse
+import os
+import sys
+import time
+
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from PyQt6.QtWidgets import QApplication, QComboBox, QCompleter, QStyleOptionViewItem, QTableWidget, QTableWidgetItem
+
+from scripts.conversion_result import ConversionResult
+from scripts.symbol_search import symbol_search
+
+QUERIES = ["res", "device:r", "LM35", "usb_c", "atmega328", "conn_01x04", "led", "sw_push", "q_npn", "7805"]
+
+
+def synthetic_result(rows, lib_ids):
+    components = [{"lib_id": lib_ids[i * 97 % len(lib_ids)], "lib_id_gpt": "resistor", "x": i % 8, "y": i // 8,
+                   "angle": 0, "reference": f"R{i + 1}", "value": ""} for i in range(rows)]
+    return ConversionResult({"detected_components": components, "component_connections": []})
+
+
+def per_row_combo_boxes(table, result, items):
+    """The previous load_component_data: a filled combo box and a completer in every row."""
+    components = result["detected_components"]
+    table.setRowCount(len(components))
+    for row, component in enumerate(components):
+        for column, key in enumerate(["lib_id", "lib_id_gpt", "reference", "value", "x", "y"]):
+            table.setItem(row, column, QTableWidgetItem(str(component[key])))
+        combo = QComboBox()
+        combo.setEditable(True)
+        completer = QCompleter(items)
+        combo.setCompleter(completer)
+        combo.addItems(items)
+        combo.setCurrentText(component["lib_id"])
+        table.setCellWidget(row, 0, combo)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    QApplication.processEvents()
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--rows", type=int, nargs="+", default=[10, 50, 200])
+    args = arg_parser.parse_args()
+
+    app = QApplication(sys.argv)
+    from gui.gui import ComponentEditor
+
+    lib_ids = symbol_search.sorted_lib_ids()
+    editor = ComponentEditor(lambda: None)
+    start = time.perf_counter()
+    editor.load_symbols()
+    symbol_search.substring_index
+    print(f"{len(lib_ids)} lib_ids, shared model and completion index built once in "
+          f"{(time.perf_counter() - start) * 1000:.0f} ms")
+
+    for rows in args.rows:
+        result = synthetic_result(rows, lib_ids)
+        previous = timed(per_row_combo_boxes, QTableWidget(0, 6), result, lib_ids)
+        current = timed(editor.load_component_data, result)
+        print(f"{rows:4d} rows: per-row combo boxes {previous * 1000:8.1f} ms, shared model {current * 1000:6.2f} ms")
+
+    # Editing a cell creates one combo box over the shared model
+    delegate = editor.table.itemDelegateForColumn(0)
+    index = editor.table.model().index(0, 0)
+    editor_times = []
+    for _ in range(2):
+        start = time.perf_counter()
+        combo = delegate.createEditor(editor.table.viewport(), QStyleOptionViewItem(), index)
+        delegate.setEditorData(combo, index)
+        editor_times.append(time.perf_counter() - start)
+    # The first combo box of the process also sets up its style
+    print(f"editor for one cell: {editor_times[1] * 1000:.2f} ms (first one {editor_times[0] * 1000:.1f} ms)")
+
+    start = time.perf_counter()
+    scanned = [[lib_id for lib_id in lib_ids if query.lower() in lib_id.lower()] for query in QUERIES]
+    scan_time = (time.perf_counter() - start) / len(QUERIES)
+    start = time.perf_counter()
+    indexed = [symbol_search.find_containing(query) for query in QUERIES]
+    indexed_time = (time.perf_counter() - start) / len(QUERIES)
+    print(f"completion: scan {scan_time * 1000:.2f} ms/query, indexed {indexed_time * 1000:.3f} ms/query, "
+          f"identical results: {scanned == indexed}")
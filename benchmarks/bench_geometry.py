@@ -0,0 +1,144 @@
+# Benchmark of the vectorized geometry layer (scripts/geometry.py).
+# Times the scalar per-dict helpers the pipeline used before against the NumPy versions on a synthetic
+# layout, and checks that both give exactly the same results.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_geometry [--components 10000]
+
+import argparse
+import random
+import time
+
+import numpy as np
+
+from scripts import geometry
+from scripts.image_to_schematic import prepare_components
+from scripts.wire_routing import pin_location
+
+
+def legacy_scale_components(components, scaling_factor):
+    min_x = min(component['x'] for component in components)
+    min_y = min(component['y'] for component in components)
+    scaled_components = []
+    for component in components:
+        scaled_component = component.copy()
+        scaled_component['x'] = int(min_x + (component['x'] - min_x) * scaling_factor)
+        scaled_component['y'] = int(min_y + (component['y'] - min_y) * scaling_factor)
+        scaled_components.append(scaled_component)
+    return scaled_components
+
+
+def legacy_scale_components_in_relative_coordinates(components, scaling_factor):
+    scaled_components = []
+    for component in components:
+        scaled_component = component.copy()
+        scaled_component['x'] = int(20 + (component['x']) * scaling_factor)
+        scaled_component['y'] = int(20 + (component['y']) * scaling_factor)
+        scaled_components.append(scaled_component)
+    return scaled_components
+
+
+def legacy_prepare_components(result):
+    list_of_component_dict = []
+    for symbol in result["detected_components"]:
+        list_of_component_dict.append({"lib_id": symbol["lib_id"], "x": symbol["x"], "y": symbol["y"],
+                                      "angle": symbol["angle"], "reference_name": symbol["reference"], "value": symbol["value"]})
+    scaled_components = legacy_scale_components_in_relative_coordinates(list_of_component_dict, 10)
+    for component in scaled_components:
+        if component["lib_id"] == "Device:R":
+            if component["angle"] == 0:
+                component["angle"] = 90
+            else:
+                component["angle"] = 0
+    return scaled_components
+
+
+def legacy_label_positions(component, reference_offset, value_offset):
+    """The Reference/Value placement of add_component_to_document, for one component."""
+    refCord = list(reference_offset)
+    valueCord = list(value_offset)
+    if component["angle"] != 0:
+        xs = abs(refCord[0]) + 2.54
+        refCord[1] = round(component["y"] - 1.7 - xs, 2)
+        refCord[0] = round(component["x"], 2)
+        valueCord[1] = round(component["y"] - xs, 2)
+        valueCord[0] = round(component["x"], 2)
+    else:
+        refCord[0] = round(refCord[0] + component["x"], 2) + 0.5
+        refCord[1] = round(refCord[1] + component["y"], 2)
+        valueCord[0] = round(valueCord[0] + component["x"], 2)
+        valueCord[1] = round(valueCord[1] + component["y"], 2)
+    return refCord, valueCord
+
+
+def timed(function, *args, repeat=5):
+    """Best time of several runs."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def report(name, legacy, vectorized):
+    (legacy_result, legacy_time), (result, vectorized_time) = legacy, vectorized
+    # repr tells 5 from 5.0 and -0.0 from 0.0, which end up differently in the schematic
+    print(f"{name}: scalar {legacy_time * 1000:.1f} ms, vectorized {vectorized_time * 1000:.1f} ms "
+          f"({legacy_time / vectorized_time:.1f}x), identical: {repr(legacy_result) == repr(result)}")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--components", type=int, default=10000)
+    args = arg_parser.parse_args()
+
+    rng = random.Random(0)
+    n = args.components
+    components = [{"lib_id": "Device:R", "x": rng.randint(0, 200), "y": rng.randint(0, 150),
+                   "angle": rng.choice([0, 90, 180, 270]), "reference": f"R{i}", "value": "1k"} for i in range(n)]
+    wires = [{"x": round(rng.uniform(0, 300), 2), "y": round(rng.uniform(0, 200), 2),
+              "end_x": round(rng.uniform(0, 300), 2), "end_y": round(rng.uniform(0, 200), 2)} for _ in range(3 * n)]
+    for wire in wires[::3]:
+        wire["end_y"] = wire["y"]
+
+    report("scale_components", timed(legacy_scale_components, components, 0.2),
+           timed(geometry.scale_components, components, 0.2))
+    report("scale_components_in_relative_coordinates",
+           timed(legacy_scale_components_in_relative_coordinates, components, 10),
+           timed(geometry.scale_components_in_relative_coordinates, components, 10))
+    result = {"detected_components": components, "component_connections": []}
+    report("prepare_components", timed(legacy_prepare_components, result), timed(prepare_components, result))
+
+    # Field positions, with the Device:R offsets of the KiCad library
+    placed = geometry.scale_components_in_relative_coordinates(components, 10)
+    reference_offset, value_offset = (2.032, 0.0), (-2.032, 0.0)
+    report("label positions",
+           timed(lambda: [legacy_label_positions(c, reference_offset, value_offset) for c in placed]),
+           timed(lambda: list(zip(*geometry.label_positions(
+               [(c["x"], c["y"]) for c in placed], np.array([c["angle"] for c in placed], dtype=np.float64),
+               np.tile(reference_offset, (n, 1)), np.tile(value_offset, (n, 1)))))))
+
+    # Two pins per component, like Device:R
+    pin_offsets = [(0.0, 3.81), (0.0, -3.81)] * n
+    symbols = [c for c in placed for _ in range(2)]
+    report("pin locations",
+           timed(lambda: [pin_location(px, py, float(c["x"]), float(c["y"]), c["angle"])
+                          for (px, py), c in zip(pin_offsets, symbols)]),
+           timed(lambda: geometry.pin_locations(np.array(pin_offsets),
+                                                np.array([(c["x"], c["y"]) for c in symbols], dtype=np.float64),
+                                                np.array([c["angle"] for c in symbols], dtype=np.float64))))
+
+    # The array operations alone, for callers which keep their data in arrays
+    positions = geometry.component_positions(components)
+    segments = np.array([(w["x"], w["y"], w["end_x"], w["end_y"]) for w in wires])
+    _, scale_time = timed(geometry.scale_positions, positions, 10, None, 20)
+    split, _, _ = geometry.split_diagonal(segments)
+    _, split_time = timed(geometry.split_diagonal, segments)
+    assert split.tolist() == [[w["x"], w["y"], w["end_x"], w["end_y"]]
+                              for w in geometry.split_diagonal_segments(wires)]
+    _, rotate_time = timed(geometry.rotate_pin_offsets, np.array(pin_offsets),
+                           np.array([c["angle"] for c in symbols], dtype=np.float64))
+    print(f"arrays only: scale {scale_time * 1000:.2f} ms, split {split_time * 1000:.2f} ms, "
+          f"rotate pins {rotate_time * 1000:.2f} ms")
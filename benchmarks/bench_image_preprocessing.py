@@ -0,0 +1,36 @@
+# Benchmark of the image preprocessing stage (scripts/image_preprocessing.py).
+# Prepares each image as it is sent to the vision model and reports the upload size (base64) before and
+# after, and the time taken.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_image_preprocessing [images ...] [--max-dimension 2048]
+
+import argparse
+import glob
+import time
+
+from scripts.image_preprocessing import DEFAULT_MAX_DIMENSION, prepare_image
+
+
+def base64_size(size):
+    return 4 * ((size + 2) // 3)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("images", nargs="*", default=sorted(glob.glob("testImages/*")))
+    arg_parser.add_argument("--max-dimension", type=int, default=DEFAULT_MAX_DIMENSION)
+    args = arg_parser.parse_args()
+
+    total_before = total_after = 0
+    for image_path in args.images:
+        start = time.perf_counter()
+        prepared_image = prepare_image(image_path, max_dimension=args.max_dimension)
+        elapsed = time.perf_counter() - start
+        before, after = base64_size(prepared_image.original_size), base64_size(prepared_image.size)
+        total_before += before
+        total_after += after
+        print(f"{image_path}: {before} -> {after} base64 bytes, {prepared_image.mime_type}, "
+              f"{elapsed * 1000:.0f} ms ({', '.join(prepared_image.steps)})")
+    if total_before:
+        print(f"total: {total_before} -> {total_after} base64 bytes ({100 * (1 - total_after / total_before):.0f}% smaller)")
@@ -0,0 +1,72 @@
+# Import-time regression check.
+# Imports each module in a new interpreter with python -X importtime and checks its cumulative import time
+# against a budget. The modules used at startup must not import langchain or the provider SDKs, which are
+# loaded by the first conversion. Exits with status 1 when a budget is exceeded or a deferred module is imported.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_import_time [--runs 3] [--scale 1.0]
+
+import argparse
+import re
+import subprocess
+import sys
+
+# (module, budget in ms, whether it may import the model stage)
+BUDGETS = [
+    ("scripts.settings", 100, False),
+    ("scripts.image_to_schematic", 600, False),
+    ("gui.gui", 800, False),
+    ("scripts.LLMToSchematics", 2000, True),
+]
+
+# Imported when the first model is called, never at startup
+DEFERRED_MODULES = ["langchain", "langchain_core", "langchain_openai", "langchain_google_genai", "openai",
+                    "google.generativeai", "httpx"]
+
+IMPORT_TIME_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_times(module):
+    """
+    Import a module in a new interpreter.
+
+    Returns:
+        tuple: The cumulative import time of the module in ms, and the names of all the modules imported.
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             capture_output=True, text=True)
+    if process.returncode != 0:
+        raise SystemExit(f"import {module} failed:\n{process.stderr[-2000:]}")
+    total = None
+    imported = set()
+    for line in process.stderr.splitlines():
+        match = IMPORT_TIME_LINE.match(line)
+        if match is None:
+            continue
+        imported.add(match.group(4))
+        # The module itself is at the top level, the modules it imports are indented
+        if match.group(4) == module and len(match.group(3)) == 1:
+            total = int(match.group(2)) / 1000
+    return total, imported
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--runs", type=int, default=3, help="The best of this many imports is kept")
+    arg_parser.add_argument("--scale", type=float, default=1.0, help="Multiply the budgets, for slow machines")
+    args = arg_parser.parse_args()
+
+    ok = True
+    for module, budget, loads_model_stage in BUDGETS:
+        runs = [import_times(module) for _ in range(args.runs)]
+        best = min(total for total, _ in runs)
+        imported = runs[0][1]
+        deferred = sorted(name for name in DEFERRED_MODULES if name in imported)
+        over_budget = best > budget * args.scale
+        print(f"{module:28s} {best:7.0f} ms (budget {budget * args.scale:.0f} ms)"
+              f"{'  OVER BUDGET' if over_budget else ''}")
+        if deferred and not loads_model_stage:
+            print(f"  imports {', '.join(deferred)} at startup")
+            ok = False
+        ok = ok and not over_budget
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,70 @@
+# Benchmark of lib_id resolution (scripts/lib_id_resolver.py).
+# Resolves detection results with many components and few distinct names, and compares the previous
+# match_libId (reproduced here: an alias chain, then a fuzzy search for every component) with resolve_lib_ids,
+# which looks each distinct name up in the alias table once, searches the remaining ones once, and memoizes
+# them. "cold" starts from an empty cache, "warm" resolves the same names again, as the next conversion does.
+# Needs configuration.yaml and symbol_data.json.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_lib_id_resolver [--components 100 1000 10000] [--names 10]
+
+import argparse
+import time
+
+from scripts.conversion_result import ConversionResult
+from scripts.image_to_schematic import resolve_lib_ids
+from scripts.lib_id_resolver import get_resolver
+from scripts.symbol_search import symbol_search
+
+# Half of them in the alias table, half matched by the fuzzy search
+NAMES = ["resistor", "npn transistor", "capacitor", "diode", "led", "op amp", "battery", "potentiometer",
+         "switch", "voltage regulator", "Resistor", "inductor", "C", "crystal", "LED", "audio jack"]
+
+
+def previous_match_lib_id(raw_libid):
+    """match_libId as it was, for every component."""
+    if raw_libid == "resistor" or raw_libid == "R" or raw_libid == "Resistor":
+        return "Device:R"
+    elif raw_libid == "capacitor" or raw_libid == "C" or raw_libid == "C_Small":
+        return "Device:C"
+    elif "battery" == raw_libid or "cell" == raw_libid or "BAT" == raw_libid:
+        return "Device:Battery"
+    elif "led" == raw_libid or "LED" == raw_libid:
+        return "Device:LED"
+    elif "switch" == raw_libid or "SW" == raw_libid or "switch_spst" == raw_libid:
+        return "Switch:SW_SPST"
+    return symbol_search.find_closest_matches(raw_libid)[0]
+
+
+def detection_result(component_count, names):
+    return ConversionResult({"detected_components": [
+        {"lib_id": names[i % len(names)], "x": i % 10, "y": i // 10, "angle": 0, "reference": f"U{i + 1}", "value": ""}
+        for i in range(component_count)], "component_connections": []})
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    value = function(*args)
+    return time.perf_counter() - start, value
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--components", type=int, nargs="+", default=[100, 1000, 10000])
+    arg_parser.add_argument("--names", type=int, default=10, help="Distinct component names per result")
+    args = arg_parser.parse_args()
+
+    names = NAMES[:args.names]
+    # Load the catalogue and its index once, so both sides measure the matching only
+    symbol_search.find_closest_matches(names[0])
+
+    for component_count in args.components:
+        result = detection_result(component_count, names)
+        previous, expected = timed(lambda: [previous_match_lib_id(component["lib_id"])
+                                            for component in result["detected_components"]])
+        get_resolver().clear()
+        cold, resolved = timed(resolve_lib_ids, detection_result(component_count, names))
+        warm, _ = timed(resolve_lib_ids, detection_result(component_count, names))
+        same = [component["lib_id"] for component in resolved["detected_components"]] == expected
+        print(f"{component_count:6d} components, {len(names)} names: per component {previous * 1000:9.1f} ms, "
+              f"resolver cold {cold * 1000:7.2f} ms, warm {warm * 1000:6.2f} ms, same lib_ids: {same}")
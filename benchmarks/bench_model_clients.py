@@ -0,0 +1,58 @@
+# Benchmark of chat model client reuse.
+# Starts the local fake of the OpenAI chat completions endpoint (scripts/fake_llm.py), then compares the
+# per-call overhead of constructing a new ChatOpenAI (and its HTTP connection pool) for every call with the
+# shared models of LLMToSchematics.get_chat_model, which keep their connections alive. No API key or network
+# access is needed.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_model_clients [--calls 200] [--threads 8]
+
+import argparse
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+from langchain import globals
+from langchain_core.messages import HumanMessage
+
+import scripts.LLMToSchematics as LLMToSchematics
+from scripts.fake_llm import FakeChatModel, serve
+
+MODEL_NAME = LLMToSchematics.TEXT_MODEL_NAMES['openai']
+
+
+def run(server, calls, threads, invoke):
+    server.connections = 0
+    messages = [HumanMessage(content="ping")]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(lambda _: invoke(messages), range(calls)))
+    return time.perf_counter() - start, server.connections
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--calls", type=int, default=200)
+    arg_parser.add_argument("--threads", type=int, default=8)
+    args = arg_parser.parse_args()
+
+    globals.set_debug(False)
+    server, base_url = serve(FakeChatModel(response='{"detected_components": [], "component_connections": []}'))
+
+    def new_model_per_call(messages):
+        return LLMToSchematics.create_chat_model('openai', MODEL_NAME, base_url=base_url).invoke(messages)
+
+    LLMToSchematics.api_in_use = 'openai'
+    LLMToSchematics.openai_base_url = base_url
+
+    def shared_model(messages):
+        return LLMToSchematics.get_chat_model(MODEL_NAME).invoke(messages)
+
+    for label, invoke in (("new ChatOpenAI per call", new_model_per_call), ("shared chat model", shared_model)):
+        elapsed, connections = run(server, args.calls, args.threads, invoke)
+        print(f"{label}: {args.calls} calls on {args.threads} threads in {elapsed:.3f} s "
+              f"({elapsed / args.calls * 1000:.2f} ms/call, {connections} TCP connections)")
+
+    server.shutdown()
@@ -0,0 +1,71 @@
+# Benchmark of schematic generation.
+# Times kicad_utils.create_kicad_sch_file on a synthetic sheet, and compares with adding the same
+# elements one at a time through add_component_to_kicad_sch_file/add_wire_to_kicad_sch_file, which
+# re-parse and re-serialize the whole schematic string for every element.
+# Needs configuration.yaml and the KiCad symbol library (Device.kicad_sym).
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_schematic_writer [--components 1000] [--wires 3000]
+
+import argparse
+import contextlib
+import io
+import os
+import tempfile
+import time
+
+import scripts.kicad_utils as kicad_utils
+
+LIB_IDS = ["Device:R", "Device:C", "Device:LED"]
+
+
+def synthetic_sheet(component_count, wire_count):
+    components = []
+    for i in range(component_count):
+        components.append({"lib_id": LIB_IDS[i % len(LIB_IDS)], "x": 20 + (i % 40) * 10, "y": 20 + (i // 40) * 10,
+                           "angle": 90 * (i % 2), "reference_name": f"U{i + 1}", "value": "1k"})
+    wires = []
+    for i in range(wire_count):
+        x, y = 20 + (i % 40) * 10, 20 + (i // 40) * 5
+        wires.append({"x": x, "y": y, "end_x": x + 5, "end_y": y})
+    return components, wires
+
+
+def time_document(components, wires):
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            kicad_utils.create_kicad_sch_file(components=components, wires=wires,
+                                              new_file_name=os.path.join(directory, "bench"))
+        return time.perf_counter() - start
+
+
+def time_splicing(components, wires):
+    start = time.perf_counter()
+    kicad_sch_file = kicad_utils.create_empty_kicad_sch_template()
+    for component in components:
+        kicad_sch_file = kicad_utils.add_component_to_kicad_sch_file(kicad_sch_file, component)
+    for wire in wires:
+        kicad_sch_file = kicad_utils.add_wire_to_kicad_sch_file(kicad_sch_file, wire)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--components", type=int, default=1000)
+    arg_parser.add_argument("--wires", type=int, default=3000)
+    args = arg_parser.parse_args()
+
+    # Load the library once so that both runs measure schematic generation only
+    for lib_id in LIB_IDS:
+        kicad_utils.get_library_symbol(lib_id)
+
+    components, wires = synthetic_sheet(args.components, args.wires)
+    print(f"SchematicDocument, {args.components} components + {args.wires} wires: "
+          f"{time_document(components, wires):.3f} s")
+
+    small_components, small_wires = synthetic_sheet(args.components // 10, args.wires // 10)
+    print(f"SchematicDocument, {len(small_components)} components + {len(small_wires)} wires: "
+          f"{time_document(small_components, small_wires):.3f} s")
+    print(f"per-element string splicing, {len(small_components)} components + {len(small_wires)} wires: "
+          f"{time_splicing(small_components, small_wires):.3f} s")
@@ -0,0 +1,95 @@
+# Benchmark of the S-expression scanner on KiCad symbol library files.
+# For every .kicad_sym file, finds the end of every top-level symbol with the previous
+# character-by-character scanner and with sexpr.form_end, and indexes the same file with
+# one pass of sexpr.scan_forms.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_sexpr [--symbol-library-path /usr/share/kicad/symbols/]
+
+import argparse
+import os
+import time
+
+import yaml
+
+from scripts import sexpr
+
+
+def legacy_form_end(content, subsection_start):
+    """Reference implementation: the scanner previously used by kicad_utils.extract_subsection."""
+    balance = 0
+    for i in range(subsection_start, len(content)):
+        if content[i] == '(':
+            balance += 1
+        elif content[i] == ')':
+            balance -= 1
+
+        if balance == 0:
+            return i + 1
+    return None
+
+
+def default_symbol_library_path():
+    if not os.path.exists('configuration.yaml'):
+        return None
+    with open('configuration.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+    return os.path.expanduser(config.get('symbol_library_path', ''))
+
+
+def run(directory_path):
+    total_bytes = 0
+    total_symbols = 0
+    legacy_time = 0.0
+    scan_time = 0.0
+    lookup_time = 0.0
+    mismatches = []
+
+    for filename in sorted(os.listdir(directory_path)):
+        if not filename.endswith(".kicad_sym"):
+            continue
+        with open(os.path.join(directory_path, filename), 'r') as file:
+            content = file.read()
+        total_bytes += len(content)
+
+        start = time.perf_counter()
+        spans = {}
+        for head, name, form_start, form_end in sexpr.scan_forms(content, depth=1):
+            if head == "symbol" and name not in spans:
+                spans[name] = (form_start, form_end)
+        scan_time += time.perf_counter() - start
+        total_symbols += len(spans)
+
+        # Both scanners start from the same str.find result, only the scanning is timed
+        starts = {name: content.find(f'(symbol "{sexpr.escape(name)}"') for name in spans}
+
+        start = time.perf_counter()
+        for form_start in starts.values():
+            sexpr.form_end(content, form_start)
+        lookup_time += time.perf_counter() - start
+
+        start = time.perf_counter()
+        legacy_ends = {name: legacy_form_end(content, form_start) for name, form_start in starts.items()}
+        legacy_time += time.perf_counter() - start
+
+        for name, span in spans.items():
+            if (starts[name], legacy_ends[name]) != span:
+                mismatches.append(f"{filename}:{name}")
+
+    megabytes = total_bytes / 1e6
+    print(f"{total_symbols} symbols in {megabytes:.1f} MB of libraries")
+    print(f"  legacy scanner, one call per symbol: {legacy_time:8.3f} s")
+    print(f"  sexpr.form_end, one call per symbol: {lookup_time:8.3f} s ({legacy_time / lookup_time:.1f}x)")
+    print(f"  sexpr.scan_forms, one pass per file: {scan_time:8.3f} s ({legacy_time / scan_time:.1f}x, "
+          f"{megabytes / scan_time:.0f} MB/s)")
+    # The legacy scanner miscounts parentheses inside quoted strings, so a few spans may differ
+    print(f"  spans differing from the legacy scanner: {len(mismatches)} {mismatches[:5]}")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--symbol-library-path", default=default_symbol_library_path())
+    args = arg_parser.parse_args()
+    if not args.symbol_library_path:
+        raise SystemExit("No symbol library path given and no configuration.yaml found")
+    run(args.symbol_library_path)
@@ -0,0 +1,116 @@
+# Benchmark of the streaming conversion (get_json_from_image_streaming) against the blocking one.
+# The local fake chat model of scripts/fake_llm.py streams a canned response at a fixed token rate. Blocking: wait for the whole
+# response, then match lib_ids, load the symbols and write the schematic. Streaming: the lib_ids are matched
+# and the symbols loaded while the connections are still arriving. The symbol library cache is cleared
+# before each run, as in a new process. The symbol libraries are copied to a temporary directory, with
+# Device.kicad_sym padded to the size of the KiCad library, so loading them costs what it costs in practice.
+# Needs configuration.yaml and the KiCad symbol library (Device.kicad_sym, Switch.kicad_sym).
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_streaming [--components 24] [--tokens-per-second 200]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import tempfile
+import time
+
+import scripts.kicad_utils as kicad_utils
+from scripts.LLMToSchematics import parser
+from scripts.fake_llm import CHARS_PER_TOKEN, FakeChatModel
+from scripts.image_to_schematic import (finish_conversion, get_json_from_image_streaming, write_schematic,
+                                        write_schematic_streaming)
+from scripts.symbol_library import symbol_library_cache
+
+NAMES = ["resistor", "capacitor", "led", "battery", "switch"]
+
+
+def canned_response(component_count, seed=0):
+    rng = random.Random(seed)
+    components = [{"lib_id": NAMES[i % len(NAMES)], "x": i % 6, "y": i // 6, "angle": rng.choice([0, 90]),
+                   "reference": f"U{i + 1}", "value": ""} for i in range(component_count)]
+    connections = [{"A_ref": f"U{i + 1}", "A_pin": 2, "B_ref": f"U{i + 2}", "B_pin": 1}
+                   for i in range(component_count - 1)]
+    document = {"detected_components": components, "component_connections": connections}
+    return "```json\n" + json.dumps(document, indent=2) + "\n```"
+
+
+def padded_library(directory, size):
+    """Copy the symbol libraries, adding copies of Device:R to Device.kicad_sym until it is size bytes."""
+    library_directory = os.path.join(directory, "symbols")
+    os.makedirs(library_directory)
+    for lib_name in ("Device", "Switch"):
+        with open(os.path.join(kicad_utils.PATH_TO_SYMBOL_LIBRARY, f"{lib_name}.kicad_sym")) as f:
+            content = f.read()
+        if lib_name == "Device":
+            definition = kicad_utils.get_library_symbol("Device:R").definition
+            fillers = []
+            total = len(content)
+            while total < size:
+                filler = definition.replace('"R', f'"Filler{len(fillers)}_R')
+                fillers.append(filler)
+                total += len(filler) + 2
+            end = content.rindex(")")
+            content = content[:end] + "\n\t" + "\n\t".join(fillers) + "\n" + content[end:]
+        with open(os.path.join(library_directory, f"{lib_name}.kicad_sym"), "w") as f:
+            f.write(content)
+    return library_directory + os.sep
+
+
+def blocking(model, image_path, schematic_path):
+    response = parser.parse(model.invoke("convert").content)
+    result = finish_conversion(response)
+    write_schematic(result, schematic_path, create=True)
+    return result
+
+
+def streaming(model, image_path, schematic_path):
+    result = get_json_from_image_streaming(image_path, use_cache=False, model=model)
+    write_schematic(result, schematic_path, create=True)
+    return result
+
+
+def streaming_placement(model, image_path, schematic_path):
+    result, _, _ = write_schematic_streaming(image_path, schematic_path, create=True, use_cache=False, model=model)
+    return result
+
+
+def schematic_text(path):
+    # The uuids are new in every file
+    with open(path) as f:
+        return re.sub(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', 'uuid', f.read())
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--components", type=int, default=24)
+    arg_parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    arg_parser.add_argument("--image", default="testImages/image.png")
+    arg_parser.add_argument("--library-mb", type=float, default=2.0, help="Size of the padded Device.kicad_sym")
+    args = arg_parser.parse_args()
+
+    response = canned_response(args.components)
+    model = FakeChatModel(response=response, tokens_per_second=args.tokens_per_second)
+    model_seconds = len(range(0, len(response), CHARS_PER_TOKEN)) / args.tokens_per_second
+    print(f"{args.components} components, {len(response)} characters, model latency about {model_seconds:.2f} s")
+
+    with tempfile.TemporaryDirectory() as directory:
+        kicad_utils.PATH_TO_SYMBOL_LIBRARY = padded_library(directory, int(args.library_mb * 1024 * 1024))
+        results = {}
+        modes = (("blocking", blocking), ("streaming, lib_ids and symbols early", streaming),
+                 ("streaming, components placed early", streaming_placement))
+        paths = {}
+        for name, convert in modes:
+            symbol_library_cache.clear()
+            start = time.perf_counter()
+            with contextlib.redirect_stdout(io.StringIO()):
+                paths[name] = os.path.join(directory, f"{len(paths)}.kicad_sch")
+                results[name] = convert(model, args.image, paths[name])
+            elapsed = time.perf_counter() - start
+            print(f"{name}: {elapsed:.2f} s end to end, {elapsed - model_seconds:.2f} s after the model")
+        print("same results:", all(result == results["blocking"] for result in results.values()),
+              "same schematics:", len({schematic_text(path) for path in paths.values()}) == 1)
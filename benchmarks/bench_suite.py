@@ -0,0 +1,247 @@
+# Offline benchmark suite of the conversion pipeline, without any API call.
+# Times the stages on synthetic circuits of 10 to 10,000 components, and the whole GUI-free conversion
+# (image preparation, streamed model answer, lib_id matching, schematic writing) of the testImages/ files by
+# replaying model responses from benchmarks/responses/:
+#   symbol_search            fuzzy lib_id search, building the index, then per name
+#   resolve_lib_ids          matching the names of a synthetic answer to lib_ids
+#   create_kicad_sch_file    writing a new schematic with the components of a synthetic answer
+#   modify_kicad_sch_file    adding the components of a synthetic answer to an existing schematic
+#   add_wires_to_schematic   routing the connections of a synthetic answer on its schematic
+#   end_to_end               get_json_from_image_streaming and write_schematic, per test image
+# The results are written as JSON, and compared with a previous run to flag regressions.
+# Needs configuration.yaml, symbol_data.json and the KiCad symbol library.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_suite [--sizes 10 100 1000 10000] [--density 1.5] --output results.json
+#   python -m benchmarks.bench_suite --output new.json --compare results.json [--threshold 0.2]
+
+import argparse
+import contextlib
+import glob
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import scripts.kicad_utils as kicad_utils
+from scripts.image_to_schematic import (add_wires_to_schematic, get_json_from_image_streaming, prepare_components,
+                                        resolve_lib_ids, write_schematic)
+from scripts.conversion_result import ConversionResult
+from scripts.fake_llm import FakeChatModel, synthetic_circuit
+from scripts.symbol_search import SymbolSearch, symbol_search
+
+RESPONSES_DIRECTORY = os.path.join(os.path.dirname(__file__), "responses")
+
+# Names which go through the fuzzy symbol search
+SEARCH_TERMS = ["transistor", "potentiometer", "audio jack", "diode", "inductor", "fuse", "op amp", "LM358",
+                "crystal", "usb_c", "atmega328", "7805", "relay", "buzzer", "photoresistor"]
+
+
+def load_responses(directory=RESPONSES_DIRECTORY):
+    """
+    Read the replayed model responses.
+
+    Returns:
+        list of dicts: One per test image, with its "image", the raw model "response", and its "source":
+            "recorded" for an answer of a model, "transcribed" for one written by hand.
+    """
+    responses = []
+    for path in sorted(glob.glob(os.path.join(directory, "*.json"))):
+        with open(path) as f:
+            responses.append({"name": os.path.splitext(os.path.basename(path))[0], **json.load(f)})
+    return responses
+
+
+def measure(function, repeat, setup=None):
+    """
+    Time a function, keeping its output quiet.
+
+    Parameters:
+        function (function): Called with the value returned by setup, or without arguments.
+        repeat (int): The number of runs.
+        setup (function, optional): Called before each run, outside of the timing.
+
+    Returns:
+        dict: The best and median times in seconds, or the error raised by the function.
+    """
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            try:
+                args = (setup(),) if setup is not None else ()
+                start = time.perf_counter()
+                function(*args)
+                times.append(time.perf_counter() - start)
+            except Exception as e:
+                return {"error": f"{type(e).__name__}: {e}"}
+    times.sort()
+    return {"best": times[0], "median": times[len(times) // 2], "runs": len(times)}
+
+
+def bench_symbol_search(repeat):
+    results = {}
+    # A new instance, so the catalogue and its index are loaded as in a new process
+    results["symbol_search/index"] = measure(
+        lambda search: search.find_closest_matches(SEARCH_TERMS[0]), repeat,
+        setup=lambda: SymbolSearch(symbol_search.symbol_data_path))
+    symbol_search.find_closest_matches(SEARCH_TERMS[0])
+    query = measure(lambda: [symbol_search.find_closest_matches(term) for term in SEARCH_TERMS], repeat)
+    if "error" not in query:
+        query = {**query, "best": query["best"] / len(SEARCH_TERMS), "median": query["median"] / len(SEARCH_TERMS)}
+    results["symbol_search/query"] = query
+    return results
+
+
+def bench_circuit(size, density, repeat, directory):
+    results = {}
+    answer = synthetic_circuit(size, density)
+    results[f"resolve_lib_ids/{size}"] = measure(
+        resolve_lib_ids, repeat, setup=lambda: ConversionResult(json.loads(json.dumps(answer))))
+    result = resolve_lib_ids(ConversionResult(answer))
+    components = prepare_components(result)
+    half = len(components) // 2
+    schematic_name = os.path.join(directory, f"circuit_{size}")
+
+    results[f"create_kicad_sch_file/{size}"] = measure(
+        lambda: kicad_utils.create_kicad_sch_file(components=components, new_file_name=schematic_name), repeat)
+
+    # The schematic is written again before each run, so every run starts from the same file
+    results[f"modify_kicad_sch_file/{size}"] = measure(
+        lambda path: kicad_utils.modify_kicad_sch_file(path, components=components[half:]), repeat,
+        setup=lambda: kicad_utils.create_kicad_sch_file(components=components[:half], new_file_name=schematic_name))
+    results[f"add_wires_to_schematic/{size}"] = measure(
+        lambda path: add_wires_to_schematic(kicad_schematic_path=path, result=result), repeat,
+        setup=lambda: kicad_utils.create_kicad_sch_file(components=components, new_file_name=schematic_name))
+    return results
+
+
+def bench_end_to_end(responses, repeat, directory, tokens_per_second):
+    results = {}
+    for response in responses:
+        model = FakeChatModel(response=response["response"], tokens_per_second=tokens_per_second)
+        schematic_path = os.path.join(directory, f"{response['name']}.kicad_sch")
+
+        def convert():
+            result = get_json_from_image_streaming(response["image"], use_cache=False, model=model)
+            write_schematic(result, schematic_path, create=True)
+        results[f"end_to_end/{response['name']}"] = {**measure(convert, repeat), "source": response["source"]}
+    return results
+
+
+def run_suite(sizes, density=1.5, repeat=3, tokens_per_second=float("inf")):
+    """
+    Run every benchmark of the suite.
+
+    Parameters:
+        sizes (list of int): The numbers of components of the synthetic circuits.
+        density (float, optional): The number of connections per component. Defaults to 1.5.
+        repeat (int, optional): The number of runs of each benchmark. Defaults to 3.
+        tokens_per_second (float, optional): The rate of the replayed responses. Defaults to no delay, so the
+            end-to-end times are the time spent by the pipeline itself.
+
+    Returns:
+        dict: {benchmark: {"best": s, "median": s, "runs": n}}, or {"error": message} for a failed benchmark.
+    """
+    results = bench_symbol_search(repeat)
+    with tempfile.TemporaryDirectory() as directory:
+        for size in sizes:
+            results.update(bench_circuit(size, density, repeat, directory))
+        results.update(bench_end_to_end(load_responses(), repeat, directory, tokens_per_second))
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True).stdout.strip()
+    except OSError:
+        commit = None
+    return {"commit": commit or None, "python": platform.python_version(), "platform": platform.platform(),
+            "date": time.strftime("%Y-%m-%dT%H:%M:%S")}
+
+
+def compare(results, baseline, threshold=0.2, min_delta=0.001):
+    """
+    Compare the results of a run with a previous one.
+
+    Parameters:
+        results (dict): The benchmarks of this run, see run_suite.
+        baseline (dict): The benchmarks of the previous run.
+        threshold (float, optional): The relative slowdown flagged as a regression. Defaults to 0.2, 20%.
+        min_delta (float, optional): Slowdowns of less than this many seconds are ignored as noise.
+
+    Returns:
+        dict: {benchmark: {"baseline": s, "current": s, "change": ratio, "regression": bool}}, using the best
+            times. A benchmark which failed in this run, but not in the baseline, is a regression.
+    """
+    comparison = {}
+    for name, result in results.items():
+        previous = baseline.get(name)
+        if previous is None or "error" in previous:
+            continue
+        if "error" in result:
+            comparison[name] = {"baseline": previous["best"], "current": None, "change": None, "regression": True}
+            continue
+        change = result["best"] / previous["best"] - 1 if previous["best"] else 0.0
+        regression = change > threshold and result["best"] - previous["best"] > min_delta
+        comparison[name] = {"baseline": previous["best"], "current": result["best"], "change": change,
+                            "regression": regression}
+    return comparison
+
+
+def print_results(results, comparison=None):
+    comparison = comparison or {}
+    for name, result in results.items():
+        if "error" in result:
+            line = f"{name:36s} failed: {result['error']}"
+        else:
+            line = f"{name:36s} {result['best'] * 1000:10.2f} ms (median {result['median'] * 1000:.2f} ms)"
+        if result.get("source") == "transcribed":
+            line += "  [transcribed response]"
+        changed = comparison.get(name)
+        if changed is not None and changed["change"] is not None:
+            line += f"  {changed['change']:+.0%}"
+        if changed is not None and changed["regression"]:
+            line += "  REGRESSION"
+        print(line)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 10000])
+    arg_parser.add_argument("--density", type=float, default=1.5, help="Connections per component")
+    arg_parser.add_argument("--repeat", type=int, default=3, help="The best and median of this many runs are kept")
+    arg_parser.add_argument("--tokens-per-second", type=float, default=float("inf"),
+                            help="Rate of the replayed responses. No delay by default")
+    arg_parser.add_argument("--output", default=None, help="Write the results to this JSON file")
+    arg_parser.add_argument("--compare", default=None, metavar="BASELINE", help="The JSON file of a previous run")
+    arg_parser.add_argument("--threshold", type=float, default=0.2, help="Relative slowdown flagged as a regression")
+    args = arg_parser.parse_args()
+
+    results = run_suite(args.sizes, args.density, args.repeat, args.tokens_per_second)
+
+    comparison = None
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        comparison = compare(results, baseline["results"], args.threshold)
+    print_results(results, comparison)
+
+    if args.output is not None:
+        report = {"environment": environment(), "settings": {"sizes": args.sizes, "density": args.density,
+                  "repeat": args.repeat,
+                  # None for no delay, JSON has no infinity
+                  "tokens_per_second": args.tokens_per_second if args.tokens_per_second != float("inf") else None}, "results": results}
+        if comparison is not None:
+            report["comparison"] = {"baseline": args.compare, "threshold": args.threshold, "benchmarks": comparison}
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+
+    regressions = [name for name, changed in (comparison or {}).items() if changed["regression"]]
+    if regressions:
+        print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+    sys.exit(1 if regressions else 0)
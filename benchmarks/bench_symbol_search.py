@@ -0,0 +1,75 @@
+# Benchmark of the fuzzy symbol search.
+# Compares the indexed SymbolIndex against the brute-force Levenshtein scan on the
+# stock catalogue (~20k symbols) and on a synthetic catalogue 10 times as large.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_symbol_search [--symbol-data symbol_data.json]
+
+import argparse
+import json
+import time
+
+import Levenshtein
+
+from scripts.symbol_index import SymbolIndex
+
+QUERIES = ["resistor", "capacitor", "npn transistor", "led", "battery", "switch", "diode",
+           "potentiometer", "inductor", "op amp", "LM358", "NE555", "crystal", "fuse",
+           "mosfet", "zener", "speaker", "relay", "ATmega328P", "usb connector"]
+
+
+def scan_closest_matches(term, symbol_data, top_n=3):
+    """Reference implementation: the full scan used by symbol_search.find_closest_matches."""
+    matches = []
+    for lib_data in symbol_data["symbols"]:
+        for symbol in lib_data["symbols"]:
+            matches.append((lib_data["lib"], symbol, Levenshtein.distance(term.lower(), symbol.lower())))
+    matches.sort(key=lambda x: x[2])
+    return [f"{match[0]}:{match[1]}" for match in matches[:top_n]]
+
+
+def scale_symbol_data(symbol_data, factor):
+    """Create a synthetic catalogue `factor` times larger by adding suffixed copies of each library."""
+    libs = list(symbol_data["symbols"])
+    for copy_index in range(1, factor):
+        for lib_data in symbol_data["symbols"]:
+            libs.append({"lib": f"{lib_data['lib']}_{copy_index}",
+                         "symbols": [f"{symbol}_V{copy_index}" for symbol in lib_data["symbols"]]})
+    return {"symbols": libs}
+
+
+def run(symbol_data, label):
+    symbol_count = sum(len(lib_data["symbols"]) for lib_data in symbol_data["symbols"])
+
+    start = time.perf_counter()
+    index = SymbolIndex(symbol_data)
+    build_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed_results = [index.find_closest_matches(query) for query in QUERIES]
+    indexed_time = (time.perf_counter() - start) / len(QUERIES)
+
+    start = time.perf_counter()
+    scan_results = [scan_closest_matches(query, symbol_data) for query in QUERIES]
+    scan_time = (time.perf_counter() - start) / len(QUERIES)
+
+    mismatches = [query for query, a, b in zip(QUERIES, indexed_results, scan_results) if a != b]
+
+    print(f"{label}: {symbol_count} symbols, index build {build_time * 1000:.0f} ms")
+    print(f"  scan:    {scan_time * 1000:8.2f} ms/query")
+    print(f"  indexed: {indexed_time * 1000:8.2f} ms/query ({scan_time / indexed_time:.1f}x)")
+    print(f"  identical results: {'yes' if not mismatches else 'NO ' + str(mismatches)}")
+    return not mismatches
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--symbol-data", default="symbol_data.json")
+    args = arg_parser.parse_args()
+
+    with open(args.symbol_data, "r") as f:
+        data = json.load(f)
+
+    ok = run(data, "stock catalogue")
+    ok = run(scale_symbol_data(data, 10), "synthetic catalogue (10x)") and ok
+    raise SystemExit(0 if ok else 1)
@@ -0,0 +1,127 @@
+# Offline check and benchmark of the tiled conversion mode (scripts/tiling.py).
+# Builds a synthetic sheet, cuts it into tiles and produces the canned response each tile would get
+# (parts inside the tile, numbered from 1 in every tile, with positions in percent of the tile and a few
+# pixels of noise). merge_tile_results must give back the parts and connections of the sheet. The tiles
+# are then "converted" by a fake model with a random latency, concurrently and one after the other.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_tiling [--parts 16] [--rows 3] [--cols 3] [--latency 0.5]
+
+import argparse
+import math
+import random
+import time
+
+from scripts import tiling
+
+LIB_IDS = [("resistor", "R"), ("capacitor", "C"), ("led", "D")]
+PITCH = 120
+
+
+def synthetic_sheet(parts_per_side, seed=0):
+    """A grid of parts, each connected to its right and lower neighbours."""
+    rng = random.Random(seed)
+    parts = []
+    for row in range(parts_per_side):
+        for col in range(parts_per_side):
+            lib_id, prefix = rng.choice(LIB_IDS)
+            parts.append({"lib_id": lib_id, "prefix": prefix, "x": 60 + col * PITCH, "y": 60 + row * PITCH,
+                          "grid": (col, row), "angle": rng.choice([0, 90])})
+    connections = []
+    for i, part in enumerate(parts):
+        col, row = part["grid"]
+        if col + 1 < parts_per_side:
+            connections.append((i, 2, i + 1, 1))
+        if row + 1 < parts_per_side:
+            connections.append((i, 1, i + parts_per_side, 2))
+    size = 2 * 60 + (parts_per_side - 1) * PITCH
+    return parts, connections, size
+
+
+def canned_tile_response(parts, connections, box, rng, noise=3):
+    left, top, right, bottom = box
+    width, height = right - left, bottom - top
+    # A part is seen by the tile when its body (about 40 pixels) is inside it
+    visible = [i for i, part in enumerate(parts)
+               if left + 20 <= part["x"] <= right - 20 and top + 20 <= part["y"] <= bottom - 20]
+    rng.shuffle(visible)
+    counters = {}
+    local_references = {}
+    components = []
+    for i in visible:
+        part = parts[i]
+        counters[part["prefix"]] = counters.get(part["prefix"], 0) + 1
+        local_references[i] = f"{part['prefix']}{counters[part['prefix']]}"
+        x = part["x"] - left + rng.uniform(-noise, noise)
+        y = part["y"] - top + rng.uniform(-noise, noise)
+        components.append({"lib_id": part["lib_id"], "x": round(100 * x / width, 1), "y": round(100 * y / height, 1),
+                           "angle": part["angle"], "reference": local_references[i], "value": ""})
+    tile_connections = [{"A_ref": local_references[a], "A_pin": a_pin, "B_ref": local_references[b], "B_pin": b_pin}
+                        for a, a_pin, b, b_pin in connections if a in local_references and b in local_references]
+    return {"detected_components": components, "component_connections": tile_connections}
+
+
+def check_merge(parts, connections, result):
+    """Match the merged components to the parts of the sheet by their grid position."""
+    by_grid = {part["grid"]: i for i, part in enumerate(parts)}
+    part_of_reference = {}
+    misplaced = 0
+    for component in result["detected_components"]:
+        i = by_grid.get((component["x"], component["y"]))
+        if i is None or parts[i]["lib_id"] != component["lib_id"]:
+            misplaced += 1
+        else:
+            part_of_reference[component["reference"]] = i
+    expected = {frozenset([(a, a_pin), (b, b_pin)]) for a, a_pin, b, b_pin in connections}
+    found = {frozenset([(part_of_reference.get(c["A_ref"]), c["A_pin"]), (part_of_reference.get(c["B_ref"]), c["B_pin"])])
+             for c in result["component_connections"]}
+    return misplaced, len(expected & found), len(expected), len(found - expected)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--parts", type=int, default=16, help="Parts per side of the synthetic sheet")
+    arg_parser.add_argument("--rows", type=int, default=3)
+    arg_parser.add_argument("--cols", type=int, default=3)
+    arg_parser.add_argument("--overlap", type=float, default=tiling.DEFAULT_OVERLAP)
+    arg_parser.add_argument("--latency", type=float, default=0.5, help="Mean latency of the fake model, in seconds")
+    args = arg_parser.parse_args()
+
+    rng = random.Random(1)
+    parts, connections, size = synthetic_sheet(args.parts)
+    boxes = tiling.tile_boxes(size, size, args.rows, args.cols, args.overlap)
+    tile_results = [canned_tile_response(parts, connections, box, rng) for box in boxes]
+
+    start = time.perf_counter()
+    result, report = tiling.merge_tile_results(tile_results, boxes)
+    merge_time = time.perf_counter() - start
+    misplaced, connections_found, connections_expected, extra = check_merge(parts, connections, result)
+    print(f"sheet {size}x{size} px, {len(parts)} parts, {len(connections)} connections, {len(boxes)} tiles")
+    print(f"merge: {merge_time * 1000:.1f} ms, {report['tile_components']} tile parts -> {report['components']} "
+          f"components ({len(parts)} expected, {misplaced} misplaced), connections {connections_found}/"
+          f"{connections_expected} recovered, {extra} wrong")
+    # Connections between parts which never share a tile cannot be seen by any tile
+    shared = sum(1 for a, _, b, _ in connections
+                 if any(box[0] + 20 <= parts[a]["x"] <= box[2] - 20 and box[1] + 20 <= parts[a]["y"] <= box[3] - 20
+                        and box[0] + 20 <= parts[b]["x"] <= box[2] - 20 and box[1] + 20 <= parts[b]["y"] <= box[3] - 20
+                        for box in boxes))
+    print(f"  {shared} of the connections have both parts in one tile")
+
+    # Wall-clock time of the tile calls with a fake model
+    latencies = [args.latency * rng.uniform(0.5, 1.5) for _ in boxes]
+
+    def fake_convert(prepared_image):
+        time.sleep(latencies[prepared_image])
+        return tile_results[prepared_image]
+
+    tiles = [(box, i) for i, box in enumerate(boxes)]
+    start = time.perf_counter()
+    tiling.convert_tiles(tiles, fake_convert)
+    concurrent_time = time.perf_counter() - start
+    start = time.perf_counter()
+    tiling.convert_tiles(tiles, fake_convert, max_workers=1)
+    sequential_time = time.perf_counter() - start
+    print(f"tile calls: concurrent {concurrent_time:.2f} s (slowest tile {max(latencies):.2f} s), "
+          f"one after the other {sequential_time:.2f} s")
+    if math.isclose(concurrent_time, max(latencies), rel_tol=0.2):
+        print("  wall-clock time follows the slowest tile")
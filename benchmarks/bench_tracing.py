@@ -0,0 +1,93 @@
+# Benchmark of the tracing layer (scripts/tracing.py).
+# Measures the cost of a span when tracing is off and on, then converts a canned response with a local fake
+# chat model (see scripts/fake_llm.py) and writes its schematic with tracing on, and prints the spans recorded
+# per stage, and the Prometheus metrics. The trace files are written to a temporary directory.
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_tracing [--components 24] [--spans 200000]
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.bench_streaming import canned_response
+from scripts import tracing
+from scripts.fake_llm import FakeChatModel
+from scripts.image_to_schematic import get_json_from_image_streaming, write_schematic
+from scripts.symbol_library import symbol_library_cache
+
+
+def span_cost(count):
+    """Seconds per span with a counter, as instrumented code uses them, without the cost of the loop."""
+    start = time.perf_counter()
+    for _ in range(count):
+        pass
+    loop = time.perf_counter() - start
+    start = time.perf_counter()
+    for _ in range(count):
+        with tracing.span("stage") as span:
+            span.add("items", 1)
+    return (time.perf_counter() - start - loop) / count
+
+
+def convert(model, image_path, schematic_path):
+    symbol_library_cache.clear()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = get_json_from_image_streaming(image_path, use_cache=False, model=model)
+        write_schematic(result, schematic_path, create=True)
+    return result
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--components", type=int, default=24)
+    arg_parser.add_argument("--spans", type=int, default=200000)
+    arg_parser.add_argument("--image", default="testImages/image.png")
+    args = arg_parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        jsonl_path = os.path.join(directory, "traces.jsonl")
+        prometheus_path = os.path.join(directory, "metrics.prom")
+
+        tracing.disable()
+        off = span_cost(args.spans)
+        tracing.enable(None, None)
+        in_memory = span_cost(args.spans // 10)
+        tracing.enable(os.path.join(directory, "overhead.jsonl"), None)
+        logged = span_cost(args.spans // 10)
+        tracing.disable()
+        print(f"span cost: off {off * 1e9:.0f} ns, on {in_memory * 1e6:.1f} us (totals only), "
+              f"{logged * 1e6:.1f} us (with the JSON-lines log)")
+
+        model = FakeChatModel(response=canned_response(args.components))
+        schematic_path = os.path.join(directory, "bench.kicad_sch")
+        start = time.perf_counter()
+        convert(model, args.image, schematic_path)
+        untraced = time.perf_counter() - start
+
+        tracer = tracing.enable(jsonl_path, prometheus_path)
+        start = time.perf_counter()
+        convert(model, args.image, schematic_path)
+        traced = time.perf_counter() - start
+        tracing.disable()
+        print(f"conversion of {args.components} components: {untraced * 1000:.1f} ms untraced, "
+              f"{traced * 1000:.1f} ms traced")
+
+        print(f"{'stage':22s} {'calls':>5s} {'ms':>8s}  counters")
+        for name, stage in sorted(tracer.stages.items(), key=lambda item: -item[1]["seconds"]):
+            counters = ", ".join(f"{counter}={value}" for counter, value in sorted(stage["counters"].items()))
+            print(f"{name:22s} {stage['count']:5d} {stage['seconds'] * 1000:8.2f}  {counters}")
+
+        with open(jsonl_path) as f:
+            spans = [json.loads(line) for line in f]
+        nested = sum(1 for span in spans if span["parent_id"] is not None)
+        print(f"{len(spans)} spans in the JSON-lines file, {nested} nested in another span")
+        with open(prometheus_path) as f:
+            lines = [line for line in f if not line.startswith("#")]
+        print(f"{len(lines)} Prometheus samples, eg:")
+        for line in lines[:4]:
+            print("  " + line.rstrip())
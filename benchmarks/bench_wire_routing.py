@@ -0,0 +1,148 @@
+# Benchmark of the connection stage of add_wires_to_schematic.
+# Builds a synthetic sheet and compares wire_routing (pin locations computed from the symbol definitions
+# of the document, one pass over the connections) with loading the written file with kicad-skip, and
+# with the previous nested symbol x connection x symbol scan over the kicad-skip schematic.
+# Also times route_connections alone on a synthetic pin table.
+# Needs configuration.yaml and the KiCad symbol library (Device.kicad_sym).
+#
+# Usage (from the repository root):
+#   python -m benchmarks.bench_wire_routing [--components 500] [--nets 2000]
+
+import argparse
+import contextlib
+import io
+import os
+import random
+import tempfile
+import time
+
+import skip
+
+import scripts.kicad_utils as kicad_utils
+import scripts.wire_routing as wire_routing
+
+LIB_IDS = ["Device:R", "Device:C", "Device:LED"]
+
+
+def synthetic_sheet(component_count, net_count, seed=0):
+    rng = random.Random(seed)
+    # kicad-skip rotates pins the other way round for 90 and 270 degrees, so the wires are only
+    # comparable for 0 and 180 degrees
+    components = [{"lib_id": LIB_IDS[i % len(LIB_IDS)], "x": 20 + (i % 25) * 10, "y": 20 + (i // 25) * 10,
+                   "angle": 180 * (i % 2), "reference_name": f"U{i + 1}", "value": "1k"}
+                  for i in range(component_count)]
+    connections = []
+    for _ in range(net_count):
+        a, b = rng.sample(range(component_count), 2)
+        connections.append({"A_ref": f"U{a + 1}", "A_pin": rng.randint(1, 2),
+                            "B_ref": f"U{b + 1}", "B_pin": rng.randint(1, 2)})
+    return components, connections
+
+
+def index_skip_schematic(skip_schematic):
+    """
+    Index the symbols of a kicad-skip schematic and the locations of their pins, the reference the pin locations
+    computed by wire_routing.index_document are compared with.
+
+    Parameters:
+        skip_schematic (skip.Schematic): The schematic.
+
+    Returns:
+        tuple: ({reference: symbol}, {(reference, pin number): (x, y)}, {(reference, pin number): error}).
+            Pin numbers are strings, as in the symbol library. When several symbols share a reference,
+            the first one is used.
+    """
+    symbols_by_reference = {}
+    pin_locations = {}
+    pin_errors = {}
+    for symbol in skip_schematic.symbol:
+        reference = symbol.property.Reference.value
+        if reference in symbols_by_reference:
+            continue
+        symbols_by_reference[reference] = symbol
+        for pin in symbol.pin:
+            key = (reference, str(pin.number))
+            try:
+                location = pin.location
+                pin_locations[key] = (location.x, location.y)
+            except Exception as e:
+                pin_errors[key] = f"{type(e).__name__}: {e}"
+    return symbols_by_reference, pin_locations, pin_errors
+
+
+def legacy_route(schem, connections):
+    """The connection stage as it was: nested scans, a linear search for B, and a bare except."""
+    def find_component_in_schem(component_reference, skip_schematic):
+        for symbol in skip_schematic.symbol:
+            if symbol.property.Reference.value == component_reference:
+                return symbol
+
+    wire_list = []
+    skipped = 0
+    for curr_component in schem.symbol:
+        curr_component_ref = curr_component.property.Reference.value
+        for curr_connection in connections:
+            if curr_connection['A_ref'] == curr_component_ref:
+                try:
+                    curr_component_A_pin = curr_component.pin[curr_connection['A_pin'] - 1]
+                    curr_component_B = find_component_in_schem(curr_connection['B_ref'], schem)
+                    curr_component_B_pin = curr_component_B.pin[curr_connection['B_pin'] - 1]
+                    wire_list.append({"x": curr_component_A_pin.location.x, "y": curr_component_A_pin.location.y,
+                                      "end_x": curr_component_B_pin.location.x, "end_y": curr_component_B_pin.location.y})
+                except:
+                    skipped += 1
+    return wire_list, skipped
+
+
+def wire_keys(wires):
+    return sorted((w["x"], w["y"], w["end_x"], w["end_y"]) for w in wires)
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--components", type=int, default=500)
+    arg_parser.add_argument("--nets", type=int, default=2000)
+    arg_parser.add_argument("--skip-legacy", action="store_true", help="Do not time the previous implementation")
+    args = arg_parser.parse_args()
+
+    components, connections = synthetic_sheet(args.components, args.nets)
+
+    # Pin table only: the routing pass itself
+    pin_locations = {(f"U{i + 1}", pin): (float(i), float(pin)) for i in range(args.components) for pin in ("1", "2")}
+    references = {f"U{i + 1}" for i in range(args.components)}
+    start = time.perf_counter()
+    wires, diagnostics = wire_routing.route_connections(connections, references, pin_locations)
+    print(f"route_connections, {args.components} components + {args.nets} nets: "
+          f"{(time.perf_counter() - start) * 1000:.2f} ms ({len(wires)} wires)")
+
+    with tempfile.TemporaryDirectory() as directory:
+        document = kicad_utils.load_kicad_sch_document()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for component in components:
+                kicad_utils.add_component_to_document(document, component)
+            schematic_path = kicad_utils.save_kicad_sch_document(document, os.path.join(directory, "bench.kicad_sch"))
+
+        start = time.perf_counter()
+        references, pin_locations, pin_errors = wire_routing.index_document(document)
+        index_time = time.perf_counter() - start
+        start = time.perf_counter()
+        wires, diagnostics = wire_routing.route_connections(connections, references, pin_locations, pin_errors)
+        route_time = time.perf_counter() - start
+        print(f"wire_routing on the document: index {index_time * 1000:.1f} ms + route {route_time * 1000:.2f} ms "
+              f"({len(wires)} wires, {len(diagnostics)} skipped)")
+
+        start = time.perf_counter()
+        schem = skip.Schematic(schematic_path)
+        print(f"skip.Schematic load: {time.perf_counter() - start:.3f} s")
+        start = time.perf_counter()
+        symbols_by_reference, skip_pin_locations, skip_pin_errors = index_skip_schematic(schem)
+        skip_wires, _ = wire_routing.route_connections(connections, symbols_by_reference, skip_pin_locations,
+                                                       skip_pin_errors)
+        print(f"wire_routing on the kicad-skip schematic: {(time.perf_counter() - start) * 1000:.1f} ms, "
+              f"same wires: {wire_keys(wires) == wire_keys(skip_wires)}")
+
+        if not args.skip_legacy:
+            start = time.perf_counter()
+            legacy_wires, legacy_skipped = legacy_route(schem, connections)
+            print(f"nested scans: {time.perf_counter() - start:.3f} s ({len(legacy_wires)} wires, {legacy_skipped} skipped)")
+            print("same wires:", wire_keys(wires) == wire_keys(legacy_wires))
@@ -1,38 +1,98 @@
+import math
 import sys
 
 
-from PyQt6.QtWidgets import (QApplication, QWidget, QLabel, QVBoxLayout, QPushButton, QFileDialog, QCheckBox, QTextEdit, QComboBox, QTableWidget,
-                             QTableWidgetItem, QCompleter)
-from PyQt6.QtCore import Qt
-import json
+from PyQt6.QtWidgets import (QApplication, QWidget, QLabel, QVBoxLayout, QHBoxLayout, QPushButton, QFileDialog, QCheckBox, QTextEdit, QComboBox, QTableWidget,
+                             QTableWidgetItem, QCompleter, QListWidget, QListWidgetItem, QStyledItemDelegate, QAbstractItemView)
+from PyQt6.QtCore import Qt, QStringListModel, QTimer, pyqtSignal
 from PyQt6.QtWidgets import QSpacerItem, QSizePolicy
-from scripts.image_to_schematic import create_kicad_sch_file, get_json_from_image, get_json_from_image_and_text, get_json_from_text, add_components_to_schematic, add_wires_to_schematic
-import time
+from scripts.image_to_schematic import get_json_from_image_streaming, get_json_from_image_and_text, get_json_from_text, write_schematic
+from scripts.symbol_search import symbol_search
+from scripts.conversion_result import ConversionResult
+from gui.workers import FAILED, JobQueue
+from collections import deque
+import os
 import threading
+import time
 import uuid
 
+# Model calls run concurrently, schematic writes one at a time, as several jobs can add to the same file
+MAX_CONCURRENT_CONVERSIONS = 2
+# The result being reviewed is saved here once it has been edited
+REVIEW_JSON_PATH = 'result.json'
+
+
+# Edits made in the component editor within this delay are saved in one write
+SAVE_DELAY_MS = 500
+# The component key shown in each column of the component editor, and how its text is read back.
+# Lib ID GPT is the name given by the model, shown for reference only
+EDITOR_COLUMNS = [('lib_id', str), ('lib_id_gpt', None), ('reference', str), ('value', str), ('x', 'number'), ('y', 'number')]
+
+# Completions shown while typing a lib_id, the whole catalogue can still be browsed in the drop-down list
+MAX_COMPLETIONS = 200
+LIB_ID_COLUMN = 0
+
 
-class CustomCompleter(QCompleter):
-    def __init__(self, items, parent=None):
-        super().__init__(items, parent)
-        self.setFilterMode(Qt.MatchFlag.MatchContains)
+class LibIdCompleter(QCompleter):
+    # Completes the lib_ids containing the typed text, found with the substring index of the catalogue
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setModel(QStringListModel(self))
+        self.setCompletionMode(QCompleter.CompletionMode.UnfilteredPopupCompletion)
         self.setCaseSensitivity(Qt.CaseSensitivity.CaseInsensitive)
 
-    def splitPath(self, path):
-        pattern = path.lower()
-        matches = [x for x in self.model().stringList()
-                   if pattern in x.lower()]
-        return matches
+    def update_completions(self, text):
+        self.model().setStringList(symbol_search.find_containing(text, MAX_COMPLETIONS) if text else [])
+        if text:
+            self.complete()
+
+
+class LibIdDelegate(QStyledItemDelegate):
+    # The lib_id combo box is only created for the cell being edited, over the catalogue model shared by all rows
+    def __init__(self, lib_id_model, parent=None):
+        super().__init__(parent)
+        self.lib_id_model = lib_id_model
+
+    def createEditor(self, parent, option, index):
+        combo = QComboBox(parent)
+        combo.setEditable(True)
+        combo.setInsertPolicy(QComboBox.InsertPolicy.NoInsert)
+        # Sizing the combo box to its contents would measure every symbol name
+        combo.setSizeAdjustPolicy(QComboBox.SizeAdjustPolicy.AdjustToMinimumContentsLengthWithIcon)
+        combo.view().setUniformItemSizes(True)
+        combo.setModel(self.lib_id_model)
+        completer = LibIdCompleter(combo)
+        combo.lineEdit().setCompleter(completer)
+        combo.lineEdit().textEdited.connect(completer.update_completions)
+        combo.activated.connect(lambda index, combo=combo: self.commitData.emit(combo))
+        return combo
+
+    def setEditorData(self, editor, index):
+        editor.setCurrentText(index.data())
+
+    def setModelData(self, editor, model, index):
+        model.setData(index, editor.currentText())
 
 
 class ComponentEditor(QWidget):
+    # Emitted when the editor is closed without Continue, eg: with the window's close button
+    dismissed = pyqtSignal()
+
     def __init__(self, main_window_make_schematic):
         super().__init__()
         self.initUI()
-        self.data = []  # To store the JSON data
+        self.continuing = False
+        self.data = None  # The ConversionResult being edited
+        self.save_path = None  # Where the edits are saved, if anywhere
+        self.dirty_rows = set()
         self.main_window_make_schematic = main_window_make_schematic
-        self.json_filepath = ""
         self.items = []
+        self.lib_id_model = None
+        # Restarted by every edit, the edits are saved when it runs out
+        self.save_timer = QTimer(self)
+        self.save_timer.setSingleShot(True)
+        self.save_timer.setInterval(SAVE_DELAY_MS)
+        self.save_timer.timeout.connect(self.flush)
 
     def initUI(self):
         self.setWindowTitle('Component Editor')
@@ -50,6 +110,8 @@ class ComponentEditor(QWidget):
         self.table.setColumnWidth(3, 100)
         self.table.setColumnWidth(4, 50)
         self.table.setColumnWidth(5, 50)
+        self.table.setEditTriggers(self.table.editTriggers() | QAbstractItemView.EditTrigger.SelectedClicked)
+        self.table.itemChanged.connect(self.on_item_changed)
         layout.addWidget(self.table)
 
         # Create and configure the Continue button
@@ -60,60 +122,100 @@ class ComponentEditor(QWidget):
         self.setLayout(layout)
 
     def on_continue_clicked(self):
-        self.main_window_make_schematic()
+        # The cell being edited is part of the result too
+        editor = self.table.indexWidget(self.table.currentIndex())
+        if editor is not None:
+            self.table.commitData(editor)
+            self.table.closeEditor(editor, QStyledItemDelegate.EndEditHint.NoHint)
+        # Closed first, the main window shows the next result waiting for review in it
+        self.continuing = True
         self.close()
+        self.continuing = False
+        self.main_window_make_schematic()
         # print("self.main_window_make_schematic()")
 
-    def load_symbols(self, filepath):
-        with open(filepath, 'r') as file:
-            symbol_data = json.load(file)
-            for library in symbol_data['symbols']:
-                for symbol in library['symbols']:
-                    self.items.append(f"{library['lib']}:{symbol}")
-        self.items.sort()
-
-    def load_component_data(self):
-        filepath = 'result.json'
-        with open(filepath, 'r') as file:
-            self.data = json.load(file)
-        self.json_filepath = filepath
+    def closeEvent(self, event):
+        self.flush()
+        super().closeEvent(event)
+        if not self.continuing:
+            self.dismissed.emit()
+
+    def load_symbols(self):
+        # Shared with the lib_id search, so the catalogue is loaded and sorted once per process
+        self.items = symbol_search.sorted_lib_ids()
+        self.lib_id_model = QStringListModel(self.items, self)
+        self.table.setItemDelegateForColumn(LIB_ID_COLUMN, LibIdDelegate(self.lib_id_model, self.table))
+        # The completion index is built in the background, before the first lib_id is typed
+        threading.Thread(target=lambda: symbol_search.substring_index, daemon=True).start()
+
+    def load_component_data(self, result, save_path=None):
+        """
+        Show a result in the table. Edits are made on the result itself, which make_schematic then uses.
+
+        Parameters:
+            result (ConversionResult): The result to edit.
+            save_path (str, optional): Where to save the edited result as JSON. Nothing is written by default.
+        """
+        self.flush()
+        self.data = result
+        self.save_path = save_path
         components = self.data['detected_components']
         if not self.items:  # Load symbols if not already loaded
-            self.load_symbols('symbol_data.json')
-        self.items.sort()
+            self.load_symbols()
+        # Filling the table is not an edit
+        self.table.blockSignals(True)
         self.table.setRowCount(len(components))
         for row, component in enumerate(components):
-            # Adjust the order of items based on the new header
-            self.table.setItem(row, 0, QTableWidgetItem(component['lib_id']))
-            self.table.setItem(
-                row, 1, QTableWidgetItem(component['lib_id_gpt']))
-            self.table.setItem(
-                row, 2, QTableWidgetItem(component['reference']))
-            self.table.setItem(row, 3, QTableWidgetItem(component['value']))
-            self.table.setItem(row, 4, QTableWidgetItem(str(component['x'])))
-            self.table.setItem(row, 5, QTableWidgetItem(str(component['y'])))
-
-            # Lib ID is now the first column, so we need to adjust the combo box setup
-            combo = QComboBox()
-            combo.setEditable(True)
-            completer = CustomCompleter(self.items)
-            combo.setCompleter(completer)
-            combo.addItems(self.items)
-            combo.setCurrentText(component['lib_id'])
-            combo.currentIndexChanged.connect(
-                lambda index, row=row, combo=combo: self.update_lib_id(row, combo.currentText()))
-            # Set combo in the first column for Lib ID
-            self.table.setCellWidget(row, 0, combo)
-
-    def update_lib_id(self, row, value):
-        # Update in-memory JSON data
-        self.data['detected_components'][row]['lib_id'] = value
-        print(f"Updated lib_id for row {row} to {value}")
-        self.save_json(self.json_filepath)
+            # Lib ID is the first column, edited with LibIdDelegate
+            for column, (key, parse) in enumerate(EDITOR_COLUMNS):
+                item = QTableWidgetItem(str(component[key]))
+                if parse is None:
+                    item.setFlags(item.flags() & ~Qt.ItemFlag.ItemIsEditable)
+                self.table.setItem(row, column, item)
+        self.table.blockSignals(False)
+
+    def on_item_changed(self, item):
+        row, (key, parse) = item.row(), EDITOR_COLUMNS[item.column()]
+        component = self.data['detected_components'][row]
+        try:
+            value = parse_number(item.text()) if parse == 'number' else parse(item.text())
+        except ValueError:
+            print(f"Invalid {key} for row {row}: {item.text()!r}")
+            self.table.blockSignals(True)
+            item.setText(str(component[key]))
+            self.table.blockSignals(False)
+            return
+        if value == component[key]:
+            return
+        # Update the in-memory result, it is saved once the edits stop
+        component[key] = value
+        self.dirty_rows.add(row)
+        self.save_timer.start()
+
+    def flush(self):
+        """Save the pending edits now, in one write."""
+        self.save_timer.stop()
+        if not self.dirty_rows:
+            return
+        if self.save_path is not None:
+            self.data.save(self.save_path)
+            print(f"Saved {len(self.dirty_rows)} edited rows to {self.save_path}")
+        self.dirty_rows.clear()
 
     def save_json(self, filepath):
-        with open(filepath, 'w') as file:
-            json.dump(self.data, file, indent=4)
+        self.data.save(filepath)
+
+
+def parse_number(text):
+    # Coordinates keep their type: grid units are integers, some models answer with floats
+    try:
+        return int(text)
+    except ValueError:
+        value = float(text)
+    # float() also reads nan and inf, which are no position on the sheet
+    if not math.isfinite(value):
+        raise ValueError(f"{text} is not a finite number")
+    return value
 
 
 class Image2KiCAD(QWidget):
@@ -122,10 +224,27 @@ class Image2KiCAD(QWidget):
         self.initUI()
         self.image_path = None
         self.kicad_schematic_path = None
+        self.result = None
+        # Conversions are queued from the Run button, their results wait here to be reviewed in the editor
+        self.conversions = JobQueue(max_workers=MAX_CONCURRENT_CONVERSIONS, parent=self)
+        self.writes = JobQueue(max_workers=1, parent=self)
+        self.job_items = {}
+        self.reviews = deque()
+        self.review = None
+        self.last_written = None
+        for queue in (self.conversions, self.writes):
+            queue.started.connect(lambda job_id: self.set_job_status(job_id, 'running'))
+            queue.progress.connect(self.set_job_status)
+            queue.error.connect(self.on_job_error)
+            queue.cancelled.connect(lambda job_id: self.set_job_status(job_id, 'cancelled'))
+            queue.finished.connect(self.on_job_finished)
+        self.conversions.result.connect(self.on_conversion_done)
+        self.writes.result.connect(self.on_schematic_written)
 
         # Initializing the editor here
         self.editor = ComponentEditor(
             main_window_make_schematic=self.make_schematic)
+        self.editor.dismissed.connect(self.on_review_dismissed)
         self.containsTextPrompt = False
 
     def initUI(self):
@@ -203,6 +322,21 @@ class Image2KiCAD(QWidget):
         self.append_button.setEnabled(False)
         layout.addWidget(self.append_button)
 
+        # Queued and running jobs
+        self.jobs_label = QLabel('Jobs:')
+        layout.addWidget(self.jobs_label)
+        self.jobs_list = QListWidget()
+        self.jobs_list.setMaximumHeight(120)
+        layout.addWidget(self.jobs_list)
+        jobs_buttons = QHBoxLayout()
+        self.cancel_button = QPushButton('Cancel Selected')
+        self.cancel_button.clicked.connect(self.cancel_selected_job)
+        jobs_buttons.addWidget(self.cancel_button)
+        self.cancel_all_button = QPushButton('Cancel All')
+        self.cancel_all_button.clicked.connect(self.cancel_all_jobs)
+        jobs_buttons.addWidget(self.cancel_all_button)
+        layout.addLayout(jobs_buttons)
+
         # # Add title
         # JSON2KiCad_title_label = QLabel('JSON2KiCAD')
         # JSON2KiCad_title_label.setStyleSheet(
@@ -291,27 +425,93 @@ class Image2KiCAD(QWidget):
             self.append_button.setEnabled(False)
 
     def append_to_schematic(self):
-        self.status_label.setText('Status: Processing...')
-        self.append_button.setEnabled(False)
-        # Start a new thread for processing
-        process_thread = threading.Thread(target=self.process_schematic)
-        process_thread.start()
-        process_thread.join()
-        # TODO: Open ComponentEditor.load_json('result.json')
-        self.editor.load_component_data()
+        # The inputs are read now, so they can be changed for the next job while this one is queued
+        image_path = self.image_path
+        prompt = self.input_prompt_field.toPlainText() if self.containsTextPrompt else None
+        settings = {
+            'kicad_schematic_path': None if self.new_schematic_checkbox.isChecked() else self.kicad_schematic_path,
+            'add_wires': self.addwires_checkbox.isChecked(),
+        }
+        description = os.path.basename(image_path) if image_path is not None else 'text prompt'
+        job = self.conversions.submit(
+            description, lambda job: self.process_schematic(job, image_path, prompt))
+        self.add_job_item(job, settings)
+        self.update_status()
+
+    def process_schematic(self, job, image_path, prompt):
+        # Runs on a worker thread: no widgets are used here, progress goes through the job signals
+        job.report('converting')
+        if (image_path is not None) and (prompt is None):
+            received = []
+
+            def on_component(component):
+                job.check_cancelled()
+                received.append(component)
+                job.report(f'{len(received)} components received')
+
+            return get_json_from_image_streaming(image_path, on_component=on_component)
+        elif (image_path is None) and (prompt is not None):
+            return get_json_from_text(prompt)
+        elif (image_path is not None) and (prompt is not None):
+            return get_json_from_image_and_text(image_path, prompt)
+
+    def add_job_item(self, job, settings=None):
+        item = QListWidgetItem()
+        item.setData(Qt.ItemDataRole.UserRole, job.id)
+        self.jobs_list.addItem(item)
+        self.job_items[job.id] = (item, job, settings)
+        self.set_job_status(job.id, 'queued')
+
+    def set_job_status(self, job_id, status):
+        if job_id in self.job_items:
+            item, job, _ = self.job_items[job_id]
+            item.setText(f'#{job_id} {job.description}: {status}')
+
+    def cancel_selected_job(self):
+        for item in self.jobs_list.selectedItems():
+            job_id = item.data(Qt.ItemDataRole.UserRole)
+            self.conversions.cancel(job_id) or self.writes.cancel(job_id)
+
+    def cancel_all_jobs(self):
+        self.conversions.cancel_all()
+        self.writes.cancel_all()
+
+    def on_job_error(self, job_id, message):
+        self.set_job_status(job_id, f'failed ({message})')
+        print(f"Job {job_id} failed: {message}")
+
+    def on_job_finished(self, job_id):
+        # Failed jobs stay listed with their error, the others are removed
+        item, job, _ = self.job_items.pop(job_id, (None, None, None))
+        if item is not None and job.state != FAILED:
+            self.jobs_list.takeItem(self.jobs_list.row(item))
+        self.update_status()
+
+    def on_conversion_done(self, job_id, result):
+        _, job, settings = self.job_items[job_id]
+        self.set_job_status(job_id, 'waiting for review')
+        self.reviews.append((job.description, result, settings))
+        self.show_next_review()
+
+    def show_next_review(self):
+        # One result at a time in the editor, the others wait for the current one to be continued
+        if self.review is not None or self.editor.isVisible() or not self.reviews:
+            return
+        self.review = self.reviews.popleft()
+        description, self.result, _ = self.review
+        self.editor.setWindowTitle(f'Component Editor - {description}')
+        self.editor.load_component_data(self.result, save_path=REVIEW_JSON_PATH)
         self.editor.show()
 
-    def process_schematic(self):
-        # Call your processing functions here
-        # For example:
-        if (self.image_path is not None) and (not self.containsTextPrompt):
-            gpt_result = get_json_from_image(self.image_path)
-        elif (self.image_path is None) and (self.containsTextPrompt):
-            gpt_result = get_json_from_text(
-                self.input_prompt_field.toPlainText())
-        elif (self.image_path is not None) and (self.containsTextPrompt):
-            gpt_result = get_json_from_image_and_text(
-                self.image_path, self.input_prompt_field.toPlainText())
+    def on_review_dismissed(self):
+        # Closing the editor without Continue drops the result being reviewed
+        if self.review is not None:
+            description, _, _ = self.review
+            print(f'Review of {description} closed, its schematic is not written')
+        self.review = None
+        self.update_status()
+        # The editor is still visible until its close event is done
+        QTimer.singleShot(0, self.show_next_review)
 
     # def json_to_kicad(self):
     #     curr_json_file, _ = QFileDialog.getOpenFileName(
@@ -323,22 +523,47 @@ class Image2KiCAD(QWidget):
     #                          args=(curr_json_file,)).start()
 
     def make_schematic(self):
-        # if new schematic is selected, create a new schematic
-        if self.new_schematic_checkbox.isChecked():
-            self.kicad_schematic_path = create_kicad_sch_file(
-                components=None, wires=None, new_file_name=None)
-
-        # Add components to schematic
-        schematic_path = add_components_to_schematic(
-            path_to_json='result.json', kicad_schematic_path=self.kicad_schematic_path)
+        if self.review is not None:
+            description, result, settings = self.review
+        else:
+            # A result opened from a JSON file, written with the current settings
+            description, result = 'result', self.result
+            settings = {
+                'kicad_schematic_path': None if self.new_schematic_checkbox.isChecked() else self.kicad_schematic_path,
+                'add_wires': self.addwires_checkbox.isChecked(),
+            }
+        self.review = None
+
+        # Add components and wires to the schematic in a single write
+        job = self.writes.submit(f'{description} schematic', lambda job: write_schematic(result, **settings))
+        self.add_job_item(job)
+        self.update_status()
+        self.show_next_review()
+
+    def on_schematic_written(self, job_id, written):
+        kicad_schematic_path, diagnostics = written
+        # Later jobs add to this schematic, unless a new one is asked for
+        self.kicad_schematic_path = self.last_written = kicad_schematic_path
+        self.update_status()
+
+    def update_status(self):
+        pending = self.conversions.pending() + self.writes.pending()
+        waiting = len(self.reviews) + (self.review is not None)
+        if pending or waiting:
+            self.status_label.setText(f'Status: Processing... {pending} jobs queued or running, {waiting} waiting for review')
+        elif self.last_written is not None:
+            self.status_label.setText(f'Status: Done. Created {self.last_written}')
+        else:
+            self.status_label.setText('Status: Idle')
 
-        if self.addwires_checkbox.isChecked():
-            add_wires_to_schematic(
-                path_to_json='result.json', kicad_schematic_path=self.kicad_schematic_path)
-        # Update status after processing completes
-        self.status_label.setText(
-            f'Status: Done. Created {self.kicad_schematic_path}')
-        self.append_button.setEnabled(True)
+    def closeEvent(self, event):
+        # Queued jobs are dropped, running ones stop at their next check or finish in the background
+        self.cancel_all_jobs()
+        # The results waiting for review are not shown anymore
+        self.editor.dismissed.disconnect(self.on_review_dismissed)
+        self.reviews.clear()
+        self.editor.close()
+        super().closeEvent(event)
 
     def select_json_file_editor(self):
         curr_json_file, _ = QFileDialog.getOpenFileName(
@@ -347,5 +572,7 @@ class Image2KiCAD(QWidget):
             self.open_component_editor(curr_json_file)
 
     def open_component_editor(self, json_filepath):
-        self.editor.load_json(json_filepath)
+        self.result = ConversionResult.load(json_filepath)
+        self.editor.setWindowTitle('Component Editor')
+        self.editor.load_component_data(self.result, save_path=json_filepath)
         self.editor.show()
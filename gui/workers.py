@@ -0,0 +1,161 @@
+# Background jobs for the GUI. The model calls and schematic writes run on a QThreadPool, and report back
+# to the GUI thread through signals, so the window stays responsive and several images can be queued.
+
+import itertools
+import threading
+
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class JobCancelled(Exception):
+    """Raised inside a job, by Job.check_cancelled, to stop it early."""
+
+
+class JobSignals(QObject):
+    # Every signal carries the id of the job. Connected slots of GUI objects run in the GUI thread
+    started = pyqtSignal(int)
+    progress = pyqtSignal(int, str)
+    result = pyqtSignal(int, object)
+    error = pyqtSignal(int, str)
+    cancelled = pyqtSignal(int)
+    finished = pyqtSignal(int)
+
+
+class Job(QRunnable):
+    """
+    A function run on a worker thread.
+
+    Parameters:
+        job_id (int): The id of the job, sent with every signal.
+        description (str): A short description, eg: the image being converted.
+        function (function): Called with the job, so it can report progress and check for cancellation. Its
+            return value is sent with the result signal.
+    """
+
+    def __init__(self, job_id, description, function):
+        super().__init__()
+        # The queue keeps the job until it is finished, so it can still be cancelled or taken off the pool
+        self.setAutoDelete(False)
+        self.id = job_id
+        self.description = description
+        self.function = function
+        self.state = QUEUED
+        self.signals = JobSignals()
+        self._cancel_event = threading.Event()
+
+    @property
+    def is_cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        """Ask the job to stop. A running job stops at its next check_cancelled, or its result is discarded."""
+        self._cancel_event.set()
+
+    def check_cancelled(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled()
+
+    def report(self, message):
+        self.signals.progress.emit(self.id, message)
+
+    def run(self):
+        if self.is_cancelled:
+            self.state = CANCELLED
+            self.signals.cancelled.emit(self.id)
+            self.signals.finished.emit(self.id)
+            return
+        self.state = RUNNING
+        self.signals.started.emit(self.id)
+        try:
+            result = self.function(self)
+            self.check_cancelled()
+        except JobCancelled:
+            self.state = CANCELLED
+            self.signals.cancelled.emit(self.id)
+        except Exception as e:
+            self.state = FAILED
+            self.signals.error.emit(self.id, f"{type(e).__name__}: {e}")
+        else:
+            self.state = DONE
+            self.signals.result.emit(self.id, result)
+        self.signals.finished.emit(self.id)
+
+
+class JobQueue(QObject):
+    """
+    Runs jobs on a thread pool of its own, in the order they were submitted.
+
+    Parameters:
+        max_workers (int, optional): The number of jobs run at the same time. Defaults to 1.
+        parent (QObject, optional): The Qt parent.
+    """
+
+    # Emitted for every job of the queue, with its id, as JobSignals
+    started = pyqtSignal(int)
+    progress = pyqtSignal(int, str)
+    result = pyqtSignal(int, object)
+    error = pyqtSignal(int, str)
+    cancelled = pyqtSignal(int)
+    finished = pyqtSignal(int)
+
+    _ids = itertools.count(1)
+
+    def __init__(self, max_workers=1, parent=None):
+        super().__init__(parent)
+        self.pool = QThreadPool(self)
+        self.pool.setMaxThreadCount(max_workers)
+        self.jobs = {}
+
+    def submit(self, description, function):
+        """
+        Queue a function.
+
+        Parameters:
+            description (str): A short description of the job.
+            function (function): Called with the Job on a worker thread, see Job.
+
+        Returns:
+            Job: The job. Its id is unique across all the queues.
+        """
+        job = Job(next(self._ids), description, function)
+        for name in ("started", "progress", "result", "error", "cancelled"):
+            getattr(job.signals, name).connect(getattr(self, name))
+        job.signals.finished.connect(self._on_finished)
+        self.jobs[job.id] = job
+        self.pool.start(job)
+        return job
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. A job still waiting in the queue is removed from it, a running one is asked to stop.
+
+        Returns:
+            bool: False if the job is unknown or already finished.
+        """
+        job = self.jobs.get(job_id)
+        if job is None:
+            return False
+        job.cancel()
+        if job.state == QUEUED and self.pool.tryTake(job):
+            job.state = CANCELLED
+            self.cancelled.emit(job.id)
+            self._on_finished(job.id)
+        return True
+
+    def cancel_all(self):
+        for job_id in list(self.jobs):
+            self.cancel(job_id)
+
+    def pending(self):
+        """The number of jobs queued or running."""
+        return len(self.jobs)
+
+    def wait(self, msecs=-1):
+        """Block until all the jobs are finished, for shutdown. Returns False on timeout."""
+        return self.pool.waitForDone(msecs)
+
+    def _on_finished(self, job_id):
+        if self.jobs.pop(job_id, None) is not None:
+            self.finished.emit(job_id)
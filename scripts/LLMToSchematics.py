@@ -2,28 +2,26 @@
 # python3 -m pip install -U openai             #(1.14.3)
 # export OPENAI_API_KEY="..."
 
+# The SDK of each provider (langchain_openai, langchain_google_genai) is imported when its first chat model is
+# created, not with this module, see create_chat_model.
+
 from typing import TypedDict
 import os
-import langchain
 from langchain_core.pydantic_v1 import BaseModel, Field
-from langchain.chains import TransformChain
 from langchain_core.messages import HumanMessage
-from langchain_openai import ChatOpenAI
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain import globals
-from langchain_core.runnables import chain
-import base64
+from langchain_core.runnables import RunnableLambda, chain
+import threading
 from langchain_core.output_parsers import JsonOutputParser
 
-import yaml
-import os
-
-# Path to your config.yaml file
-config_file_path = 'configuration.yaml'
+from scripts.llm_cache import ResponseCache
+from scripts.image_preprocessing import DEFAULT_MAX_DIMENSION, describe_image_file, prepare_image
+from scripts import tiling
+from scripts.json_stream import ArrayItemStream
+from scripts.settings import get_settings
+from scripts import tracing
 
-# Read the YAML file
-with open(config_file_path, 'r') as file:
-    config = yaml.safe_load(file)
+# The configuration, read once per process
+config = get_settings()
 
 # Extract the OPENAI_API_KEY value
 openai_api_key = config.get('OPENAI_API_KEY', None)
@@ -33,8 +31,12 @@ google_api_key = config.get('GOOGLE_API_KEY', None)
 api_in_use = None
 
 
-# Use openAI API key if available, else try google API key, else print error message
-if google_api_key:
+# Use the local fake model if asked to (see scripts/fake_llm.py), else the Google API key if available, else the
+# openAI API key, else print error message
+if config.get('llm_backend') == 'fake':
+    api_in_use = 'fake'
+    print('Using the local fake model, no API is called.')
+elif google_api_key:
     # Set the environment variable
     os.environ['GOOGLE_API_KEY'] = google_api_key
     api_in_use = 'gemini'
@@ -48,23 +50,57 @@ elif openai_api_key:
 else:
     print('No API key found. Please provide an API key in the configuration file.')
 
+# Models used by each API, and their sampling temperature
+IMAGE_MODEL_NAMES = {'openai': "gpt-4-vision-preview", 'gemini': "gemini-pro-vision", 'fake': "fake-schematic-model"}
+TEXT_MODEL_NAMES = {'openai': "gpt-4-vision-preview", 'gemini': "gemini-pro", 'fake': "fake-schematic-model"}
+MODEL_TEMPERATURE = 0.1
+# Optional OpenAI-compatible endpoint (eg: a proxy, or a local stub server for testing)
+openai_base_url = config.get('OPENAI_BASE_URL', None)
+
+# Cache of parsed responses, so converting the same image and prompt again skips the model call.
+# Set llm_cache: false in the configuration file to disable it.
+llm_cache_enabled = config.get('llm_cache', True)
+response_cache = ResponseCache(
+    cache_dir=config.get('llm_cache_dir', '.llm_cache'),
+    max_entries=config.get('llm_cache_max_entries', 500),
+    max_bytes=config.get('llm_cache_max_mb', 50) * 1024 * 1024,
+    max_age=config.get('llm_cache_max_age_days', 30) * 24 * 3600)
+
+# Images are cropped, reduced to 1-bit when they are line art, downscaled and re-encoded before upload.
+# Set image_preprocessing: false in the configuration file to send the files as they are.
+image_preprocessing_enabled = config.get('image_preprocessing', True)
+image_max_dimension = config.get('image_max_dimension', DEFAULT_MAX_DIMENSION)
+
+
+def prepare_image_input(image_path):
+    """
+    Prepare an image file for the vision model, and report the bytes saved.
 
-def load_image(inputs: dict) -> dict:
-    """Load image from file and encode it as base64."""
-    image_path = inputs["image_path"]
+    Parameters:
+        image_path (str): The path to the image.
+
+    Returns:
+        dict: {"image": base64 of the image, "image_mime_type": its MIME type}
+    """
+    with tracing.span("image_encode", image=os.path.basename(image_path)) as span:
+        prepared_image = prepare_image(image_path, max_dimension=image_max_dimension,
+                                       preprocess=image_preprocessing_enabled)
+        span.add("bytes_original", prepared_image.original_size)
+        span.add("bytes_encoded", prepared_image.size)
+    print(describe_image_file(image_path, prepared_image))
+    return {"image": prepared_image.base64(), "image_mime_type": prepared_image.mime_type}
 
-    def encode_image(image_path):
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
-    image_base64 = encode_image(image_path)
-    return {"image": image_base64}
 
+def load_image(inputs: dict) -> dict:
+    """Load image from file, preprocess it and encode it as base64."""
+    # invoke_with_cache prepares the image before the chain runs, on a cache miss
+    if "image" in inputs:
+        return {"image": inputs["image"], "image_mime_type": inputs.get("image_mime_type", "image/png")}
+    return prepare_image_input(inputs["image_path"])
 
-load_image_chain = TransformChain(
-    input_variables=["image_path"],
-    output_variables=["image"],
-    transform=load_image
-)
+
+# Adds the image to the inputs of the chain
+load_image_chain = RunnableLambda(lambda inputs: {**inputs, **load_image(inputs)})
 
 
 # Define dictionary structure
@@ -90,71 +126,297 @@ class SchematicsInformation(BaseModel):
     detected_components: list[Component] = Field(description="list of dictionaries containing the name, relative XY cartesian coordinates (Origin is at top left, so moving towards right should increase X, moving downwards, should increase. For. eg. If componentA is to the down-right of componentB which is at (0,0), the coordinates of component A would be (1,1). Assume the space between two adjacent components to be one cell), angle and reference for a circuit component")
     component_connections: list[Connections] = Field(description="list of dictionaries containing the connections from one pin of a reference to the pin of another reference. for eg {'A_ref': 'R1', 'A_pin': 1, 'B_ref': 'R2', 'B_pin': 2} means pin 1 of R1 is connected to pin 2 of R2")
     
-# Set verbose
-globals.set_debug(True)
+# Verbose output of every chain step, off unless debug: true is set in the configuration file
+if config.get('debug', False):
+    from langchain_core.globals import set_debug
+    set_debug(True)
+
+
+# Chat models are created once per process and reused by every call, so the HTTP connections
+# (and their TLS sessions) are kept alive across conversions. Both the models and the httpx client
+# are safe to use from several threads.
+_chat_models = {}
+_chat_models_lock = threading.Lock()
+_http_client = None
+
+
+def get_http_client():
+    """
+    Get the HTTP client shared by the OpenAI chat models.
+
+    Returns:
+        httpx.Client: A client with a keep-alive connection pool.
+    """
+    global _http_client
+    with _chat_models_lock:
+        if _http_client is None:
+            import httpx
+            _http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=32, max_keepalive_connections=16, keepalive_expiry=120),
+                timeout=httpx.Timeout(120.0, connect=10.0))
+        return _http_client
+
+
+def create_openai_chat_model(model_name, base_url=None, http_client=None):
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(temperature=MODEL_TEMPERATURE, model=model_name, max_tokens=1024,
+                      base_url=base_url, http_client=http_client)
+
+
+def create_gemini_chat_model(model_name, base_url=None, http_client=None):
+    from langchain_google_genai import ChatGoogleGenerativeAI
+    return ChatGoogleGenerativeAI(temperature=MODEL_TEMPERATURE, model=model_name)
+
+
+def create_fake_chat_model(model_name, base_url=None, http_client=None):
+    # Its latency, jitter, error rate and answer are set under fake_llm in the configuration file
+    from scripts.fake_llm import FakeChatModel
+    return FakeChatModel(model_name=model_name, **config.get('fake_llm', None) or {})
+
+
+# The backends of the chat models: {api: function(model_name, base_url, http_client) -> BaseChatModel}
+chat_model_backends = {'openai': create_openai_chat_model, 'gemini': create_gemini_chat_model,
+                       'fake': create_fake_chat_model}
+
+
+def register_backend(api, create_model, image_model_name=None, text_model_name=None):
+    """
+    Add a backend of the chat models, or replace one, eg: a fake model with other settings.
+
+    Parameters:
+        api (str): The name of the backend, eg: 'fake'.
+        create_model (function): Called with the model name, base_url and http_client, returns the BaseChatModel.
+        image_model_name (str, optional): The name of its vision model. Defaults to the current one, or the api.
+        text_model_name (str, optional): The name of its text model. Defaults to the current one, or the api.
+    """
+    with _chat_models_lock:
+        chat_model_backends[api] = create_model
+        IMAGE_MODEL_NAMES[api] = image_model_name or IMAGE_MODEL_NAMES.get(api, api)
+        TEXT_MODEL_NAMES[api] = text_model_name or TEXT_MODEL_NAMES.get(api, api)
+        # The models created by the previous backend of that name are dropped
+        for key in [key for key in _chat_models if key[0] == api]:
+            del _chat_models[key]
+
+
+def use_backend(api):
+    """
+    Send the following conversions to another backend, eg: use_backend('fake').
+
+    Parameters:
+        api (str): The name of a backend of chat_model_backends.
+    """
+    global api_in_use
+    if api not in chat_model_backends:
+        raise ValueError(f"Unknown model backend {api}, expected one of {', '.join(chat_model_backends)}")
+    api_in_use = api
+
+
+def create_chat_model(api, model_name, base_url=None, http_client=None):
+    """
+    Create a chat model client.
+
+    Parameters:
+        api (str): The backend, 'openai', 'gemini', 'fake' or one added with register_backend.
+        model_name (str): The name of the model.
+        base_url (str, optional): The OpenAI-compatible endpoint to use instead of the default one.
+        http_client (httpx.Client, optional): The HTTP client used by OpenAI models.
+
+    Returns:
+        BaseChatModel: The chat model.
+    """
+    create_model = chat_model_backends.get(api)
+    if create_model is None:
+        raise Exception('No API key found. Please provide an API key in the configuration file.')
+    return create_model(model_name, base_url=base_url, http_client=http_client)
+
+
+def get_chat_model(model_name):
+    """
+    Get the chat model for the API in use, creating it on first use.
+
+    Parameters:
+        model_name (str): The name of the model.
+
+    Returns:
+        BaseChatModel: The chat model, shared by all callers.
+    """
+    key = (api_in_use, model_name)
+    model = _chat_models.get(key)
+    if model is None:
+        http_client = get_http_client() if api_in_use == 'openai' else None
+        with _chat_models_lock:
+            model = _chat_models.get(key)
+            if model is None:
+                model = create_chat_model(api_in_use, model_name, base_url=openai_base_url, http_client=http_client)
+                _chat_models[key] = model
+    return model
+
+
+def chat_model_name(model):
+    """
+    The name of the model behind a chat model, eg: gpt-4o, used in the cache key and the traces.
+
+    Parameters:
+        model (BaseChatModel): The chat model.
+
+    Returns:
+        str: Its model name, or the name of its class when it has none.
+    """
+    return getattr(model, "model_name", None) or getattr(model, "model", None) or type(model).__name__
+
+
+def image_messages(inputs: dict) -> list:
+    """The messages sent to the vision model: the prompt, the format instructions and the image."""
+    return [HumanMessage(
+        content=[
+            {"type": "text", "text": inputs["prompt"]},
+            {"type": "text", "text": parser.get_format_instructions()},
+            {"type": "image_url", "image_url": {
+                "url": f"data:{inputs.get('image_mime_type', 'image/png')};base64,{inputs['image']}"}},
+        ]
+    )]
+
+
+def request_size(messages):
+    """The characters sent to the model: the texts and the base64 images."""
+    size = 0
+    for message in messages:
+        for part in message.content:
+            size += len(part.get("text", "")) + len(part.get("image_url", {}).get("url", ""))
+    return size
+
+
+def record_token_usage(span, message):
+    """Add the token counts reported with a model response to a span, when the API reports them."""
+    usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    for counter, key in (("prompt_tokens", "prompt_tokens"), ("completion_tokens", "completion_tokens")):
+        if usage.get(key):
+            span.add(counter, usage[key])
+
+
+def invoke_model(model_name, messages):
+    """Invoke a chat model of the API in use, in a model_call span."""
+    with tracing.span("model_call", model=model_name) as span:
+        span.add("bytes_uploaded", request_size(messages))
+        msg = get_chat_model(model_name).invoke(messages)
+        span.add("response_characters", len(msg.content))
+        record_token_usage(span, msg)
+    return msg.content
 
 
 @chain
 def image_model(inputs: dict):  # -> str | list[str] | dict:
     """Invoke model with image and prompt."""
     # choose model based on the API key
-    if api_in_use == 'openai':
-        model = ChatOpenAI(temperature=0.1, model="gpt-4-vision-preview", max_tokens=1024)
-    elif api_in_use == 'gemini':
-        model = ChatGoogleGenerativeAI(temperature=0.1, model="gemini-pro-vision")
-    msg = model.invoke(
-        [HumanMessage(
-            content=[
-                {"type": "text", "text": inputs["prompt"]},
-                {"type": "text", "text": parser.get_format_instructions()},
-                {"type": "image_url", "image_url": {
-                    "url": f"data:image/png;base64,{inputs['image']}"}},
-            ]
-        )]
-    )
-    return msg.content
+    return invoke_model(IMAGE_MODEL_NAMES.get(api_in_use), image_messages(inputs))
 
 
 @chain
 def text_model(inputs: dict):  # -> str | list[str] | dict:
     """Invoke model with image and prompt."""
     # choose model based on the API key
-    if api_in_use == 'openai':
-        model = ChatOpenAI(temperature=0.1, model="gpt-4-vision-preview", max_tokens=1024)
-    elif api_in_use == 'gemini':
-        model = ChatGoogleGenerativeAI(temperature=0.1, model="gemini-pro")
-    msg = model.invoke(
-        [HumanMessage(
-            content=[
-                {"type": "text", "text": inputs["prompt"]},
-                {"type": "text", "text": parser.get_format_instructions()},
-            ]
-        )]
-    )
-    return msg.content
+    return invoke_model(TEXT_MODEL_NAMES.get(api_in_use), [HumanMessage(
+        content=[
+            {"type": "text", "text": inputs["prompt"]},
+            {"type": "text", "text": parser.get_format_instructions()},
+        ]
+    )])
 
 
 parser = JsonOutputParser(pydantic_object=SchematicsInformation)
 
+
+def parse_model_output(text: str) -> dict:
+    """Parse the JSON answer of the model, in a json_parse span."""
+    with tracing.span("json_parse") as span:
+        span.add("response_characters", len(text))
+        result = parser.parse(text)
+        if isinstance(result, dict):
+            span.add("components", len(result.get("detected_components") or []))
+            span.add("connections", len(result.get("component_connections") or []))
+    return result
+
+
+# The last step of the chains
+parse_response = RunnableLambda(parse_model_output)
+
+
+def invoke_with_cache(vision_chain, inputs, model_name, image_path=None, use_cache=True, base_url=None):
+    """
+    Invoke a chain, or return the cached result of an identical earlier call.
+
+    Parameters:
+        vision_chain (Runnable): The chain to invoke on a cache miss.
+        inputs (dict): The inputs of the chain. Must contain the prompt, and may contain an already prepared image.
+        model_name (str): The name of the model used by the chain.
+        image_path (str, optional): The image sent to the model. Its file is part of the cache key, it is preprocessed
+            on a cache miss only.
+        use_cache (bool, optional): Set to False to bypass the cache. Defaults to True.
+        base_url (str, optional): The endpoint of the model, part of the cache key so the answers of a proxy or a fake
+            server are not mixed with the API's. Defaults to OPENAI_BASE_URL when the OpenAI API is in use.
+
+    Returns:
+        dict: The parsed SchematicsInformation.
+    """
+    # Without an API key there is no model, and no cache key either
+    if model_name is None:
+        raise Exception('No API key found. Please provide an API key in the configuration file.')
+    with tracing.span("conversion", model=model_name,
+                      image=os.path.basename(image_path) if image_path is not None else None) as span:
+        image_bytes = None
+        if image_path is not None:
+            # The cache key is computed from the file and the preprocessing settings, so a cache hit does not
+            # decode the image. It is prepared on a miss only
+            with open(image_path, 'rb') as file:
+                image_bytes = f"{image_preprocessing_enabled};{image_max_dimension};".encode('utf-8') + file.read()
+        elif "image" in inputs:
+            image_bytes = f"{inputs.get('image_mime_type')};{inputs['image']}".encode('utf-8')
+
+        def invoke():
+            if image_path is None:
+                return vision_chain.invoke(inputs)
+            return vision_chain.invoke({**inputs, **prepare_image_input(image_path)})
+
+        if not (use_cache and llm_cache_enabled):
+            return invoke()
+
+        if base_url is None and api_in_use == 'openai':
+            base_url = openai_base_url
+        key = response_cache.make_key(inputs['prompt'], model_name, MODEL_TEMPERATURE,
+                                      parser.get_format_instructions(), image_bytes, base_url)
+        result = response_cache.get(key)
+        if result is not None:
+            print('Using cached model response.')
+            span.add("cache_hits")
+            return result
+
+        span.add("cache_misses")
+        result = invoke()
+        response_cache.put(key, result)
+        return result
+
 # including start and end position on the image (you may approaximate using pixel locations)
 # including their name, position on the image, and orientation (you may approaximate using pixel locations)
 # Can you recognize and list all the electronic components on this schematic drawing and generate an netlist-like list of this diagram?
 
 
-def image_to_schematics(image_path: str) -> dict:
-    vision_prompt = """
+IMAGE_PROMPT = """
    Given the image which contains a circuit schematic drawing, provide the following information:
    - A list of components present on this schematic drawing, including their name in lowercase alphabet (like resistor, capacitor, switch etc), position in relative coordinates, and orientation in degrees (0, 90, 180, 270)
    - A list of connections made by the components, you must make sure all the references stays consistent throught your answer!
    Please just reply ONLY in JSON output and nothing else!
    """
 
-    vision_chain = load_image_chain | image_model | parser
-    return vision_chain.invoke({'image_path': f'{image_path}',
-                                'prompt': vision_prompt})
 
+def image_to_schematics(image_path: str, use_cache: bool = True) -> dict:
+    vision_prompt = IMAGE_PROMPT
+
+    vision_chain = load_image_chain | image_model | parse_response
+    return invoke_with_cache(vision_chain, {'image_path': f'{image_path}', 'prompt': vision_prompt},
+                             IMAGE_MODEL_NAMES.get(api_in_use), image_path=image_path, use_cache=use_cache)
 
-def image_text_to_schematics(image_path: str, user_request: str) -> dict:
+
+def image_text_to_schematics(image_path: str, user_request: str, use_cache: bool = True) -> dict:
     # user_request = input("Describe your request:")
     vision_prompt = f"""
     Look at this image which contains current design of a circuit schematic diagram which the user is currently working on.
@@ -164,12 +426,78 @@ def image_text_to_schematics(image_path: str, user_request: str) -> dict:
     Please just reply ONLY in JSON output and nothing else!
     """
 
-    vision_chain = load_image_chain | image_model | parser
-    return vision_chain.invoke({'image_path': f'{image_path}',
-                               'prompt': vision_prompt})
+    vision_chain = load_image_chain | image_model | parse_response
+    return invoke_with_cache(vision_chain, {'image_path': f'{image_path}', 'prompt': vision_prompt},
+                             IMAGE_MODEL_NAMES.get(api_in_use), image_path=image_path, use_cache=use_cache)
+
+
+def stream_model_response(model, messages, on_component=None):
+    """
+    Stream the response of a chat model, and hand over each detected component as soon as it is complete,
+    while the model is still writing the rest of the answer.
+
+    Parameters:
+        model (BaseChatModel): The chat model.
+        messages (list): The messages sent to the model.
+        on_component (function, optional): Called with each entry of detected_components, in the stream thread.
 
+    Returns:
+        dict: The parsed SchematicsInformation.
+    """
+    components = ArrayItemStream("detected_components")
+    chunks = []
+    with tracing.span("model_call", model=chat_model_name(model), streaming=True) as span:
+        span.add("bytes_uploaded", request_size(messages))
+        for chunk in model.stream(messages):
+            chunks.append(chunk.content)
+            for component in components.feed(chunk.content):
+                if on_component is not None:
+                    on_component(component)
+        response = "".join(chunks)
+        span.add("chunks", len(chunks))
+        span.add("components_streamed", len(components.items))
+        span.add("components_malformed", components.malformed)
+        span.add("response_characters", len(response))
+    return parse_model_output(response)
+
+
+def image_to_schematics_streaming(image_path: str, on_component=None, use_cache: bool = True, model=None) -> dict:
+    """
+    Convert an image like image_to_schematics, streaming the model response, see stream_model_response.
 
-def text_to_schematics(user_request: str) -> dict:
+    Parameters:
+        image_path (str): The path to the image.
+        on_component (function, optional): Called with each detected component as soon as it has arrived.
+        use_cache (bool, optional): Set to False to bypass the response cache. Defaults to True.
+        model (BaseChatModel, optional): The chat model. Defaults to the image model of the API in use.
+
+    Returns:
+        dict: The parsed SchematicsInformation.
+    """
+    vision_prompt = IMAGE_PROMPT
+    model_name = IMAGE_MODEL_NAMES.get(api_in_use)
+    if model is None:
+        model = get_chat_model(model_name)
+    else:
+        model_name = chat_model_name(model)
+
+    streamed = []
+
+    @chain
+    def streaming_chain(inputs: dict):
+        streamed.append(True)
+        return stream_model_response(model, image_messages(inputs), on_component)
+
+    result = invoke_with_cache(streaming_chain, {'prompt': vision_prompt}, model_name,
+                               image_path=image_path, use_cache=use_cache)
+    # A cached response arrives all at once
+    if not streamed and on_component is not None:
+        for component in result.get("detected_components", []):
+            on_component(component)
+    return result
+
+
+def text_to_schematics(user_request: str, use_cache: bool = True) -> dict:
     # user_request = input("Describe your request:")
     vision_prompt = f"""
     You are a helpful circuit designer,
@@ -179,5 +507,48 @@ def text_to_schematics(user_request: str) -> dict:
     Please just reply ONLY in JSON output and nothing else!
     """
 
-    vision_chain = text_model | parser
-    return vision_chain.invoke({'prompt': vision_prompt})
+    vision_chain = text_model | parse_response
+    return invoke_with_cache(vision_chain, {'prompt': vision_prompt},
+                             TEXT_MODEL_NAMES.get(api_in_use), use_cache=use_cache)
+
+
+def image_to_schematics_tiled(image_path: str, rows: int = None, cols: int = None,
+                              tile_size: int = tiling.DEFAULT_TILE_SIZE, overlap: float = tiling.DEFAULT_OVERLAP,
+                              max_workers: int = None, use_cache: bool = True) -> dict:
+    """
+    Convert a large schematic image tile by tile, see scripts/tiling.py.
+
+    Parameters:
+        image_path (str): The path to the image.
+        rows (int, optional): The number of tile rows. Defaults to what tile_size needs.
+        cols (int, optional): The number of tile columns. Defaults to what tile_size needs.
+        tile_size (int, optional): The maximum tile size in pixels, when rows or cols is not given. Defaults to 1024.
+        overlap (float, optional): The share of a tile also covered by its neighbour. Defaults to 0.15.
+        max_workers (int, optional): The maximum number of model calls in flight. Defaults to one per tile.
+        use_cache (bool, optional): Set to False to bypass the response cache. Defaults to True.
+
+    Returns:
+        dict: The merged SchematicsInformation.
+    """
+    tile_prompt = """
+   The image is one tile of a larger circuit schematic drawing, parts and wires may be cut at its edges. Provide the following information:
+   - A list of the components on this tile, including their name in lowercase alphabet (like resistor, capacitor, switch etc), the position of their center as percentages of the tile width and height (x from 0 at the left edge to 100 at the right edge, y from 0 at the top edge to 100 at the bottom edge), and orientation in degrees (0, 90, 180, 270)
+   - A list of connections made by the components on this tile, you must make sure all the references stays consistent throught your answer!
+   Please just reply ONLY in JSON output and nothing else!
+   """
+
+    tiles = tiling.split_image(image_path, rows=rows, cols=cols, tile_size=tile_size, overlap=overlap)
+    print(f"Image {os.path.basename(image_path)}: {len(tiles)} tiles, "
+          f"{sum(prepared_image.size for _, prepared_image in tiles)} bytes")
+    tile_chain = image_model | parse_response
+
+    def convert_tile(prepared_image):
+        return invoke_with_cache(tile_chain, {'prompt': tile_prompt, 'image': prepared_image.base64(),
+                                              'image_mime_type': prepared_image.mime_type},
+                                 IMAGE_MODEL_NAMES.get(api_in_use), use_cache=use_cache)
+
+    tile_results = tiling.convert_tiles(tiles, convert_tile, max_workers=max_workers)
+    result, report = tiling.merge_tile_results(tile_results, [box for box, _ in tiles])
+    print(f"Merged {report['tile_components']} parts of {report['tiles']} tiles into {report['components']} "
+          f"components and {report['connections']} connections ({report['dropped_connections']} dropped)")
+    return result
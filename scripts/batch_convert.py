@@ -0,0 +1,275 @@
+# Headless batch conversion of schematic images to .kicad_sch files.
+# The model calls run in a thread pool with a bounded number of requests in flight, and back off when the
+# API reports a rate limit. Each result is handed to a process pool as soon as it arrives, which writes the
+# schematic, so both stages overlap. One .kicad_sch (and the model's JSON) is written per image, plus
+# batch_report.json with per-file timings.
+#
+# Usage (from the repository root):
+#   python -m scripts.batch_convert testImages/ "datasheets/*.png" --output-dir out [--concurrency 4]
+#   python -m scripts.batch_convert testImages/ --output-dir out --fake-backend 2.0 [--fake-error-rate 0.1]
+#   python -m scripts.batch_convert large_sheets/ --output-dir out --tile-size 1024 [--fake-backend 2.0]
+
+import argparse
+import glob
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+import scripts.LLMToSchematics as LLMToSchematics
+from scripts.LLMToSchematics import image_to_schematics, image_to_schematics_tiled
+from scripts.fake_llm import FakeChatModel
+from scripts.image_to_schematic import finish_conversion, write_schematic
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+
+# Returned by the fake backend: a battery driving an LED through a resistor
+FAKE_RESULT = {
+    "detected_components": [
+        {"lib_id": "battery", "x": 0, "y": 1, "angle": 0, "reference": "BT1", "value": "9V"},
+        {"lib_id": "resistor", "x": 1, "y": 0, "angle": 0, "reference": "R1", "value": "470"},
+        {"lib_id": "led", "x": 2, "y": 1, "angle": 90, "reference": "D1", "value": "LED"},
+    ],
+    "component_connections": [
+        {"A_ref": "BT1", "A_pin": 1, "B_ref": "R1", "B_pin": 1},
+        {"A_ref": "R1", "A_pin": 2, "B_ref": "D1", "B_pin": 2},
+        {"A_ref": "D1", "A_pin": 1, "B_ref": "BT1", "B_pin": 2},
+    ],
+}
+
+
+def find_images(inputs):
+    """
+    Expand directories and glob patterns into a list of image files.
+
+    Parameters:
+        inputs (list of str): Directories, glob patterns or image paths.
+
+    Returns:
+        list: The image paths, sorted and without duplicates.
+    """
+    image_paths = set()
+    for pattern in inputs:
+        if os.path.isdir(pattern):
+            pattern = os.path.join(pattern, "*")
+        for path in glob.glob(pattern):
+            if os.path.isfile(path) and path.lower().endswith(IMAGE_EXTENSIONS):
+                image_paths.add(path)
+    return sorted(image_paths)
+
+
+def register_fake_backend(latency=1.0, jitter=0.0, error_rate=0.0):
+    """
+    Send the model calls to a local fake model answering FAKE_RESULT, to measure throughput, retries and tail
+    latency without calling an API. The plain and the tiled conversions both use it. See scripts/fake_llm.py.
+
+    Parameters:
+        latency (float, optional): The time each call takes, in seconds. Defaults to 1.0.
+        jitter (float, optional): A random time added to the latency, up to this many seconds. Defaults to 0.0.
+        error_rate (float, optional): The share of calls failing with a rate limit error. Defaults to 0.0.
+
+    Returns:
+        FakeChatModel: The fake model.
+    """
+    model = FakeChatModel(response=json.dumps(FAKE_RESULT), latency=latency, jitter=jitter, error_rate=error_rate)
+    LLMToSchematics.register_backend('fake', lambda model_name, **kwargs: model)
+    LLMToSchematics.use_backend('fake')
+    return model
+
+
+def is_rate_limit_error(error):
+    """
+    Check whether an exception raised by a model call is a rate limit (or quota) error worth retrying.
+
+    Parameters:
+        error (Exception): The exception.
+
+    Returns:
+        bool: True if the call should be retried after a delay.
+    """
+    if getattr(error, "status_code", None) == 429:
+        return True
+    name = type(error).__name__
+    return "RateLimit" in name or "ResourceExhausted" in name
+
+
+def retry_after(error):
+    """Get the delay requested by the API in a Retry-After header, or None."""
+    response = getattr(error, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+def call_with_backoff(backend, image_path, max_retries=5, base_delay=2.0, max_delay=60.0):
+    """
+    Call the backend, retrying with exponential backoff while the API reports a rate limit.
+
+    Parameters:
+        backend (function): The backend taking an image path.
+        image_path (str): The image to convert.
+        max_retries (int, optional): The number of retries before giving up. Defaults to 5.
+        base_delay (float, optional): The delay before the first retry, in seconds. Doubles on every retry. Defaults to 2.0.
+        max_delay (float, optional): The maximum delay between two attempts, in seconds. Defaults to 60.0.
+
+    Returns:
+        tuple: The backend's result and the number of retries.
+    """
+    for attempt in range(max_retries + 1):
+        try:
+            return backend(image_path), attempt
+        except Exception as e:
+            if attempt == max_retries or not is_rate_limit_error(e):
+                raise
+            delay = retry_after(e)
+            if delay is None:
+                # Full jitter, so that the workers which were throttled together do not retry together
+                delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            print(f"Rate limited on {image_path}, retrying in {delay:.1f} s")
+            time.sleep(delay)
+
+
+def model_stage(backend, image_path):
+    start = time.perf_counter()
+    response, retries = call_with_backoff(backend, image_path)
+    result = finish_conversion(response)
+    return result, retries, time.perf_counter() - start
+
+
+def schematic_stage(result, json_path, schematic_name, add_wires=True):
+    """
+    Write the model's result and the schematic built from it. Runs in the worker processes.
+
+    Parameters:
+        result (ConversionResult): The result of the model stage.
+        json_path (str): The path of the JSON file to write.
+        schematic_name (str): The path of the schematic to write, without the .kicad_sch extension.
+        add_wires (bool, optional): Whether to draw the connections. Defaults to True.
+
+    Returns:
+        tuple: The path of the schematic and the time spent, in seconds.
+    """
+    start = time.perf_counter()
+    result.save(json_path)
+    schematic_path, _ = write_schematic(result, schematic_name + ".kicad_sch", add_wires=add_wires, create=True)
+    return schematic_path, time.perf_counter() - start
+
+
+def convert_images(image_paths, output_dir, backend, concurrency=4, workers=None, add_wires=True):
+    """
+    Convert images to KiCad schematics.
+
+    Parameters:
+        image_paths (list of str): The images to convert.
+        output_dir (str): The directory receiving <image name>.kicad_sch, <image name>.json and batch_report.json.
+        backend (function): Takes an image path and returns a SchematicsInformation dictionary,
+            eg: LLMToSchematics.image_to_schematics or make_fake_backend().
+        concurrency (int, optional): The maximum number of model calls in flight. Defaults to 4.
+        workers (int, optional): The number of processes writing schematics. Defaults to the number of CPUs.
+        add_wires (bool, optional): Whether to draw the connections. Defaults to True.
+
+    Returns:
+        dict: The report, also written to batch_report.json.
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    start = time.perf_counter()
+    files = {image_path: {"image": image_path, "status": "failed"} for image_path in image_paths}
+
+    with ThreadPoolExecutor(max_workers=concurrency) as model_executor, \
+            ProcessPoolExecutor(max_workers=workers) as schematic_executor:
+        model_futures = {model_executor.submit(model_stage, backend, image_path): image_path
+                         for image_path in image_paths}
+        schematic_futures = {}
+        for future in as_completed(model_futures):
+            image_path = model_futures[future]
+            entry = files[image_path]
+            try:
+                result, entry["retries"], entry["model_seconds"] = future.result()
+            except Exception as e:
+                entry["error"] = f"model: {type(e).__name__}: {e}"
+                print(f"Failed to convert {image_path}: {entry['error']}")
+                continue
+            entry["components"] = len(result["detected_components"])
+            entry["connections"] = len(result["component_connections"])
+            # Images with the same name in different directories are told apart by their position in the batch
+            name = os.path.splitext(os.path.basename(image_path))[0]
+            if sum(1 for path in image_paths if os.path.splitext(os.path.basename(path))[0] == name) > 1:
+                name = f"{name}_{image_paths.index(image_path)}"
+            entry["json"] = os.path.join(output_dir, name + ".json")
+            schematic_futures[schematic_executor.submit(
+                schematic_stage, result, entry["json"], os.path.join(output_dir, name), add_wires)] = image_path
+
+        for future in as_completed(schematic_futures):
+            entry = files[schematic_futures[future]]
+            try:
+                entry["output"], entry["schematic_seconds"] = future.result()
+                entry["status"] = "ok"
+            except Exception as e:
+                entry["error"] = f"schematic: {type(e).__name__}: {e}"
+                print(f"Failed to write the schematic of {entry['image']}: {entry['error']}")
+
+    report = {
+        "total_seconds": time.perf_counter() - start,
+        "converted": sum(1 for entry in files.values() if entry["status"] == "ok"),
+        "failed": sum(1 for entry in files.values() if entry["status"] != "ok"),
+        "files": [files[image_path] for image_path in image_paths],
+    }
+    with open(os.path.join(output_dir, "batch_report.json"), "w") as f:
+        json.dump(report, f, indent=4)
+    return report
+
+
+def print_report(report):
+    for entry in report["files"]:
+        if entry["status"] == "ok":
+            print(f"{entry['image']}: {entry['output']} (model {entry['model_seconds']:.2f} s, "
+                  f"schematic {entry['schematic_seconds']:.2f} s, {entry['retries']} retries)")
+        else:
+            print(f"{entry['image']}: FAILED, {entry['error']}")
+    total = report["converted"] + report["failed"]
+    images_per_minute = total / report["total_seconds"] * 60 if report["total_seconds"] else 0
+    print(f"Converted {report['converted']}/{total} images in {report['total_seconds']:.2f} s "
+          f"({images_per_minute:.1f} images/min)")
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Convert a batch of schematic images to KiCad schematics.")
+    arg_parser.add_argument("inputs", nargs="+", help="Directories, glob patterns or image files")
+    arg_parser.add_argument("--output-dir", default="batch_output")
+    arg_parser.add_argument("--concurrency", type=int, default=4, help="Maximum number of model calls in flight")
+    arg_parser.add_argument("--workers", type=int, default=None, help="Number of processes writing schematics")
+    arg_parser.add_argument("--no-wires", action="store_true", help="Only place the components")
+    arg_parser.add_argument("--no-cache", action="store_true", help="Do not use cached model responses")
+    arg_parser.add_argument("--fake-backend", type=float, default=None, metavar="LATENCY",
+                            help="Use a local fake model answering after LATENCY seconds instead of the API")
+    arg_parser.add_argument("--fake-jitter", type=float, default=0.0, metavar="SECONDS",
+                            help="Random time added to the latency of the fake model")
+    arg_parser.add_argument("--fake-error-rate", type=float, default=0.0, metavar="RATE",
+                            help="Share of the calls to the fake model failing with a rate limit error")
+    arg_parser.add_argument("--tile-size", type=int, default=None, metavar="PIXELS",
+                            help="Convert large images in overlapping tiles of at most PIXELS, with concurrent calls")
+    args = arg_parser.parse_args()
+
+    image_paths = find_images(args.inputs)
+    if not image_paths:
+        arg_parser.error("no images found")
+
+    use_cache = not args.no_cache
+    if args.fake_backend is not None:
+        register_fake_backend(latency=args.fake_backend, jitter=args.fake_jitter, error_rate=args.fake_error_rate)
+        # The whole model stage runs, image preparation and parsing included, but never from the cache
+        use_cache = False
+
+    if args.tile_size is not None:
+        def backend(image_path):
+            return image_to_schematics_tiled(image_path, tile_size=args.tile_size, use_cache=use_cache)
+    else:
+        def backend(image_path):
+            return image_to_schematics(image_path, use_cache=use_cache)
+
+    report = convert_images(image_paths, args.output_dir, backend, concurrency=args.concurrency,
+                            workers=args.workers, add_wires=not args.no_wires)
+    print_report(report)
@@ -0,0 +1,74 @@
+# The result of a conversion, passed in memory from the model stage to the schematic stage and the GUI.
+# It is the SchematicsInformation dictionary returned by the model, so it can be used wherever the
+# content of result.json was used. Writing it to disk is optional, and done atomically per job.
+
+import json
+import os
+import threading
+
+
+class ConversionResult(dict):
+    """
+    SchematicsInformation of one conversion: {"detected_components": [...], "component_connections": [...]}.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.setdefault("detected_components", [])
+        self.setdefault("component_connections", [])
+
+    @property
+    def components(self):
+        return self["detected_components"]
+
+    @property
+    def connections(self):
+        return self["component_connections"]
+
+    def save(self, file_path):
+        """
+        Write the result as JSON. The file is replaced atomically, so readers never see a partial file.
+
+        Parameters:
+            file_path (str): The path to the JSON file.
+
+        Returns:
+            str: The path to the JSON file.
+        """
+        temp_path = f"{file_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self, f, indent=4)
+        os.replace(temp_path, file_path)
+        return file_path
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Read a result written by save, or a result.json file of an earlier version.
+
+        Parameters:
+            file_path (str): The path to the JSON file.
+
+        Returns:
+            ConversionResult: The result.
+        """
+        with open(file_path, 'r') as f:
+            return cls(json.load(f))
+
+
+def as_conversion_result(result=None, path_to_json=None):
+    """
+    Get the result to work on: the given one, or the one saved at path_to_json.
+
+    Parameters:
+        result (dict, optional): The result of the conversion.
+        path_to_json (str, optional): The path to a saved result, used when result is None.
+
+    Returns:
+        ConversionResult: The result.
+    """
+    if result is not None:
+        return result if isinstance(result, ConversionResult) else ConversionResult(result)
+    if path_to_json is None:
+        raise Exception("Either a conversion result or the path to a saved result is required.")
+    return ConversionResult.load(path_to_json)
@@ -0,0 +1,283 @@
+# A local fake of the vision model, to measure the pipeline (concurrency, retries, caching, streaming) without an
+# API key or network access. FakeChatModel answers in-process, as a LangChain chat model. serve() puts the same
+# model behind a local HTTP server speaking the OpenAI chat completions API, so ChatOpenAI, its connection pool
+# and its retries are exercised too.
+# The answer is a canned response, or a generated SchematicsInformation of the requested size. Its latency,
+# jitter, error rate and streaming (chunk size and token rate) are configurable.
+#
+# Usage (from the repository root):
+#   python -m scripts.fake_llm --port 8000 --latency 2 --jitter 0.5 --error-rate 0.05 --components 50
+# then set OPENAI_BASE_URL: "http://127.0.0.1:8000/v1" and any OPENAI_API_KEY in configuration.yaml.
+# Or, in-process, set llm_backend: fake in configuration.yaml, with the settings of FakeChatModel in fake_llm.
+
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Iterator, List, Optional
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.pydantic_v1 import PrivateAttr
+
+# Names of the components of generated answers, all matched without a fuzzy search
+NAMES = ["resistor", "capacitor", "led", "battery", "switch"]
+# Characters per token, to turn the token rate into a chunk rate
+CHARS_PER_TOKEN = 4
+
+
+def synthetic_circuit(component_count, density=1.5, seed=0):
+    """
+    Generate a model answer of the given size.
+
+    Parameters:
+        component_count (int): The number of detected components.
+        density (float, optional): The number of connections per component. Defaults to 1.5.
+        seed (int, optional): The seed of the random generator, the same seed gives the same circuit.
+
+    Returns:
+        dict: A SchematicsInformation dictionary, with the components on a square grid in relative coordinates.
+    """
+    rng = random.Random(seed)
+    columns = max(1, int(component_count ** 0.5))
+    components = [{"lib_id": NAMES[rng.randrange(len(NAMES))], "x": i % columns, "y": i // columns,
+                   "angle": rng.choice([0, 90, 180, 270]), "reference": f"U{i + 1}", "value": ""}
+                  for i in range(component_count)]
+    connections = []
+    for _ in range(int(component_count * density) if component_count > 1 else 0):
+        a, b = rng.sample(range(component_count), 2)
+        connections.append({"A_ref": f"U{a + 1}", "A_pin": rng.randint(1, 2),
+                            "B_ref": f"U{b + 1}", "B_pin": rng.randint(1, 2)})
+    return {"detected_components": components, "component_connections": connections}
+
+
+class FakeAPIError(Exception):
+    """An error of the fake model. Its status_code is 429 for a rate limit, so the callers retry it."""
+
+    def __init__(self, status_code=429):
+        super().__init__(f"Fake API error {status_code}")
+        self.status_code = status_code
+        self.response = None
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Chat model answering with a canned or generated SchematicsInformation, without calling an API.
+
+    Parameters:
+        response (str, optional): The raw answer. Defaults to a generated circuit of `components` components.
+        components (int, optional): The size of the generated circuit. Defaults to 10.
+        density (float, optional): The connections per component of the generated circuit. Defaults to 1.5.
+        latency (float, optional): The time before the first token, in seconds. Defaults to 0.
+        jitter (float, optional): A random time added to the latency, up to this many seconds. Defaults to 0.
+        error_rate (float, optional): The share of calls failing with a FakeAPIError, after the latency. Defaults to 0.
+        error_status (int, optional): The status code of the errors. Defaults to 429, a rate limit.
+        chunk_size (int, optional): The characters per streamed chunk. Defaults to one token.
+        tokens_per_second (float, optional): The rate the answer is written at. Defaults to no delay.
+        seed (int, optional): The seed of the generated circuit, the jitter and the errors, for repeatable runs.
+    """
+
+    response: Optional[str] = None
+    components: int = 10
+    density: float = 1.5
+    latency: float = 0.0
+    jitter: float = 0.0
+    error_rate: float = 0.0
+    error_status: int = 429
+    chunk_size: int = CHARS_PER_TOKEN
+    tokens_per_second: float = float("inf")
+    seed: Optional[int] = None
+    model_name: str = "fake-schematic-model"
+
+    _random: random.Random = PrivateAttr()
+    _random_lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self._random = random.Random(self.seed)
+        if self.response is None:
+            self.response = "```json\n" + json.dumps(
+                synthetic_circuit(self.components, self.density, self.seed or 0), indent=2) + "\n```"
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def start_call(self):
+        """
+        Wait for the latency of a call, and fail it at the error rate.
+
+        Raises:
+            FakeAPIError: For the calls which fail.
+        """
+        with self._random_lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            fails = self._random.random() < self.error_rate
+        time.sleep(delay)
+        if fails:
+            raise FakeAPIError(self.error_status)
+
+    def chunks(self):
+        """The answer, a chunk at a time at the token rate. Call start_call first."""
+        # Chunks arrive on a fixed schedule, like from a server, however long the consumer takes per chunk
+        chunk_seconds = self.chunk_size / CHARS_PER_TOKEN / self.tokens_per_second
+        begin = time.perf_counter()
+        for index, start in enumerate(range(0, len(self.response), self.chunk_size)):
+            delay = begin + (index + 1) * chunk_seconds - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            yield self.response[start:start + self.chunk_size]
+
+    def token_usage(self, prompt_characters):
+        """Token counts of a call, estimated from the characters of the request and of the answer."""
+        prompt_tokens = prompt_characters // CHARS_PER_TOKEN
+        completion_tokens = len(self.response) // CHARS_PER_TOKEN
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens}
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                  run_manager=None, **kwargs: Any) -> ChatResult:
+        self.start_call()
+        content = "".join(self.chunks())
+        prompt_characters = sum(len(str(message.content)) for message in messages)
+        message = AIMessage(content=content, response_metadata={"token_usage": self.token_usage(prompt_characters),
+                                                                "model_name": self.model_name})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None,
+                run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        self.start_call()
+        for chunk in self.chunks():
+            yield ChatGenerationChunk(message=AIMessageChunk(content=chunk))
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    """Answers POST /v1/chat/completions with the FakeChatModel of the server, streamed when asked to."""
+
+    # HTTP/1.1 so that clients can keep the connection open between requests
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.lock:
+            self.server.connections += 1
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}", "type": "invalid_request_error"}})
+            return
+        model = self.server.model
+        with self.server.lock:
+            self.server.requests += 1
+        try:
+            model.start_call()
+        except FakeAPIError as e:
+            with self.server.lock:
+                self.server.errors += 1
+            error_type = "rate_limit_error" if e.status_code == 429 else "server_error"
+            self.send_json(e.status_code, {"error": {"message": str(e), "type": error_type}}, {"Retry-After": "1"})
+            return
+
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        model_name = request.get("model", model.model_name)
+        if not request.get("stream"):
+            self.send_json(200, {
+                "id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": model_name,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": "".join(model.chunks())}}],
+                "usage": model.token_usage(len(json.dumps(request.get("messages", []))))})
+            return
+
+        # Server-sent events, in chunked transfer encoding since the length is not known up front
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(delta, finish_reason=None):
+            return {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model_name, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        self.send_event(event({"role": "assistant", "content": ""}))
+        for chunk in model.chunks():
+            self.send_event(event({"content": chunk}))
+        self.send_event(event({}, "stop"))
+        self.send_event("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+    def send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_event(self, data):
+        line = f"data: {data if isinstance(data, str) else json.dumps(data)}\n\n".encode("utf-8")
+        self.wfile.write(f"{len(line):x}\r\n".encode("ascii") + line + b"\r\n")
+        self.wfile.flush()
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(model, host="127.0.0.1", port=0):
+    """
+    Start a local OpenAI-compatible server answering with a fake model, in a background thread.
+
+    Parameters:
+        model (FakeChatModel): The model answering the requests.
+        host (str, optional): The address to listen on. Defaults to 127.0.0.1.
+        port (int, optional): The port to listen on. Defaults to a free port.
+
+    Returns:
+        tuple: The server, with its counts of connections, requests and errors, and its base URL, eg:
+            "http://127.0.0.1:8000/v1". Stop it with server.shutdown().
+    """
+    server = ThreadingHTTPServer((host, port), FakeOpenAIHandler)
+    server.daemon_threads = True
+    server.model = model
+    server.lock = threading.Lock()
+    server.connections = server.requests = server.errors = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}/v1"
+
+
+if __name__ == '__main__':
+    arg_parser = argparse.ArgumentParser(description="Serve a fake vision model over the OpenAI chat completions API.")
+    arg_parser.add_argument("--host", default="127.0.0.1")
+    arg_parser.add_argument("--port", type=int, default=8000)
+    arg_parser.add_argument("--response", default=None, help="A file with the raw answer. Defaults to a generated one")
+    arg_parser.add_argument("--components", type=int, default=10, help="The size of the generated answer")
+    arg_parser.add_argument("--density", type=float, default=1.5, help="Connections per component")
+    arg_parser.add_argument("--latency", type=float, default=0.0, help="Seconds before the first token")
+    arg_parser.add_argument("--jitter", type=float, default=0.0, help="Random seconds added to the latency")
+    arg_parser.add_argument("--error-rate", type=float, default=0.0, help="Share of the requests answered with an error")
+    arg_parser.add_argument("--error-status", type=int, default=429)
+    arg_parser.add_argument("--chunk-size", type=int, default=CHARS_PER_TOKEN, help="Characters per streamed chunk")
+    arg_parser.add_argument("--tokens-per-second", type=float, default=float("inf"))
+    arg_parser.add_argument("--seed", type=int, default=None)
+    args = arg_parser.parse_args()
+
+    response = None
+    if args.response is not None:
+        with open(args.response) as f:
+            response = f.read()
+    fake_model = FakeChatModel(response=response, components=args.components, density=args.density,
+                               latency=args.latency, jitter=args.jitter, error_rate=args.error_rate,
+                               error_status=args.error_status, chunk_size=args.chunk_size,
+                               tokens_per_second=args.tokens_per_second, seed=args.seed)
+    server, base_url = serve(fake_model, args.host, args.port)
+    print(f"Fake model listening on {base_url}, press Ctrl+C to stop")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,250 @@
+# Vectorized coordinate transforms for schematic generation.
+# Positions, angles and pin offsets are held as NumPy arrays and scaled, rotated and split as whole
+# arrays instead of one dict at a time. The pipeline converts its dicts to arrays once per stage
+# (component placement, field positions, pin locations) and gets back exactly what the scalar code
+# returned, including the rounding of Python's round(), see round_list.
+
+import math
+
+import numpy as np
+
+# KiCad rotates symbols counter-clockwise on screen: (x, y) -> (a*x + b*y, c*x + d*y), with y pointing down
+ROTATION_MATRICES = {0: (1, 0, 0, 1), 90: (0, 1, -1, 0), 180: (-1, 0, 0, -1), 270: (0, -1, 1, 0)}
+MIRROR_CODES = {None: 0, 'x': 1, 'y': 2}
+
+# Offsets of the Reference and Value fields of rotated symbols, see label_positions
+LABEL_Y_OFFSET = 1.7
+LABEL_CLEARANCE = 2.54
+REFERENCE_X_NUDGE = 0.5
+
+
+def round_list(values, digits):
+    """
+    Round an array exactly like Python's round(), which numpy.round does not always match.
+
+    Python rounds the exact binary value of each float. Scaling by 10**digits adds an error of at most
+    half an ulp, which can only change the result when the scaled value is within that error of a tie, so
+    only those values (and the ones too large to scale) go through round() itself.
+
+    Parameters:
+        values (numpy.ndarray): The values.
+        digits (int): The number of decimals.
+
+    Returns:
+        list: The rounded values, as Python floats.
+    """
+    scale = 10.0 ** digits
+    with np.errstate(invalid='ignore', over='ignore'):
+        scaled = values * scale
+        distance_to_tie = np.abs(scaled - np.floor(scaled) - 0.5)
+        exact = (distance_to_tie > 1e-7 * np.maximum(1.0, np.abs(scaled))) & (np.abs(scaled) < 2.0 ** 52)
+        rounded = (np.rint(scaled) / scale).tolist()
+    if not exact.all():
+        for i in np.flatnonzero(~exact).tolist():
+            rounded[i] = round(float(values[i]), digits)
+    return rounded
+
+
+def scale_positions(positions, scaling_factor, origin=None, offset=0):
+    """
+    Scale positions around an origin, and truncate them to integers.
+
+    Parameters:
+        positions (numpy.ndarray): (N, 2) array of x, y positions.
+        scaling_factor (float): The scaling factor.
+        origin (numpy.ndarray, optional): The (x, y) point which does not move. Defaults to (0, 0).
+        offset (float, optional): Added to the scaled positions before truncating. Defaults to 0.
+
+    Returns:
+        numpy.ndarray: (N, 2) integer array, truncated towards zero like int().
+    """
+    if origin is None:
+        scaled = offset + positions * scaling_factor
+    else:
+        scaled = offset + origin + (positions - origin) * scaling_factor
+    return np.trunc(scaled).astype(np.int64)
+
+
+def _replace_positions(components, positions):
+    return [{**component, 'x': x, 'y': y} for component, (x, y) in zip(components, positions.tolist())]
+
+
+def component_positions(components):
+    """Get the (N, 2) array of the 'x' and 'y' values of component dicts."""
+    return np.fromiter((value for component in components for value in (component['x'], component['y'])),
+                       dtype=np.float64, count=2 * len(components)).reshape(-1, 2)
+
+
+def scale_components(components, scaling_factor):
+    """
+    Scale component positions around the top-left corner of their bounding box.
+
+    Parameters:
+        components (list of dicts): The components, with 'x' and 'y' keys.
+        scaling_factor (float): The scaling factor.
+
+    Returns:
+        list of dicts: Copies of the components with scaled integer positions.
+    """
+    positions = component_positions(components)
+    return _replace_positions(components, scale_positions(positions, scaling_factor, origin=positions.min(axis=0)))
+
+
+def scale_components_in_relative_coordinates(components, scaling_factor, offset=20):
+    """
+    Scale relative component positions (grid cells) to sheet coordinates.
+
+    Parameters:
+        components (list of dicts): The components, with 'x' and 'y' keys.
+        scaling_factor (float): The size of a grid cell.
+        offset (float, optional): The position of the grid origin on the sheet. Defaults to 20.
+
+    Returns:
+        list of dicts: Copies of the components with scaled integer positions.
+    """
+    positions = component_positions(components)
+    return _replace_positions(components, scale_positions(positions, scaling_factor, offset=offset))
+
+
+def rotate_pin_offsets(pin_offsets, angles, mirrors=None):
+    """
+    Rotate and mirror pin offsets from library coordinates to sheet coordinates.
+
+    Parameters:
+        pin_offsets (numpy.ndarray): (N, 2) array of pin x, y in the symbol definitions (y pointing up).
+        angles (numpy.ndarray): (N,) array of the rotation of each symbol instance, in degrees.
+        mirrors (numpy.ndarray, optional): (N,) array of MIRROR_CODES values. Defaults to no mirroring.
+
+    Returns:
+        numpy.ndarray: (N, 2) array of the pin offsets on the sheet (y pointing down).
+    """
+    x = pin_offsets[:, 0]
+    y = -pin_offsets[:, 1]
+    angles = np.mod(angles, 360)
+    new_x = np.empty_like(x)
+    new_y = np.empty_like(y)
+    handled = np.zeros(len(x), dtype=bool)
+    for angle, (a, b, c, d) in ROTATION_MATRICES.items():
+        mask = angles == angle
+        new_x[mask] = a * x[mask] + b * y[mask]
+        new_y[mask] = c * x[mask] + d * y[mask]
+        handled |= mask
+    if not handled.all():
+        other = ~handled
+        # math.cos/math.sin like the scalar code, numpy's can differ in the last bit
+        radians = [math.radians(angle) for angle in angles[other].tolist()]
+        cos = np.array([math.cos(radian) for radian in radians])
+        sin = np.array([math.sin(radian) for radian in radians])
+        new_x[other] = x[other] * cos + y[other] * sin
+        new_y[other] = -x[other] * sin + y[other] * cos
+    if mirrors is not None:
+        new_y = np.where(mirrors == MIRROR_CODES['x'], -new_y, new_y)
+        new_x = np.where(mirrors == MIRROR_CODES['y'], -new_x, new_x)
+    return np.stack([new_x, new_y], axis=1)
+
+
+def pin_locations(pin_offsets, symbol_positions, angles, mirrors=None):
+    """
+    Compute where pins of placed symbols are on the sheet, see wire_routing.pin_location.
+
+    Parameters:
+        pin_offsets (numpy.ndarray): (N, 2) array of pin x, y in the symbol definitions.
+        symbol_positions (numpy.ndarray): (N, 2) array of the position of the symbol instance of each pin.
+        angles (numpy.ndarray): (N,) array of the rotation of the symbol instance of each pin.
+        mirrors (numpy.ndarray, optional): (N,) array of MIRROR_CODES values.
+
+    Returns:
+        list: (x, y) tuples, rounded to 4 decimals.
+    """
+    locations = symbol_positions + rotate_pin_offsets(pin_offsets, angles, mirrors)
+    return list(zip(round_list(locations[:, 0], 4), round_list(locations[:, 1], 4)))
+
+
+def label_positions(positions, angles, reference_offsets, value_offsets):
+    """
+    Compute the positions of the Reference and Value fields of symbol instances.
+    Unrotated symbols keep the field offsets of the library (the reference nudged right by 0.5),
+    rotated symbols get both fields stacked above the symbol.
+
+    Parameters:
+        positions (list of tuples): The (x, y) positions of the symbols. Fields of rotated symbols are placed at
+            round(x, 2) of these values, so integer positions are written as integers, as they always have been.
+        angles (numpy.ndarray): (N,) array of the symbol rotations.
+        reference_offsets (numpy.ndarray): (N, 2) array of the Reference field positions in the library.
+        value_offsets (numpy.ndarray): (N, 2) array of the Value field positions in the library.
+
+    Returns:
+        tuple: (reference positions, value positions), lists of [x, y] rounded to 2 decimals.
+    """
+    position_array = np.array(positions, dtype=np.float64).reshape(-1, 2)
+    x, y = position_array[:, 0], position_array[:, 1]
+    rotated = angles != 0
+    clearance = np.abs(reference_offsets[:, 0]) + LABEL_CLEARANCE
+    reference_x = round_list(reference_offsets[:, 0] + x, 2)
+    reference_y = round_list(np.where(rotated, y - LABEL_Y_OFFSET - clearance, reference_offsets[:, 1] + y), 2)
+    value_x = round_list(value_offsets[:, 0] + x, 2)
+    value_y = round_list(np.where(rotated, y - clearance, value_offsets[:, 1] + y), 2)
+
+    references = []
+    values = []
+    for i, is_rotated in enumerate(rotated.tolist()):
+        if is_rotated:
+            field_x = round(positions[i][0], 2)
+            references.append([field_x, reference_y[i]])
+            values.append([field_x, value_y[i]])
+        else:
+            # The nudge is added after rounding, as the fields have always been placed
+            references.append([reference_x[i] + REFERENCE_X_NUDGE, reference_y[i]])
+            values.append([value_x[i], value_y[i]])
+    return references, values
+
+
+def split_diagonal(segments):
+    """
+    Split diagonal segments into a horizontal segment followed by a vertical one, on an array.
+    The pipeline keeps its wires as dicts and uses split_diagonal_segments, this version is for callers which keep
+    their segments in arrays, and is only used by benchmarks/bench_geometry.py for now.
+
+    Parameters:
+        segments (numpy.ndarray): (N, 4) array of x, y, end_x, end_y.
+
+    Returns:
+        tuple: The (M, 4) array of segments, the (M,) array of the index of the segment each one comes from,
+            and the (M,) array of the part of the original segment it is: 0 for a segment which was not split,
+            1 for the horizontal part and 2 for the vertical part.
+    """
+    diagonal = (segments[:, 0] != segments[:, 2]) & (segments[:, 1] != segments[:, 3])
+    source = np.repeat(np.arange(len(segments)), np.where(diagonal, 2, 1))
+    split_rows = np.flatnonzero(diagonal[source])
+    part = np.zeros(len(source), dtype=np.int8)
+    part[split_rows[::2]] = 1
+    part[split_rows[1::2]] = 2
+
+    split = segments[source]
+    horizontal = part == 1
+    vertical = part == 2
+    split[horizontal, 3] = split[horizontal, 1]
+    split[vertical, 0] = split[vertical, 2]
+    return split, source, part
+
+
+def split_diagonal_segments(wire_list):
+    """
+    Split the diagonal wires into a horizontal and a vertical wire. split_diagonal does the same on an array.
+
+    Parameters:
+        wire_list (list of dicts): The wires, with 'x', 'y', 'end_x' and 'end_y' keys.
+
+    Returns:
+        list of dicts: The wires, with each diagonal wire replaced by two wires.
+    """
+    # A single pass over the dicts: converting them to an array and back costs more than the split itself
+    new_wire_list = []
+    for segment in wire_list:
+        if segment['x'] != segment['end_x'] and segment['y'] != segment['end_y']:
+            new_wire_list.append({'x': segment['x'], 'y': segment['y'], 'end_x': segment['end_x'], 'end_y': segment['y']})
+            new_wire_list.append({'x': segment['end_x'], 'y': segment['y'],
+                                  'end_x': segment['end_x'], 'end_y': segment['end_y']})
+        else:
+            new_wire_list.append(segment)
+    return new_wire_list
@@ -0,0 +1,200 @@
+# Preprocessing of the images sent to the vision models.
+# Schematic drawings are mostly white paper with thin dark lines, so they are cropped to their content,
+# reduced to grayscale or 1-bit, downscaled to the size the models work at and re-encoded, which makes
+# the upload several times smaller. The MIME type sent with the image is the one of the encoded bytes.
+
+import base64
+import io
+import mimetypes
+import os
+
+from PIL import Image
+
+# The formats the vision APIs accept, by Pillow format name
+MIME_TYPES = {'PNG': 'image/png', 'JPEG': 'image/jpeg', 'GIF': 'image/gif', 'WEBP': 'image/webp'}
+
+# The vision models scale larger images down to fit 2048 x 2048 anyway
+DEFAULT_MAX_DIMENSION = 2048
+# Pixels darker than this are content, for cropping
+CROP_THRESHOLD = 245
+CROP_MARGIN = 8
+# An image is line art when this share of its pixels is close to black or white
+LINE_ART_RATIO = 0.9
+# Pixels darker than this are black in 1-bit images. It is above mid-gray so the anti-aliased edges of
+# thin lines stay black after downscaling
+BILEVEL_THRESHOLD = 192
+JPEG_QUALITY = 85
+
+
+class PreparedImage:
+    """
+    An image ready to be sent to a model.
+
+    Parameters:
+        data (bytes): The encoded image.
+        mime_type (str): The MIME type of data.
+        original_size (int): The size of the image file, in bytes.
+        steps (list of str): The preprocessing steps applied, for reporting.
+    """
+
+    def __init__(self, data, mime_type, original_size, steps=None):
+        self.data = data
+        self.mime_type = mime_type
+        self.original_size = original_size
+        self.steps = steps or []
+
+    @property
+    def size(self):
+        return len(self.data)
+
+    @property
+    def bytes_saved(self):
+        return self.original_size - self.size
+
+    def base64(self):
+        return base64.b64encode(self.data).decode('utf-8')
+
+    def data_url(self):
+        return f"data:{self.mime_type};base64,{self.base64()}"
+
+    def describe(self):
+        steps = ", ".join(self.steps) if self.steps else "unchanged"
+        percent = 100 * self.bytes_saved / self.original_size if self.original_size else 0
+        return (f"{self.original_size} -> {self.size} bytes ({self.mime_type}, {self.bytes_saved} bytes saved, "
+                f"{percent:.0f}%; {steps})")
+
+
+def flatten(image):
+    """Get the first frame of an image as RGB or L, with transparent areas made white."""
+    image.seek(0)
+    if image.mode in ('RGBA', 'LA', 'PA') or (image.mode == 'P' and 'transparency' in image.info):
+        rgba = image.convert('RGBA')
+        background = Image.new('RGBA', rgba.size, (255, 255, 255, 255))
+        return Image.alpha_composite(background, rgba).convert('RGB')
+    if image.mode in ('L', 'RGB'):
+        return image.copy()
+    return image.convert('RGB')
+
+
+def crop_to_content(image, threshold=CROP_THRESHOLD, margin=CROP_MARGIN):
+    """
+    Crop the white border around the drawing.
+
+    Parameters:
+        image (PIL.Image.Image): An RGB or L image.
+        threshold (int, optional): Pixels darker than this are content.
+        margin (int, optional): The border kept around the content, in pixels.
+
+    Returns:
+        PIL.Image.Image: The cropped image, or the image itself if there is nothing to crop.
+    """
+    content = image.convert('L').point(lambda value: 255 if value < threshold else 0)
+    box = content.getbbox()
+    if box is None:
+        return image
+    left, top, right, bottom = box
+    box = (max(left - margin, 0), max(top - margin, 0),
+           min(right + margin, image.width), min(bottom + margin, image.height))
+    if box == (0, 0, image.width, image.height):
+        return image
+    return image.crop(box)
+
+
+def is_line_art(gray_image, ratio=LINE_ART_RATIO):
+    """Check whether an L image is mostly black and white, like a scanned or drawn schematic."""
+    histogram = gray_image.histogram()
+    extremes = sum(histogram[:64]) + sum(histogram[192:])
+    return extremes >= ratio * sum(histogram)
+
+
+def encode(image, format, **options):
+    buffer = io.BytesIO()
+    image.save(buffer, format=format, **options)
+    return buffer.getvalue()
+
+
+def guess_mime_type(image_path, image_bytes):
+    """Get the MIME type of an image file from its content, or from its name."""
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            if image.format in MIME_TYPES:
+                return MIME_TYPES[image.format]
+    except Exception:
+        pass
+    return mimetypes.guess_type(image_path)[0] or 'image/png'
+
+
+def prepare_image(image_path, max_dimension=DEFAULT_MAX_DIMENSION, crop=True, line_art=None, preprocess=True):
+    """
+    Load an image file and make it as small as possible for a vision model.
+
+    Parameters:
+        image_path (str): The path to the image.
+        max_dimension (int, optional): The maximum width and height, larger images are downscaled. None keeps the size.
+        crop (bool, optional): Crop the white border around the drawing. Defaults to True.
+        line_art (bool, optional): Encode the image as 1-bit. Defaults to None, which detects line art.
+        preprocess (bool, optional): Set to False to send the file as it is, with its MIME type. Defaults to True.
+
+    Returns:
+        PreparedImage: The encoded image. The original file is used when nothing smaller could be made.
+    """
+    with open(image_path, 'rb') as image_file:
+        original = image_file.read()
+    original_mime_type = guess_mime_type(image_path, original)
+    if not preprocess:
+        return PreparedImage(original, original_mime_type, len(original))
+
+    with Image.open(io.BytesIO(original)) as source:
+        source_format = source.format
+        image = flatten(source)
+    steps = []
+    geometry_changed = False
+
+    if crop:
+        cropped = crop_to_content(image)
+        if cropped is not image:
+            steps.append(f"cropped {image.width}x{image.height} to {cropped.width}x{cropped.height}")
+            image = cropped
+            geometry_changed = True
+
+    if max_dimension and max(image.size) > max_dimension:
+        size = image.size
+        image.thumbnail((max_dimension, max_dimension), Image.LANCZOS)
+        steps.append(f"downscaled {size[0]}x{size[1]} to {image.width}x{image.height}")
+        geometry_changed = True
+
+    data, mime_type, encode_steps = encode_for_model(image, line_art)
+    # The original can only stand in for the result when it shows the same area at the same size
+    if not geometry_changed and source_format in MIME_TYPES and len(original) <= len(data):
+        return PreparedImage(original, MIME_TYPES[source_format], len(original), steps + encode_steps[:1] + ["kept original"])
+    return PreparedImage(data, mime_type, len(original), steps + encode_steps)
+
+
+def encode_for_model(image, line_art=None):
+    """
+    Encode an image in the smallest suitable format: 1-bit PNG for line art, else the smaller of PNG and JPEG.
+
+    Parameters:
+        image (PIL.Image.Image): An RGB or L image, see flatten.
+        line_art (bool, optional): Encode the image as 1-bit. Defaults to None, which detects line art.
+
+    Returns:
+        tuple: (encoded bytes, MIME type, list of the steps applied)
+    """
+    gray = image.convert('L')
+    if line_art is None:
+        line_art = is_line_art(gray)
+    if line_art:
+        steps = ["1-bit"]
+        bilevel = gray.point(lambda value: 255 if value >= BILEVEL_THRESHOLD else 0).convert('1', dither=Image.NONE)
+        candidates = [(encode(bilevel, 'PNG', optimize=True), 'PNG')]
+    else:
+        steps = ["grayscale" if image.mode == 'L' else "color"]
+        candidates = [(encode(image, 'PNG', optimize=True), 'PNG'),
+                      (encode(image, 'JPEG', quality=JPEG_QUALITY, optimize=True), 'JPEG')]
+    data, format = min(candidates, key=lambda candidate: len(candidate[0]))
+    return data, MIME_TYPES[format], steps + [f"{format} encoded"]
+
+
+def describe_image_file(image_path, prepared_image):
+    return f"Image {os.path.basename(image_path)}: {prepared_image.describe()}"
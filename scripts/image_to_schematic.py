@@ -1,122 +1,154 @@
 
-from scripts.LLMToSchematics import image_to_schematics, image_text_to_schematics, text_to_schematics
-import json
+# The model stage (scripts/LLMToSchematics.py) pulls in langchain, it is imported by the functions which call the
+# model so importing this module, eg: for the GUI, stays fast
 import scripts.kicad_utils as kicad_utils
-import skip
+import scripts.wire_routing as wire_routing
+from scripts import geometry
 import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-from scripts.symbol_search import symbol_search
+from scripts.lib_id_resolver import get_resolver
+from scripts.conversion_result import ConversionResult, as_conversion_result
+from scripts import tracing
 
 ################################## HELPER FUNCTIONS ################################
 # to be moved into respective files
 
 
-def find_component_in_schem(component_reference, skip_schematic):
-    for symbol in skip_schematic.symbol:
-        if symbol.property.Reference.value == component_reference:
-            return symbol
-
-
 def split_diagonal_segments(wire_list):
-    new_wire_list = []
-    for segment in wire_list:
-        # Check if the segment is diagonal
-        if segment['x'] != segment['end_x'] and segment['y'] != segment['end_y']:
-            # Split the diagonal segment into horizontal and vertical segments
-            horizontal_segment = {
-                'x': segment['x'], 'y': segment['y'], 'end_x': segment['end_x'], 'end_y': segment['y']}
-            vertical_segment = {'x': segment['end_x'], 'y': segment['y'],
-                                'end_x': segment['end_x'], 'end_y': segment['end_y']}
-            new_wire_list.append(horizontal_segment)
-            new_wire_list.append(vertical_segment)
-        else:
-            # Keep non-diagonal segments unchanged
-            new_wire_list.append(segment)
-    return new_wire_list
+    return geometry.split_diagonal_segments(wire_list)
 
 
 def scale_components(components, scaling_factor):
-    # Find the minimum and maximum x and y coordinates
-    min_x = min(component['x'] for component in components)
-    min_y = min(component['y'] for component in components)
-    
-    # Scale the components
-    scaled_components = []
-    for component in components:
-        scaled_x = min_x + (component['x'] - min_x) * scaling_factor
-        scaled_y = min_y + (component['y'] - min_y) * scaling_factor
-        scaled_component = component.copy()
-        scaled_component['x'] = int(scaled_x)
-        scaled_component['y'] = int(scaled_y)
-        scaled_components.append(scaled_component)
+    # Scale around the top left corner of the components
+    return geometry.scale_components(components, scaling_factor)
 
-    return scaled_components
 
 def scale_components_in_relative_coordinates(components, scaling_factor):
-    # Find the minimum and maximum x and y coordinates
-    # Scale the components
-    scaled_components = []
-    for component in components:
-        scaled_x = 20 + (component['x']) * scaling_factor
-        scaled_y = 20 + (component['y']) * scaling_factor
-        scaled_component = component.copy()
-        scaled_component['x'] = int(scaled_x)
-        scaled_component['y'] = int(scaled_y)
-        scaled_components.append(scaled_component)
-    
-    return scaled_components
+    # Grid cells of scaling_factor, starting at (20, 20)
+    return geometry.scale_components_in_relative_coordinates(components, scaling_factor, offset=20)
 
 
 
 def match_libId(raw_libid: str):
-    lib_id = raw_libid
-    if raw_libid == "resistor" or raw_libid == "R" or raw_libid== "Resistor":
-        lib_id = "Device:R"
-    elif raw_libid == "capacitor" or raw_libid == "C" or raw_libid == "C_Small":
-        lib_id = "Device:C"
-    elif "battery" == raw_libid or "cell" == raw_libid or "BAT" == raw_libid:
-        lib_id = "Device:Battery"
-    elif "led" == raw_libid or "LED" == raw_libid:
-        lib_id = "Device:LED"
-    elif "switch" == raw_libid or "SW" == raw_libid or "switch_spst" == raw_libid:
-        lib_id = "Switch:SW_SPST"
-    else:
-        lib_id = symbol_search.find_closest_matches(raw_libid)[0]
+    # Through the alias table (lib_id_aliases.yaml), then the fuzzy symbol search, see scripts/lib_id_resolver.py
+    return get_resolver().resolve(raw_libid)
+
+
+def resolve_lib_ids(result, lib_ids=None):
+    """
+    Replace the component names returned by the model with KiCad lib_ids. The original names are kept in 'lib_id_gpt'.
+    Each distinct name is matched once, see LibIdResolver.resolve_components.
+
+    Parameters:
+        result (dict): The SchematicsInformation returned by the model. Modified in place.
+        lib_ids (dict, optional): {name: lib_id} of the names already matched, see preload_symbol.
+
+    Returns:
+        dict: The same result.
+    """
+    lib_ids = lib_ids or {}
+    components = result['detected_components']
+    lib_ids = {**get_resolver().resolve_components(
+        [component for component in components if component['lib_id'] not in lib_ids]), **lib_ids}
+    for component in components:
+        component['lib_id_gpt'] = component['lib_id']
+        component['lib_id'] = lib_ids[component['lib_id']]
+    return result
 
+
+def preload_symbol(raw_libid):
+    """
+    Match a component name to a lib_id and load its symbol definition into the library cache, so placing
+    the component later does not read or parse the library.
+
+    Parameters:
+        raw_libid (str): The name of the component given by the model.
+
+    Returns:
+        str: The lib_id.
+    """
+    lib_id = match_libId(raw_libid)
+    try:
+        library_symbol = kicad_utils.get_library_symbol(lib_id)
+        library_symbol.pins
+        library_symbol.properties
+    except Exception as e:
+        # Placing the component reports the error
+        print(f"Could not preload {lib_id}: {e}")
     return lib_id
 
 
 ####################################################################################
 
-def get_json_from_image(image_path):
-    result = image_to_schematics(image_path)
-    for component in result['detected_components']:
-        component['lib_id_gpt'] = component['lib_id']
-        component['lib_id'] = match_libId(component['lib_id'])
-
-    with open('result.json', 'w') as f:
-        json.dump(result, f, indent=4)
+def finish_conversion(response, save_path=None, lib_ids=None):
+    """
+    Turn a model response into a ConversionResult with resolved lib_ids.
+
+    Parameters:
+        response (dict): The SchematicsInformation returned by the model.
+        save_path (str, optional): Where to save the result as JSON. Nothing is written by default.
+        lib_ids (dict, optional): {name: lib_id} of the names already matched, see resolve_lib_ids.
+
+    Returns:
+        ConversionResult: The result.
+    """
+    result = resolve_lib_ids(ConversionResult(response), lib_ids)
+    if save_path is not None:
+        result.save(save_path)
     return result
 
 
-def get_json_from_image_and_text(image_path, prompt):
-    result = image_text_to_schematics(image_path, prompt)
-    for component in result['detected_components']:
-        component['lib_id_gpt'] = component['lib_id']
-        component['lib_id'] = match_libId(component['lib_id'])
-    with open('result.json', 'w') as f:
-        json.dump(result, f, indent=4)
-    return result
+def get_json_from_image(image_path, use_cache=True, save_path=None):
+    from scripts.LLMToSchematics import image_to_schematics
+    return finish_conversion(image_to_schematics(image_path, use_cache=use_cache), save_path)
 
 
-def get_json_from_text(prompt):
-    result = text_to_schematics(prompt)
-    for component in result['detected_components']:
-        component['lib_id_gpt'] = component['lib_id']
-        component['lib_id'] = match_libId(component['lib_id'])
-    with open('result.json', 'w') as f:
-        json.dump(result, f, indent=4)
-    return result
+def get_json_from_image_streaming(image_path, use_cache=True, save_path=None, model=None, on_component=None):
+    """
+    Convert an image while streaming the model response. The lib_id of each component is matched, and its
+    symbol loaded, as soon as the component has arrived, while the model is still writing the connections.
+
+    Parameters:
+        image_path (str): The path to the image.
+        use_cache (bool, optional): Set to False to bypass the response cache. Defaults to True.
+        save_path (str, optional): Where to save the result as JSON. Nothing is written by default.
+        model (BaseChatModel, optional): The chat model, eg: a fake one. Defaults to the image model of the API in use.
+        on_component (function, optional): Also called with each component as it arrives, eg: to report progress.
+            An exception it raises stops the conversion.
+
+    Returns:
+        ConversionResult: The result.
+    """
+    from scripts.LLMToSchematics import image_to_schematics_streaming
+    preloads = {}
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        def preload(component):
+            raw_libid = component.get('lib_id')
+            if raw_libid is not None and raw_libid not in preloads:
+                preloads[raw_libid] = executor.submit(preload_symbol, raw_libid)
+            if on_component is not None:
+                on_component(component)
+
+        response = image_to_schematics_streaming(image_path, preload, use_cache=use_cache, model=model)
+        lib_ids = {raw_libid: future.result() for raw_libid, future in preloads.items()}
+    return finish_conversion(response, save_path, lib_ids)
+
+
+def get_json_from_image_tiled(image_path, rows=None, cols=None, use_cache=True, save_path=None):
+    # For large sheets: the image is converted in overlapping tiles, see scripts/tiling.py
+    from scripts.LLMToSchematics import image_to_schematics_tiled
+    return finish_conversion(image_to_schematics_tiled(image_path, rows=rows, cols=cols, use_cache=use_cache), save_path)
+
+
+def get_json_from_image_and_text(image_path, prompt, use_cache=True, save_path=None):
+    from scripts.LLMToSchematics import image_text_to_schematics
+    return finish_conversion(image_text_to_schematics(image_path, prompt, use_cache=use_cache), save_path)
+
+
+def get_json_from_text(prompt, use_cache=True, save_path=None):
+    from scripts.LLMToSchematics import text_to_schematics
+    return finish_conversion(text_to_schematics(prompt, use_cache=use_cache), save_path)
 
 
 def create_kicad_sch_file(components=None, wires=None, new_file_name=None):
@@ -125,69 +157,179 @@ def create_kicad_sch_file(components=None, wires=None, new_file_name=None):
     return kicad_schematic_path
 
 
-def add_components_to_schematic(path_to_json='result.json', kicad_schematic_path=None):
+def prepare_components(result):
+    """
+    Turn the detected components of a conversion result into the component dicts placed on the sheet.
+
+    Parameters:
+        result (ConversionResult): The result of the conversion.
+
+    Returns:
+        list of dicts: The components, scaled to sheet coordinates, see kicad_utils.add_component_to_document.
+    """
+    detected_components = result["detected_components"]
+    # Scaled as one array, the component dicts are built once with their sheet positions
+    positions = geometry.scale_positions(geometry.component_positions(detected_components), 10, offset=20).tolist()
+
+    list_of_component_dict = []
+    for symbol, (x, y) in zip(detected_components, positions):
+        angle = symbol["angle"]
+        # Change angle to 90 for all resistors having angle 0 and 0 for all resistors having angle 90
+        if symbol["lib_id"] == "Device:R":
+            angle = 90 if angle == 0 else 0
+        list_of_component_dict.append({"lib_id": symbol["lib_id"], "x": x, "y": y, "angle": angle,
+                                       "reference_name": symbol["reference"], "value": symbol["value"]})
+    return list_of_component_dict
+
+
+def add_result_to_document(document, result, add_wires=True):
+    """
+    Place the components of a conversion result on a schematic document, and wire their connections.
+    Pin locations are computed from the symbol definitions embedded in the document.
+
+    Parameters:
+        document (SchematicDocument): The schematic being edited.
+        result (ConversionResult): The result of the conversion.
+        add_wires (bool, optional): Whether to draw the connections. Defaults to True.
+
+    Returns:
+        list: The diagnostics of the connections which were skipped, see wire_routing.route_connections.
+    """
+    with tracing.span("component_placement") as span:
+        kicad_utils.add_components_to_document(document, prepare_components(result))
+        span.add("components", len(result["detected_components"]))
+    if not add_wires:
+        return []
+    return add_connections_to_document(document, result["component_connections"])
+
+
+def add_connections_to_document(document, connections):
+    """
+    Wire connections between the components placed on a schematic document.
+
+    Parameters:
+        document (SchematicDocument): The schematic being edited, with the components placed.
+        connections (list of dicts): The component_connections of a conversion result.
+
+    Returns:
+        list: The diagnostics of the connections which were skipped, see wire_routing.route_connections.
+    """
+    with tracing.span("wire_routing") as span:
+        references, pin_locations, pin_errors = wire_routing.index_document(document)
+        wire_list, diagnostics = wire_routing.route_connections(connections, references, pin_locations, pin_errors)
+        wire_routing.print_diagnostics(diagnostics, len(connections))
+        wires = split_diagonal_segments(wire_list)
+        for wire in wires:
+            kicad_utils.add_wire_to_document(document, wire)
+        span.add("connections", len(connections))
+        span.add("connections_skipped", len(diagnostics))
+        span.add("wires", len(wires))
+    return diagnostics
+
+
+def write_schematic(result, kicad_schematic_path=None, add_wires=True, create=False):
+    """
+    Add the components and wires of a conversion result to a schematic, reading and writing the file once.
+
+    Parameters:
+        result (ConversionResult): The result of the conversion.
+        kicad_schematic_path (str, optional): The KiCad schematic file to add to. A new temp_<uuid>.kicad_sch
+            file is created if not provided.
+        add_wires (bool, optional): Whether to draw the connections. Defaults to True.
+        create (bool, optional): Start from an empty schematic instead of reading kicad_schematic_path. Defaults to False.
+
+    Returns:
+        tuple: The path to the schematic, and the diagnostics of the connections which were skipped.
+    """
+    document = kicad_utils.load_kicad_sch_document(None if create else kicad_schematic_path)
+    diagnostics = add_result_to_document(document, as_conversion_result(result), add_wires=add_wires)
+    return kicad_utils.save_kicad_sch_document(document, kicad_schematic_path), diagnostics
+
+
+def write_schematic_streaming(image_path, kicad_schematic_path=None, add_wires=True, create=False, use_cache=True,
+                              save_path=None, model=None):
+    """
+    Convert an image and write its schematic while the model response is streamed. Each component is placed
+    as soon as it has arrived, so only the wires are left to do when the model is done.
+
+    Parameters:
+        image_path (str): The path to the image.
+        kicad_schematic_path (str, optional): The KiCad schematic file to add to. A new temp_<uuid>.kicad_sch
+            file is created if not provided.
+        add_wires (bool, optional): Whether to draw the connections. Defaults to True.
+        create (bool, optional): Start from an empty schematic instead of reading kicad_schematic_path. Defaults to False.
+        use_cache (bool, optional): Set to False to bypass the response cache. Defaults to True.
+        save_path (str, optional): Where to save the result as JSON. Nothing is written by default.
+        model (BaseChatModel, optional): The chat model, eg: a fake one. Defaults to the image model of the API in use.
+
+    Returns:
+        tuple: The result, the path to the schematic, and the diagnostics of the connections which were skipped.
+    """
+    from scripts.LLMToSchematics import image_to_schematics_streaming
+    document = kicad_utils.load_kicad_sch_document(None if create else kicad_schematic_path)
+    lib_ids = {}
+
+    def place(component):
+        raw_libid = component['lib_id']
+        if raw_libid not in lib_ids:
+            lib_ids[raw_libid] = match_libId(raw_libid)
+        resolved_component = {**component, 'lib_id': lib_ids[raw_libid]}
+        with tracing.span("component_placement", streaming=True) as span:
+            kicad_utils.add_component_to_document(document, prepare_components({"detected_components": [resolved_component]})[0])
+            span.add("components")
+
+    # A single worker, the document is edited by one thread at a time
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        placements = []
+        response = image_to_schematics_streaming(
+            image_path, lambda component: placements.append(executor.submit(place, component)),
+            use_cache=use_cache, model=model)
+        for placement in placements:
+            placement.result()
+
+    result = finish_conversion(response, save_path, lib_ids)
+    diagnostics = add_connections_to_document(document, result["component_connections"]) if add_wires else []
+    return result, kicad_utils.save_kicad_sch_document(document, kicad_schematic_path), diagnostics
+
+
+def add_components_to_schematic(path_to_json='result.json', kicad_schematic_path=None, result=None):
     _kicad_schematic_path = kicad_schematic_path
     if (_kicad_schematic_path == None):
         _kicad_schematic_path = "temp_" + uuid.uuid4().hex + ".kicad_sch"
 
-    with open('result.json', 'r') as f:
-        result = json.load(f)
-
-    # Populate the list of components
-    list_of_component_dict = []
-    for symbol in result["detected_components"]:
-        # Add the component to the list
-        list_of_component_dict.append({"lib_id": symbol["lib_id"], "x": symbol["x"], "y": symbol["y"],
-                                      "angle": symbol["angle"], "reference_name": symbol["reference"], "value": symbol["value"]})
-
-    # scaled_components = scale_components(list_of_component_dict, 0.2)
-    scaled_components = scale_components_in_relative_coordinates(list_of_component_dict, 10)
-
-    # Change angle t0 90 for all resistors having angle 0 and 0 for all resistors having angle 90
-    for component in scaled_components:
-        if component["lib_id"] == "Device:R":
-            if component["angle"] == 0:
-                component["angle"] = 90
-            else:
-                component["angle"] = 0
+    # The result is read from path_to_json only when it is not passed in memory
+    result = as_conversion_result(result, path_to_json)
 
     # Modify the kicad schematic file
     kicad_utils.modify_kicad_sch_file(
-        components=scaled_components, file_path=_kicad_schematic_path)
+        components=prepare_components(result), file_path=_kicad_schematic_path)
     return _kicad_schematic_path
 
 
-def add_wires_to_schematic(path_to_json='result.json', kicad_schematic_path=None):
-    with open('result.json', 'r') as f:
-        result = json.load(f)
-
-    # Load kicad schematic file into skip schematic
-    schem = skip.Schematic(kicad_schematic_path)
-    wire_list = []
-
-    # make a copy of detected connections
-    all_connections = result["component_connections"].copy()
-
-    for curr_component in schem.symbol:
-        print(curr_component.property.Reference.value)
-        curr_component_ref = curr_component.property.Reference.value
-        # Iterate through the list of detected connections
-        for curr_connection in all_connections:
-            # If curr component is compA in curr connection
-            if curr_connection['A_ref'] == curr_component_ref:
-                try:
-                    curr_component_A_pin = curr_component.pin[curr_connection['A_pin'] - 1]
-                    # Find component B
-                    curr_component_B = find_component_in_schem(
-                        curr_connection['B_ref'], schem)
-                    curr_component_B_pin = curr_component_B.pin[curr_connection['B_pin'] - 1]
-                    # Add a wire to connect
-
-                    wire_list.append({"x": curr_component_A_pin.location.x, "y": curr_component_A_pin.location.y,
-                                      "end_x": curr_component_B_pin.location.x, "end_y": curr_component_B_pin.location.y})
-                except:
-                    print("Skipped a wire")
-                    continue
-    new_wire_list = split_diagonal_segments(wire_list)
-    kicad_utils.modify_kicad_sch_file(
-        wires=new_wire_list, file_path=kicad_schematic_path)
+def add_wires_to_schematic(path_to_json='result.json', kicad_schematic_path=None, result=None):
+    """
+    Draw the connections of a conversion result as wires between the pins of the schematic's symbols.
+    Use write_schematic to add the components and the wires in a single write.
+
+    Parameters:
+        path_to_json (str, optional): The path to a saved result, used when result is None.
+        kicad_schematic_path (str): The path to the KiCad schematic file.
+        result (ConversionResult, optional): The result of the conversion.
+
+    Returns:
+        list: The diagnostics of the connections which were skipped, see wire_routing.route_connections.
+    """
+    result = as_conversion_result(result, path_to_json)
+
+    # Index the symbols of the schematic and their pin locations once
+    document = kicad_utils.load_kicad_sch_document(kicad_schematic_path)
+    references, pin_locations, pin_errors = wire_routing.index_document(document)
+
+    connections = result["component_connections"]
+    wire_list, diagnostics = wire_routing.route_connections(connections, references, pin_locations, pin_errors)
+    wire_routing.print_diagnostics(diagnostics, len(connections))
+
+    for wire in split_diagonal_segments(wire_list):
+        kicad_utils.add_wire_to_document(document, wire)
+    kicad_utils.save_kicad_sch_document(document, kicad_schematic_path)
+    return diagnostics
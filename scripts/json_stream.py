@@ -0,0 +1,125 @@
+# Incremental parsing of a JSON document which arrives in chunks, like a streamed model response.
+# Only the entries of one array are extracted, each as soon as its closing brace arrives, so work on the
+# first entries can start while the rest of the document is still being generated.
+
+import json
+
+WHITESPACE = " \t\r\n"
+
+
+class ArrayItemStream:
+    """
+    Yields the objects of the array under a key of a streamed JSON document, eg: "detected_components".
+    Text around the document, like the ```json fences of chat models, is ignored.
+
+    Parameters:
+        key (str): The key of the array.
+    """
+
+    def __init__(self, key):
+        self.marker = json.dumps(key)
+        self.buffer = ""
+        self.position = 0
+        self.state = "key"
+        self.item_start = None
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.items = []
+        self.malformed = 0
+
+    @property
+    def done(self):
+        """True once the closing bracket of the array has arrived."""
+        return self.state == "done"
+
+    def feed(self, text):
+        """
+        Add the next chunk of the document.
+
+        Parameters:
+            text (str): The chunk.
+
+        Returns:
+            list: The array entries completed by this chunk, parsed.
+        """
+        if self.state == "done":
+            return []
+        self.buffer += text
+        completed = []
+        buffer = self.buffer
+        while self.position < len(buffer) and self.state != "done":
+            if self.state == "key":
+                index = buffer.find(self.marker, self.position)
+                if index < 0:
+                    # Keep looking from where a marker cut by the chunk boundary could start
+                    self.position = max(self.position, len(buffer) - len(self.marker) + 1)
+                    break
+                self.position = index + len(self.marker)
+                self.state = "colon"
+            elif self.state in ("colon", "bracket"):
+                char = buffer[self.position]
+                self.position += 1
+                if char in WHITESPACE:
+                    continue
+                expected = ":" if self.state == "colon" else "["
+                if char != expected:
+                    # The key was a value somewhere else in the document, look for the next one
+                    self.state = "key"
+                    continue
+                self.state = "bracket" if self.state == "colon" else "array"
+            elif self.state == "array":
+                char = buffer[self.position]
+                self.position += 1
+                if char == "{":
+                    self.state = "item"
+                    self.item_start = self.position - 1
+                    self.depth = 1
+                elif char == "]":
+                    self.state = "done"
+            else:
+                self.position = self._scan_item(buffer, completed)
+        # The text before the entry being read, or the position, is not needed anymore. Dropping it keeps the
+        # buffer short, so appending a chunk does not copy the whole document received so far
+        consumed = self.item_start if self.state == "item" else self.position
+        if consumed:
+            self.buffer = buffer[consumed:]
+            self.position -= consumed
+            if self.state == "item":
+                self.item_start = 0
+        return completed
+
+    def _scan_item(self, buffer, completed):
+        # Only the characters which can end the entry matter: quotes, escapes and braces
+        position = self.position
+        in_string, escaped, depth = self.in_string, self.escaped, self.depth
+        for position in range(self.position, len(buffer)):
+            char = buffer[position]
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+                if depth == 0:
+                    try:
+                        item = json.loads(buffer[self.item_start:position + 1])
+                    except json.JSONDecodeError:
+                        # Eg: a trailing comma. The entry is not handed over early, it is left to the parse of
+                        # the whole response
+                        self.malformed += 1
+                    else:
+                        self.items.append(item)
+                        completed.append(item)
+                    self.state = "array"
+                    self.in_string, self.escaped, self.depth = False, False, 0
+                    return position + 1
+        self.in_string, self.escaped, self.depth = in_string, escaped, depth
+        return len(buffer)
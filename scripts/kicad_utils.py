@@ -26,29 +26,31 @@
 
 import uuid
 import os
-import yaml
+import numpy as np
+
+from scripts import sexpr
+from scripts.schematic_document import SchematicDocument
+from scripts import geometry
+from scripts.symbol_library import symbol_library_cache
+from scripts.settings import get_settings, load_settings
+from scripts import tracing
 
 def read_config(file_path):
     """
-    Read contents from the configuration.yaml file
+    Read contents from a configuration file. The pipeline itself uses the shared settings, see scripts/settings.py
 
     Parameters:
     file_path (str): Path to the configuration file
 
     Returns:
-    dict: A dictionary containing the configuration values
+    Settings: A read-only mapping of the configuration values
     """
 
-    with open(file_path, 'r') as file:
-        config = yaml.safe_load(file)
-    return config
-
+    return load_settings(file_path)
 
-# Path to the configuration file
-config_file_path = 'configuration.yaml'
 
-# Read the configuration
-config = read_config(config_file_path)
+# The configuration, read once per process
+config = get_settings()
 
 # Get the symbol library path from the configuration and expand the user path
 PATH_TO_SYMBOL_LIBRARY = os.path.expanduser(config['symbol_library_path'])
@@ -88,46 +90,36 @@ def print_all_files_in_symbol_library():
             print(file)
 
 
-def extract_subsection(content, subsection):
+def find_property_form(subsection, property_name):
     """
-    Extracts a subsection from the content based on the given subsection string.
+    Finds and parses the first (property "property_name" ...) form in a subsection.
 
     Parameters:
-        content (str): The content from which the subsection is to be extracted.
-        subsection (str): The string that marks the beginning of the subsection.
+        subsection (str): The subsection to search.
+        property_name (str): The name of the property.
 
     Returns:
-        list: A list containing the start index, end index, and the extracted subsection content.
-    
+        sexpr.Node: The parsed property, or None if it is not found.
     """
-    subsection_start = content.find(subsection)
-    if subsection_start == -1:
-        return None  # Symbol not found
-
-    balance = 0  # Track the balance of parentheses
-    for i in range(subsection_start, len(content)):
-        if content[i] == '(':
-            balance += 1
-        elif content[i] == ')':
-            balance -= 1
+    property_start = subsection.find(f'(property "{sexpr.escape(property_name)}"')
+    if property_start == -1:
+        return None
+    return sexpr.parse_form(subsection, property_start)
 
-        if balance == 0:
-            subsection_end = i + 1
-            return [subsection_start, subsection_end, content[subsection_start:subsection_end]]
-    return None
 
 # Extracts string which is the definition symbol template from Device.kicad_sym file
 
 
-def extract_symbol_definition(lib_id):
+def get_library_symbol(lib_id):
     """
-    Extracts the symbol definition from the symbol library file based on the given lib_id.
+    Gets the cached library symbol for the given lib_id. The library file is read only once per process
+    (and again if it changes on disk).
 
     Parameters:
-        lib_id (str): The lib_id of the symbol to be extracted.
+        lib_id (str): The lib_id of the symbol, eg: Device:R
 
     Returns:
-        str: The symbol definition string.
+        LibrarySymbol: The symbol from the library cache.
     """
 
     lib_name = lib_id.split(":")[0]  # Eg: Device
@@ -136,20 +128,28 @@ def extract_symbol_definition(lib_id):
     # This file is the reference which defines the properties of each component
     path_to_lib_kicad_sym_file = f"{PATH_TO_SYMBOL_LIBRARY}{lib_name}.kicad_sym"
 
-    # Read the symbol definition from the device file
-    with open(path_to_lib_kicad_sym_file, 'r') as file:
-        lib_file_content = file.read()
-
-    subsection = extract_subsection(
-        lib_file_content, f'(symbol "{symbol_name}"')
-    if subsection is not None:
-        symbol_def_string = subsection[2]
-        symbol_def_string = symbol_def_string.replace(
-            f'(symbol "{symbol_name}"', f'(symbol "{lib_id}"')
-        return symbol_def_string
-    else:
+    library_symbol = symbol_library_cache.get_symbol(path_to_lib_kicad_sym_file, symbol_name)
+    if library_symbol is None:
         raise Exception(
             f"Symbol {symbol_name} not found in {path_to_lib_kicad_sym_file}")
+    return library_symbol
+
+
+def extract_symbol_definition(lib_id):
+    """
+    Extracts the symbol definition from the symbol library file based on the given lib_id.
+
+    Parameters:
+        lib_id (str): The lib_id of the symbol to be extracted.
+
+    Returns:
+        str: The symbol definition string.
+    """
+    library_symbol = get_library_symbol(lib_id)
+    symbol_def_string = library_symbol.definition
+    symbol_def_string = symbol_def_string.replace(
+        f'(symbol "{library_symbol.name}"', f'(symbol "{lib_id}"')
+    return symbol_def_string
 
 
 def extract_property_value(subsection, property_name):
@@ -163,14 +163,10 @@ def extract_property_value(subsection, property_name):
     Returns:
         str: The value of the property.
     """
-    property_start = subsection.find(f'(property "{property_name}"') + 1
-    if property_start == -1:
+    property_form = find_property_form(subsection, property_name)
+    if property_form is None or len(property_form.atoms) < 2:
         return None  # Property not found
-
-    value_start = subsection.find(
-        '"', property_start + len(f'(property "{property_name}"'))
-    value_end = subsection.find('"', value_start + 1)
-    return subsection[value_start+1:value_end]
+    return property_form.atoms[1]
 
 ## Extract coordinates of Reference from the symbol library to use as offset (not always 100% accurate for now)
 def extract_property_coordinates(symbol_library, property_name):
@@ -186,23 +182,14 @@ def extract_property_coordinates(symbol_library, property_name):
         str: The coordinates of the property.
     """
 
-    start_index = symbol_library.find(f'(property "{property_name}"')
+    property_form = find_property_form(symbol_library, property_name)
+    at_form = property_form.find("at") if property_form is not None else None
 
-    # If the substring is found, continue to extract the values
-    if start_index != -1:
-        # Narrow down the search area to the part that contains the desired values
-        start_search_area = symbol_library.find('(at', start_index)
-        end_search_area = symbol_library.find(')', start_search_area)
-        
-        # Extract the substring containing the values
-        value_string = symbol_library[start_search_area:end_search_area]
+    # If the property is found, extract the values
+    if at_form is not None:
+        x, y, z = at_form.atoms[:3]
         
-        # Split the string to get the individual values
-        _, x, y, z = value_string.split()
-        
-        # Print the extracted values
         extracted_values = (float(x), float(y), float(z))
-        print(extracted_values)
     else:
         extracted_values = "The specified property was not found."
 
@@ -219,25 +206,7 @@ def count_pins_in_symbol(lib_id):
     Returns:
         int: The number of pins in the symbol.
     """
-    lib_name = lib_id.split(":")[0]  # Eg: Device
-    symbol_name = lib_id.split(":")[1]  # Eg: Battery_Cell
-    # Import Library Symbols Definitions
-    # This file is the reference which defines the properties of each component
-    path_to_lib_kicad_sym_file = f"{PATH_TO_SYMBOL_LIBRARY}{lib_name}.kicad_sym"
-
-    # Read the symbol definition from the device file
-    with open(path_to_lib_kicad_sym_file, 'r') as file:
-        lib_file_content = file.read()
-
-    subsection = extract_subsection(
-        lib_file_content, f'(symbol "{symbol_name}"')
-    if subsection is not None:
-        symbol_def_string = subsection[2]
-        pin_count = symbol_def_string.count("(pin ")
-        return pin_count
-    else:
-        raise Exception(
-            f"Symbol {symbol_name} not found in {path_to_lib_kicad_sym_file}")
+    return get_library_symbol(lib_id).pin_count
 
 def find_justification(symbol_library):
     
@@ -266,79 +235,101 @@ def find_justification(symbol_library):
         return None
 
 
-def add_component_to_kicad_sch_file(kicad_sch_file, component_dict):
-    # if symbol for component is not lib_symbol, add it
-    libSymbols = extract_subsection(kicad_sch_file, '(lib_symbols')
-    if libSymbols[2].find(f'component_dict["lib_id"]"') == -1:
-        libSymbols_insert_point = libSymbols[0] + len('(lib_symbols')
-        kicad_sch_file = kicad_sch_file[:libSymbols_insert_point] + \
-            f"\n {extract_symbol_definition(component_dict['lib_id'])} \n " + \
-            kicad_sch_file[libSymbols_insert_point:]
+def compute_label_positions(components):
+    """
+    Compute the positions of the Reference and Value fields of components, for all components at once.
+
+    Parameters:
+        components (list of dicts): The components, see add_component_to_document.
+
+    Returns:
+        list: ([reference x, reference y], [value x, value y]) for each component.
+    """
+    library_symbols = [get_library_symbol(component["lib_id"]) for component in components]
+    reference_offsets = np.array([symbol.property_coordinates("Reference")[:2] for symbol in library_symbols],
+                                 dtype=np.float64).reshape(-1, 2)
+    value_offsets = np.array([symbol.property_coordinates("Value")[:2] for symbol in library_symbols],
+                             dtype=np.float64).reshape(-1, 2)
+    angles = np.array([component["angle"] for component in components], dtype=np.float64)
+    references, values = geometry.label_positions([(component["x"], component["y"]) for component in components],
+                                                  angles, reference_offsets, value_offsets)
+    return list(zip(references, values))
+
+
+def add_components_to_document(document, components):
+    """
+    Add components to a schematic document. The field positions are computed in one batch.
+
+    Parameters:
+        document (SchematicDocument): The schematic being edited.
+        components (list of dicts): The components, see add_component_to_document.
+
+    Returns:
+        None
+    """
+    if not components:
+        return
+    for component_dict, label_positions in zip(components, compute_label_positions(components)):
+        add_component_to_document(document, component_dict, label_positions)
+
+
+def add_component_to_document(document, component_dict, label_positions=None):
+    """
+    Add a component to a schematic document.
+
+    Parameters:
+        document (SchematicDocument): The schematic being edited.
+        component_dict (dict): A dictionary representing the component to be added to the schematic.
+            The dictionary should contain the keys 'lib_id', 'x', 'y', 'angle', and 'reference_name'.
+            Example: {"lib_id": "Device:Ammeter_AC", "x": 133.35, "y": 64.77, "angle": 0, "reference_name": "BT1"}
+        label_positions (tuple, optional): The positions of the Reference and Value fields, see compute_label_positions.
+            Computed for this component alone if not provided.
 
+    Returns:
+        None
+    """
     # add symbol string
     curr_lib_id = component_dict["lib_id"]
+
+    # if symbol for component is not in lib_symbols, add it
+    if document.has_lib_symbol(curr_lib_id):
+        document.skip_lib_symbol(curr_lib_id)
+    else:
+        document.add_lib_symbol(curr_lib_id, extract_symbol_definition(curr_lib_id))
     
     # lib_name = component_dict["lib_id"].split(":")[0] #Eg: Device
     # symbol_name = component_dict["lib_id"].split(":")[1] #Eg: Battery_Cell
 
-    # get file uuid to add to instance section in the bottom of the file
-    uuid_section = extract_subsection(kicad_sch_file, '(uuid')
-    if uuid_section:
-        # Extract the UUID value
-        start = uuid_section[2].find('"') + 1  # Find the first quotation mark
-        # Find the second quotation mark
-        end = uuid_section[2].find('"', start)
-        uuid_value = uuid_section[2][start:end]
-
-    # get symbol value from lib_symbols
-    libSymbols = extract_subsection(kicad_sch_file, '(lib_symbols')
-    if libSymbols is None:
-        print("lib_symbols not found")
-        raise Exception("lib_symbols not found")
-
-    symbol_section = extract_subsection(
-        libSymbols[2], f'(symbol "{curr_lib_id}"')
-    if symbol_section is None:
-        # print("symbol_section? not found")
-        raise Exception(f'symbol_section (symbol "{curr_lib_id}" not found')
-
-    refCord = list(extract_property_coordinates(symbol_section[2], "Reference"))
-    valueCord = list(extract_property_coordinates(symbol_section[2], "Value"))
-    justify = find_justification(symbol_section[2])
-
-    y_offset = refCord[1]-valueCord[1] # offset between reference and value
-    y_offset = 1.7
-
-    if component_dict["angle"] != 0:
-        xs = abs(refCord[0]) + 2.54
-        refCord[1] = round(component_dict["y"]-y_offset-xs,2)
-        refCord[0] = round(component_dict["x"],2)
-        valueCord[1] = round(component_dict["y"]- xs,2)
-        valueCord[0] = round(component_dict["x"],2)
-        justify = None
-    else:
-        refCord[0] = round(refCord[0]+component_dict["x"],2) + 0.5
-        refCord[1] = round(refCord[1]+component_dict["y"],2)
-        valueCord[0] = round(valueCord[0]+component_dict["x"],2)
-        valueCord[1] = round(valueCord[1]+component_dict["y"],2)
+    # file uuid to add to instance section in the bottom of the file
+    uuid_value = document.uuid
+
+    # get symbol properties from the cached library definition
+    library_symbol = get_library_symbol(curr_lib_id)
+
+    if label_positions is None:
+        label_positions = compute_label_positions([component_dict])[0]
+    refCord, valueCord = label_positions
+
+    # Fields of rotated symbols are stacked above the symbol, without the library justification
+    justify = None
+    if component_dict["angle"] == 0:
+        justify = find_justification(library_symbol.definition)
 
-    description = extract_property_value(symbol_section[2], "Description")
+    description = library_symbol.property_value("Description")
 
     # get symbol description from lib_symbols
-    property_value = extract_property_value(symbol_section[2], "Value")
+    property_value = library_symbol.property_value("Value")
     
     # If no value is provided, use the default value from the symbol library
     if "value" not in component_dict:
         component_dict["value"] = property_value
 
-    # create a pin list for the symbol
-    pin_count = symbol_section[2].count("(pin ")
+    # create a pin list for the symbol, with the pin numbers of unit 1 so they match the library pins
     pin_uuid_list = ""
-    for i in range(pin_count): 
-        pin_uuid_list+=(f"(pin \"{i}\" (uuid {uuid.uuid4()})) \n")
+    for pin_number, _, _, _ in library_symbol.pins:
+        pin_uuid_list+=(f"(pin \"{sexpr.escape(pin_number)}\" (uuid {uuid.uuid4()})) \n")
 
     # TODO: set "at" of each property value = parsed_x + lib_symbol_property_x
-    # Currently adding 2 pins to all components. TODO: Check lib-symbols for number of pins and add accordingly.
     symbol_instance = f"""
 (symbol
         (lib_id "{component_dict["lib_id"]}")
@@ -359,7 +350,7 @@ def add_component_to_kicad_sch_file(kicad_sch_file, component_dict):
                 {"" if justify is None else f'(justify {justify})'}
             )
         )
-        (property "Value" "{component_dict["value"]}"
+        (property "Value" "{sexpr.escape(str(component_dict["value"]))}"
             (at {valueCord[0]} {valueCord[1]} {component_dict["angle"]})
             (effects
                 (font
@@ -386,7 +377,7 @@ def add_component_to_kicad_sch_file(kicad_sch_file, component_dict):
                 (hide yes)
             )
         )
-        (property "Description" "{description}"
+        (property "Description" "{sexpr.escape(str(description))}"
             (at 0 0 0)
             (effects
                 (font
@@ -409,27 +400,38 @@ def add_component_to_kicad_sch_file(kicad_sch_file, component_dict):
     )    
 """
 
-    libSymbols = extract_subsection(kicad_sch_file, '(lib_symbols')
-    symbol_insert_point = libSymbols[1] + 1
-    # print(f" the value of symbol_insert_point is {symbol_insert_point}")
-    kicad_sch_file = kicad_sch_file[:symbol_insert_point] + \
-        f"\n {symbol_instance} \n " + kicad_sch_file[symbol_insert_point:]
-    # print(kicad_sch_file)
-    return kicad_sch_file
+    document.add_symbol(symbol_instance)
 
 
-def add_wire_to_kicad_sch_file(kicad_sch_file, wire_dict):
+def add_component_to_kicad_sch_file(kicad_sch_file, component_dict):
     """
-    Add a wire to a KiCad schematic file.
+    Add a component to a KiCad schematic file.
 
     Parameters:
         kicad_sch_file (str): The content of the KiCad schematic file.
+        component_dict (dict): A dictionary representing the component to be added to the schematic.
+            See add_component_to_document.
+
+    Returns:
+        str: The modified KiCad schematic file content.
+    """
+    document = SchematicDocument(kicad_sch_file)
+    add_component_to_document(document, component_dict)
+    return document.to_string()
+
+
+def add_wire_to_document(document, wire_dict):
+    """
+    Add a wire to a schematic document.
+
+    Parameters:
+        document (SchematicDocument): The schematic being edited.
         wire_dict (dict): A dictionary representing the wire to be added to the schematic.
             The dictionary should contain the keys 'x', 'y', 'end_x', and 'end_y'.
             Example: {"x": 148.59, "y": 77.47, "end_x": 157.48, "end_y": 77.47}
 
     Returns:
-        str: The modified KiCad schematic file content.
+        None
     """
     wire_template = f"""(wire
 		(pts
@@ -441,11 +443,62 @@ def add_wire_to_kicad_sch_file(kicad_sch_file, wire_dict):
 		)
 		(uuid "{uuid.uuid4()}")
 	)"""
-    libSymbols = extract_subsection(kicad_sch_file, '(lib_symbols')
-    symbol_insert_point = libSymbols[1] + 1
-    kicad_sch_file = kicad_sch_file[:symbol_insert_point] + \
-        f"\n {wire_template} \n " + kicad_sch_file[symbol_insert_point:]
-    return kicad_sch_file
+    document.add_wire(wire_template)
+
+
+def add_wire_to_kicad_sch_file(kicad_sch_file, wire_dict):
+    """
+    Add a wire to a KiCad schematic file.
+
+    Parameters:
+        kicad_sch_file (str): The content of the KiCad schematic file.
+        wire_dict (dict): A dictionary representing the wire to be added to the schematic.
+            The dictionary should contain the keys 'x', 'y', 'end_x', and 'end_y'.
+            Example: {"x": 148.59, "y": 77.47, "end_x": 157.48, "end_y": 77.47}
+
+    Returns:
+        str: The modified KiCad schematic file content.
+    """
+    document = SchematicDocument(kicad_sch_file)
+    add_wire_to_document(document, wire_dict)
+    return document.to_string()
+
+
+def print_lib_symbols_savings(document):
+    """
+    Print how many bytes of duplicate lib_symbols definitions were not written to the file.
+
+    Parameters:
+        document (SchematicDocument): The schematic which was written.
+
+    Returns:
+        int: The number of bytes saved.
+    """
+    if document.lib_symbols_bytes_saved:
+        print(f"Embedded {len(document.lib_symbols)} lib_symbols definitions once each, "
+              f"saved {document.lib_symbols_bytes_saved} bytes of duplicates")
+    return document.lib_symbols_bytes_saved
+
+
+def write_kicad_sch_document(document, file_path):
+    """
+    Serialize a SchematicDocument and write it, in a schematic_write span.
+
+    Parameters:
+        document (SchematicDocument): The schematic.
+        file_path (str): Path to the KiCad schematic file.
+
+    Returns:
+        str: The content written.
+    """
+    with tracing.span("schematic_write", file=os.path.basename(file_path)) as span:
+        content = document.to_string()
+        with open(file_path, 'w') as file:
+            file.write(content)
+        span.add("bytes_written", len(content))
+        span.add("symbols_added", len(document.symbols))
+        span.add("wires_added", len(document.wires))
+    return content
 
 
 def create_kicad_sch_file(components=None, wires=None, new_file_name=None):
@@ -470,25 +523,57 @@ def create_kicad_sch_file(components=None, wires=None, new_file_name=None):
         wires = []
 
     # create empty kicad_sch file
-    temp_kicad_sch_file = create_empty_kicad_sch_template()
+    document = SchematicDocument(create_empty_kicad_sch_template())
 
     # add each element to kicad_file
-    for component in components:
-        temp_kicad_sch_file = add_component_to_kicad_sch_file(
-            temp_kicad_sch_file, component)
+    add_components_to_document(document, components)
 
     for wire in wires:
-        temp_kicad_sch_file = add_wire_to_kicad_sch_file(
-            temp_kicad_sch_file, wire)
+        add_wire_to_document(document, wire)
 
     # save temp file
     if new_file_name is not None:
         file_path = new_file_name + ".kicad_sch"
     else:
         file_path = f'temp_{uuid.uuid4()}.kicad_sch'
-    with open(file_path, 'w') as file:
-        file.write(temp_kicad_sch_file)
+    write_kicad_sch_document(document, file_path)
     print(f"Created file {file_path}")
+    print_lib_symbols_savings(document)
+    return file_path
+
+
+def load_kicad_sch_document(file_path=None):
+    """
+    Load a KiCad schematic file as a SchematicDocument, or create an empty one.
+
+    Parameters:
+        file_path (str, optional): Path to the KiCad schematic file. An empty schematic is created if not provided.
+
+    Returns:
+        SchematicDocument: The schematic.
+    """
+    if file_path is None:
+        return SchematicDocument(create_empty_kicad_sch_template())
+    with open(file_path, 'r') as file:
+        return SchematicDocument(file.read())
+
+
+def save_kicad_sch_document(document, file_path=None):
+    """
+    Write a SchematicDocument.
+
+    Parameters:
+        document (SchematicDocument): The schematic.
+        file_path (str, optional): Path to the KiCad schematic file. A temp_<uuid>.kicad_sch file is created if not provided.
+
+    Returns:
+        str: The path to the written file.
+    """
+    if file_path is None:
+        file_path = f'temp_{uuid.uuid4()}.kicad_sch'
+    write_kicad_sch_document(document, file_path)
+    print(f"Saved file {file_path}")
+    print_lib_symbols_savings(document)
     return file_path
 
 
@@ -514,21 +599,17 @@ def modify_kicad_sch_file(file_path, components=None, wires=None):
     if wires is None:
         wires = []
 
-    # create empty kicad_sch file
+    # read the existing kicad_sch file
     with open(file_path, 'r') as file:
-        temp_kicad_sch_file = file.read()
+        document = SchematicDocument(file.read())
 
     # add each element to kicad_file
-    for component in components:
-        temp_kicad_sch_file = add_component_to_kicad_sch_file(
-            temp_kicad_sch_file, component)
+    add_components_to_document(document, components)
 
     for wire in wires:
-        temp_kicad_sch_file = add_wire_to_kicad_sch_file(
-            temp_kicad_sch_file, wire)
+        add_wire_to_document(document, wire)
 
-    # save temp file
-    with open(file_path, 'w') as file:
-        file.write(temp_kicad_sch_file)
+    temp_kicad_sch_file = write_kicad_sch_document(document, file_path)
     print(f"Modified file {file_path}")
+    print_lib_symbols_savings(document)
     return temp_kicad_sch_file
@@ -0,0 +1,176 @@
+# Resolution of the component names given by the model ("resistor", "npn transistor") to KiCad lib_ids.
+# A detection result is resolved as a whole: its names are deduplicated, known names are looked up in the alias
+# table (lib_id_aliases.yaml, exact names), and only the remaining distinct names go through the fuzzy symbol
+# search. The fuzzy matches are memoized, in a bounded LRU shared by every conversion of the process, so the cost
+# follows the number of distinct part names, not the number of components.
+
+import threading
+from collections import OrderedDict
+
+import yaml
+
+from scripts.settings import get_settings
+from scripts.symbol_search import symbol_search
+from scripts import tracing
+
+DEFAULT_ALIASES_PATH = 'lib_id_aliases.yaml'
+DEFAULT_CACHE_SIZE = 1024
+
+_resolver = None
+_resolver_lock = threading.Lock()
+
+
+def search_key(raw_libid):
+    """The key of a component name in the cache of fuzzy matches: lower case, as the fuzzy search compares them."""
+    return raw_libid.lower()
+
+
+def load_aliases(file_path):
+    """
+    Read an alias table.
+
+    Parameters:
+        file_path (str): A YAML file of {lib_id: [name, ...]}.
+
+    Returns:
+        dict: {name: lib_id}.
+    """
+    with open(file_path, 'r') as file:
+        table = yaml.safe_load(file) or {}
+    aliases = {}
+    for lib_id, names in table.items():
+        for name in [names] if isinstance(names, str) else names:
+            aliases[str(name)] = lib_id
+    return aliases
+
+
+class LibIdResolver:
+    """
+    Matches component names to lib_ids, through the alias table and then the fuzzy symbol search.
+
+    Parameters:
+        aliases (dict): {name: lib_id}, see load_aliases.
+        search (SymbolSearch, optional): The fuzzy search. Defaults to the shared symbol_search.
+        cache_size (int, optional): The number of fuzzy matches kept. Defaults to 1024.
+    """
+
+    def __init__(self, aliases, search=symbol_search, cache_size=DEFAULT_CACHE_SIZE):
+        self.aliases = dict(aliases)
+        self.search = search
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, raw_libid):
+        """
+        Match one component name.
+
+        Parameters:
+            raw_libid (str): The name given by the model.
+
+        Returns:
+            str: The lib_id.
+        """
+        return self.resolve_names([raw_libid])[raw_libid]
+
+    def resolve_names(self, raw_libids):
+        """
+        Match component names, each distinct name once.
+
+        Parameters:
+            raw_libids (iterable of str): The names given by the model, with repeats.
+
+        Returns:
+            dict: {name: lib_id} of the distinct names.
+        """
+        with tracing.span("match_lib_id") as span:
+            lib_ids = {}
+            # {search key: [names]} of the names left for the fuzzy search
+            unresolved = {}
+            for raw_libid in dict.fromkeys(raw_libids):
+                # The alias table matches exact names, as the if/elif chain of match_libId did
+                lib_id = self.aliases.get(raw_libid)
+                key = search_key(raw_libid)
+                if lib_id is None:
+                    lib_id = self._cached(key)
+                if lib_id is not None:
+                    lib_ids[raw_libid] = lib_id
+                else:
+                    unresolved.setdefault(key, []).append(raw_libid)
+            span.add("names", len(lib_ids) + sum(len(names) for names in unresolved.values()))
+            span.add("fuzzy_searches", len(unresolved))
+
+            if not unresolved:
+                return lib_ids
+            for key, lib_id in self.search.find_closest_matches_batch(list(unresolved), top_n=1).items():
+                # The name is kept when the catalogue has no match at all
+                lib_id = lib_id[0] if lib_id else unresolved[key][0]
+                self._remember(key, lib_id)
+                for raw_libid in unresolved[key]:
+                    lib_ids[raw_libid] = lib_id
+        return lib_ids
+
+    def resolve_components(self, components):
+        """
+        Match the names of a list of detected components.
+
+        Parameters:
+            components (list of dicts): The detected_components of a model answer.
+
+        Returns:
+            dict: {name: lib_id} of the distinct names.
+        """
+        with tracing.span("resolve_lib_ids") as span:
+            span.add("components", len(components))
+            return self.resolve_names(component['lib_id'] for component in components)
+
+    def clear(self):
+        """Forget the fuzzy matches, eg: after the symbol catalogue changed."""
+        with self._lock:
+            self._cache.clear()
+
+    def _cached(self, key):
+        # The matches of a catalogue are not used with another one
+        key = (self.search.symbol_data_path, key)
+        with self._lock:
+            lib_id = self._cache.get(key)
+            if lib_id is None:
+                self.misses += 1
+                return None
+            self._cache.move_to_end(key)
+            self.hits += 1
+        tracing.current_span().add("cache_hits")
+        return lib_id
+
+    def _remember(self, key, lib_id):
+        key = (self.search.symbol_data_path, key)
+        with self._lock:
+            self._cache[key] = lib_id
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+
+def get_resolver():
+    """
+    Get the resolver shared by every conversion, creating it on first use from the lib_id_aliases and
+    lib_id_cache_size settings.
+
+    Returns:
+        LibIdResolver: The resolver.
+    """
+    global _resolver
+    if _resolver is None:
+        with _resolver_lock:
+            if _resolver is None:
+                settings = get_settings()
+                aliases_path = settings.get('lib_id_aliases', DEFAULT_ALIASES_PATH)
+                try:
+                    aliases = load_aliases(aliases_path)
+                except FileNotFoundError:
+                    print(f"Alias table {aliases_path} not found, every component name is matched with a fuzzy search")
+                    aliases = {}
+                _resolver = LibIdResolver(aliases, cache_size=settings.get('lib_id_cache_size', DEFAULT_CACHE_SIZE))
+    return _resolver
@@ -0,0 +1,145 @@
+# Persistent cache of parsed LLM responses.
+# Entries are keyed by a hash of everything that determines the answer: the image bytes, the prompt,
+# the model, the temperature and the format instructions. Each entry is one JSON file in the cache
+# directory; the oldest entries are evicted when the cache grows past its size or age limits.
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+
+class ResponseCache:
+    """
+    Content-addressed cache of parsed model responses (SchematicsInformation dictionaries).
+
+    Parameters:
+        cache_dir (str): The directory holding the cache entries.
+        max_entries (int, optional): The maximum number of entries kept. Defaults to 500.
+        max_bytes (int, optional): The maximum total size of the entries. Defaults to 50 MB.
+        max_age (float, optional): The age in seconds after which an entry is not used anymore. Defaults to 30 days.
+    """
+
+    def __init__(self, cache_dir, max_entries=500, max_bytes=50 * 1024 * 1024, max_age=30 * 24 * 3600):
+        self.cache_dir = cache_dir
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(prompt, model, temperature, format_instructions, image_bytes=None, base_url=None):
+        """
+        Compute the cache key of a model call.
+
+        Parameters:
+            prompt (str): The prompt text.
+            model (str): The model name.
+            temperature (float): The sampling temperature.
+            format_instructions (str): The output format instructions sent with the prompt.
+            image_bytes (bytes, optional): The content of the image file, for vision calls.
+            base_url (str, optional): The endpoint the model is called at, eg: a proxy or a local fake server.
+
+        Returns:
+            str: The hex digest identifying the call.
+        """
+        digest = hashlib.sha256()
+        for part in (prompt, model, repr(temperature), format_instructions, base_url or ''):
+            encoded = part.encode('utf-8')
+            # Length prefixes keep the boundaries between the parts unambiguous
+            digest.update(len(encoded).to_bytes(8, 'little'))
+            digest.update(encoded)
+        if image_bytes is not None:
+            digest.update(len(image_bytes).to_bytes(8, 'little'))
+            digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def get(self, key):
+        """
+        Get a cached response.
+
+        Parameters:
+            key (str): The cache key, see make_key.
+
+        Returns:
+            dict: The cached response, or None if it is not cached or has expired.
+        """
+        path = self._entry_path(key)
+        try:
+            age = time.time() - os.path.getmtime(path)
+            if age > self.max_age:
+                os.remove(path)
+                raise FileNotFoundError(path)
+            with open(path, 'r') as f:
+                value = json.load(f)
+            # Refresh the entry so eviction removes the least recently used entries first
+            os.utime(path)
+        except (OSError, ValueError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return value
+
+    def put(self, key, value):
+        """
+        Store a response, then evict old entries if the cache is over its limits.
+
+        Parameters:
+            key (str): The cache key, see make_key.
+            value (dict): The parsed response. Must be JSON serializable.
+
+        Returns:
+            None
+        """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self._entry_path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(value, f)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove expired entries, then the least recently used ones until the cache is within its limits."""
+        with self._lock:
+            try:
+                names = [name for name in os.listdir(self.cache_dir) if name.endswith(".json")]
+            except FileNotFoundError:
+                return
+            entries = []
+            for name in names:
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+            entries.sort()
+
+            now = time.time()
+            total_bytes = sum(size for _, size, _ in entries)
+            remaining = len(entries)
+            for mtime, size, path in entries:
+                if now - mtime <= self.max_age and remaining <= self.max_entries and total_bytes <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                remaining -= 1
+                total_bytes -= size
+
+    def clear(self):
+        """Remove all the entries."""
+        with self._lock:
+            if not os.path.isdir(self.cache_dir):
+                return
+            for name in os.listdir(self.cache_dir):
+                if name.endswith(".json"):
+                    os.remove(os.path.join(self.cache_dir, name))
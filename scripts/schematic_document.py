@@ -0,0 +1,114 @@
+# In-memory model of a kicad_sch file.
+# The text of an existing file is split once into the part before (lib_symbols ...), the library
+# symbol definitions, and the rest of the file. New definitions, symbol instances and wires are
+# appended in O(1) and the whole file is written once by to_string(), instead of
+# splicing every element into the full schematic string.
+# lib_symbols is a registry keyed by lib_id, so each definition is embedded exactly once no matter
+# how many instances of the part are placed.
+
+from scripts import sexpr
+
+
+class SchematicDocument:
+    """
+    A kicad_sch file being edited.
+
+    Attributes:
+        uuid (str): The uuid of the root sheet.
+        lib_symbols (dict): {lib_id: (symbol ...) definition} of the definitions inside (lib_symbols ...).
+        lib_symbols_bytes_saved (int): The size of the duplicate definitions which were not written.
+        symbols (list of str): The (symbol ...) instances added to the sheet.
+        wires (list of str): The (wire ...) forms added to the sheet.
+    """
+
+    def __init__(self, kicad_sch_file):
+        """
+        Parameters:
+            kicad_sch_file (str): The content of the KiCad schematic file.
+        """
+        # Top-level forms only, so a "(lib_symbols" or "(uuid" inside a quoted string or a nested form is not matched
+        lib_symbols_span = sexpr.find_form(kicad_sch_file, "lib_symbols")
+        if lib_symbols_span is None:
+            print("lib_symbols not found")
+            raise Exception("lib_symbols not found")
+        # The uuid of the root sheet comes before lib_symbols
+        uuid_span = sexpr.find_form(kicad_sch_file, "uuid", end=lib_symbols_span[0])
+
+        self.uuid = sexpr.parse_form(kicad_sch_file, uuid_span[0]).name if uuid_span is not None else None
+        self.lib_symbols = {}
+        self.lib_symbols_bytes_saved = 0
+        # Definitions already in the file are registered too, duplicates left by older versions are dropped
+        for _, lib_id, start, end in sexpr.scan_forms(kicad_sch_file, depth=1,
+                                                       start=lib_symbols_span[0], end=lib_symbols_span[1]):
+            if lib_id in self.lib_symbols:
+                self.lib_symbols_bytes_saved += end - start
+            else:
+                self.lib_symbols[lib_id] = kicad_sch_file[start:end]
+        self.symbols = []
+        self.wires = []
+        # Everything before (lib_symbols and after its closing parenthesis is kept as it is
+        self._head = kicad_sch_file[:lib_symbols_span[0]]
+        self._tail = kicad_sch_file[lib_symbols_span[1]:]
+
+    def has_lib_symbol(self, lib_id):
+        return lib_id in self.lib_symbols
+
+    def add_lib_symbol(self, lib_id, symbol_definition):
+        """
+        Embed a symbol definition in lib_symbols, unless one is already registered for the lib_id.
+
+        Parameters:
+            lib_id (str): The lib_id of the symbol, eg: Device:R
+            symbol_definition (str): The (symbol "lib_id" ...) definition.
+
+        Returns:
+            bool: True if the definition was added.
+        """
+        if lib_id in self.lib_symbols:
+            self.lib_symbols_bytes_saved += len(symbol_definition)
+            return False
+        self.lib_symbols[lib_id] = symbol_definition
+        return True
+
+    def skip_lib_symbol(self, lib_id):
+        """Record that another instance of an already embedded lib_id did not add a copy of its definition."""
+        self.lib_symbols_bytes_saved += len(self.lib_symbols[lib_id])
+
+    def add_symbol(self, symbol_instance):
+        self.symbols.append(symbol_instance)
+
+    def add_wire(self, wire):
+        self.wires.append(wire)
+
+    def iter_symbol_instances(self):
+        """
+        Iterate over the symbol instances of the sheet: the ones already in the file, then the added ones.
+
+        Returns:
+            generator: The (symbol ...) instances, as text.
+        """
+        for head, _, start, end in sexpr.scan_forms(self._tail, depth=0):
+            if head == "symbol":
+                yield self._tail[start:end]
+        yield from self.symbols
+
+    def to_string(self):
+        """
+        Serialize the document.
+
+        Returns:
+            str: The content of the KiCad schematic file.
+        """
+        parts = [self._head, "(lib_symbols"]
+        for symbol_definition in self.lib_symbols.values():
+            parts.append("\n ")
+            parts.append(symbol_definition)
+        parts.append("\n    )")
+        for symbol_instance in self.symbols:
+            parts.append("\n ")
+            parts.append(symbol_instance)
+        for wire in self.wires:
+            parts.append("\n ")
+            parts.append(wire)
+        parts.append(self._tail)
+        return "".join(parts)
@@ -0,0 +1,73 @@
+# The settings of configuration.yaml, read once per process and shared by every module.
+# The settings cannot be changed once loaded, so they are safe to share between threads and are the
+# same for every part of the pipeline.
+
+import os
+from collections.abc import Mapping
+from types import MappingProxyType
+
+import yaml
+
+# Path to the configuration file
+config_file_path = 'configuration.yaml'
+
+_settings = None
+
+
+class Settings(Mapping):
+    """
+    Read-only view of the configuration file: settings["symbol_library_path"], settings.get("llm_cache", True).
+
+    Parameters:
+        values (dict): The settings.
+        path (str, optional): The file they were read from.
+    """
+
+    def __init__(self, values, path=None):
+        self._values = MappingProxyType(dict(values or {}))
+        self.path = path
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def __len__(self):
+        return len(self._values)
+
+    def __repr__(self):
+        return f"Settings({self.path!r}, {sorted(self._values)})"
+
+    @property
+    def symbol_library_path(self):
+        """The KiCad symbol library directory, with ~ expanded."""
+        path = self.get('symbol_library_path')
+        return os.path.expanduser(path) if path else None
+
+
+def load_settings(file_path):
+    """
+    Read a configuration file.
+
+    Parameters:
+        file_path (str): The path to the YAML file.
+
+    Returns:
+        Settings: The settings.
+    """
+    with open(file_path, 'r') as file:
+        return Settings(yaml.safe_load(file), file_path)
+
+
+def get_settings():
+    """
+    Get the settings of configuration.yaml, reading the file on first use.
+
+    Returns:
+        Settings: The settings, shared by all callers.
+    """
+    global _settings
+    if _settings is None:
+        _settings = load_settings(config_file_path)
+    return _settings
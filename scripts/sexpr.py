@@ -0,0 +1,251 @@
+# Minimal S-expression tokenizer and parser for KiCad files (.kicad_sch, .kicad_sym).
+#
+# KiCad files are nested lists such as (symbol "Device:R" (pin_numbers hide) (property "Reference" "R" ...)).
+# Every list starts with a head atom (symbol, property, at, ...) which is often followed by a name.
+# Quoted strings may contain parentheses and backslash escapes (\" and \\), which must not be
+# counted as structure.
+#
+# The tokenizer is a single compiled regex, so scanning is linear and runs mostly in C.
+# Nodes keep their source offsets, so callers can cut the original text of any form
+# without re-serializing it.
+
+import re
+
+# Structure only: parentheses and quoted strings (skipped as a whole)
+STRUCTURE_PATTERN = re.compile(r'[()]|"[^"\\]*(?:\\.[^"\\]*)*"')
+# Full tokenizer: parentheses, quoted strings and bare atoms
+TOKEN_PATTERN = re.compile(r'([()])|"([^"\\]*(?:\\.[^"\\]*)*)"|([^\s()"]+)')
+# Head atom and optional name of a form, matched at its opening parenthesis
+HEAD_PATTERN = re.compile(r'\(\s*([^\s()"]+)(?:\s+(?:"([^"\\]*(?:\\.[^"\\]*)*)"|([^\s()"]+)))?')
+ESCAPE_PATTERN = re.compile(r'\\(.)')
+
+
+def unescape(value):
+    """Remove the backslash escapes of a quoted string."""
+    if '\\' not in value:
+        return value
+    return ESCAPE_PATTERN.sub(r'\1', value)
+
+
+def escape(value):
+    """Escape a string so it can be written between double quotes."""
+    return value.replace('\\', '\\\\').replace('"', '\\"')
+
+
+class Node:
+    """
+    A parsed (head ...) form.
+
+    children holds the items after the head: nested Node objects and atoms (str).
+    Quoted strings are unescaped, bare atoms are kept as they are.
+    start and end are the offsets of the form in the parsed text, end is exclusive.
+    """
+    __slots__ = ('head', 'children', 'start', 'end')
+
+    def __init__(self, head, start):
+        self.head = head
+        self.children = []
+        self.start = start
+        self.end = None
+
+    @property
+    def name(self):
+        """The first item after the head if it is an atom, eg: "R" for (symbol "R" ...)."""
+        if self.children and isinstance(self.children[0], str):
+            return self.children[0]
+        return None
+
+    @property
+    def atoms(self):
+        """The atoms of this form, without nested forms."""
+        return [child for child in self.children if isinstance(child, str)]
+
+    def find(self, head, name=None):
+        """Return the first direct child form with the given head (and name), or None."""
+        for child in self.children:
+            if isinstance(child, Node) and child.head == head and (name is None or child.name == name):
+                return child
+        return None
+
+    def find_all(self, head):
+        """Return all direct child forms with the given head."""
+        return [child for child in self.children if isinstance(child, Node) and child.head == head]
+
+    def iter_all(self, head):
+        """Yield all forms with the given head in this subtree, at any depth."""
+        for child in self.children:
+            if isinstance(child, Node):
+                if child.head == head:
+                    yield child
+                yield from child.iter_all(head)
+
+    def __repr__(self):
+        return f'<Node ({self.head} {self.name!r}) [{self.start}:{self.end}]>'
+
+
+def tokenize(text, start=0, end=None):
+    """
+    Split text into tokens.
+
+    Parameters:
+        text (str): The text to tokenize.
+        start (int, optional): The index to start at. Defaults to 0.
+        end (int, optional): The index to stop at. Defaults to the end of the text.
+
+    Returns:
+        generator: (kind, value, offset) tuples. kind is '(' or ')' for parentheses,
+        'string' for quoted strings (value is unescaped) and 'atom' for bare atoms.
+    """
+    if end is None:
+        end = len(text)
+    for match in TOKEN_PATTERN.finditer(text, start, end):
+        paren, string, atom = match.groups()
+        if paren is not None:
+            yield paren, paren, match.start()
+        elif string is not None:
+            yield 'string', unescape(string), match.start()
+        else:
+            yield 'atom', atom, match.start()
+
+
+def parse(text, start=0, end=None):
+    """
+    Parse all forms in text into a node tree.
+
+    Parameters:
+        text (str): The text to parse.
+        start (int, optional): The index to start at. Defaults to 0.
+        end (int, optional): The index to stop at. Defaults to the end of the text.
+
+    Returns:
+        list: The top-level Node objects.
+    """
+    forms = []
+    stack = []
+    expect_head = False
+    for kind, value, offset in tokenize(text, start, end):
+        if kind == '(':
+            node = Node(None, offset)
+            if stack:
+                stack[-1].children.append(node)
+            else:
+                forms.append(node)
+            stack.append(node)
+            expect_head = True
+        elif kind == ')':
+            if not stack:
+                raise ValueError(f"Unexpected ')' at offset {offset}")
+            stack.pop().end = offset + 1
+            expect_head = False
+        elif expect_head:
+            stack[-1].head = value
+            expect_head = False
+        elif stack:
+            stack[-1].children.append(value)
+    if stack:
+        raise ValueError(f"Unclosed '(' at offset {stack[-1].start}")
+    return forms
+
+
+def parse_form(text, start=0):
+    """
+    Parse the single form whose opening parenthesis is at the given index.
+
+    Parameters:
+        text (str): The text containing the form.
+        start (int, optional): The index of the opening parenthesis. Defaults to 0.
+
+    Returns:
+        Node: The parsed form.
+    """
+    end = form_end(text, start)
+    if end is None:
+        raise ValueError(f"Unclosed '(' at offset {start}")
+    return parse(text, start, end)[0]
+
+
+def form_end(text, start):
+    """
+    Find the end of the form starting at the given index, ignoring parentheses inside quoted strings.
+
+    Parameters:
+        text (str): The text containing the form.
+        start (int): The index of the opening parenthesis of the form.
+
+    Returns:
+        int: The index just after the matching closing parenthesis, or None if it is not balanced.
+    """
+    balance = 0
+    for match in STRUCTURE_PATTERN.finditer(text, start):
+        token = match.group()
+        if token == '(':
+            balance += 1
+        elif token == ')':
+            balance -= 1
+            if balance == 0:
+                return match.end()
+    return None
+
+
+def scan_forms(text, depth=1, start=0, end=None):
+    """
+    Scan text once and yield the forms at the given depth, without building a tree.
+
+    Parameters:
+        text (str): The text to scan.
+        depth (int, optional): The nesting depth of the forms to yield. Top-level forms are at
+            depth 0, so the default yields the children of the root form (eg: the symbols of
+            a kicad_symbol_lib, or the lib_symbols/wire/symbol forms of a kicad_sch).
+        start (int, optional): The index to start at. Defaults to 0.
+        end (int, optional): The index to stop at. Defaults to the end of the text.
+
+    Returns:
+        generator: (head, name, start, end) tuples in source order. name is the first atom
+        after the head (unescaped), or None.
+    """
+    if end is None:
+        end = len(text)
+    level = 0
+    form_start = None
+    for match in STRUCTURE_PATTERN.finditer(text, start, end):
+        token = match.group()
+        if token == '(':
+            if level == depth:
+                form_start = match.start()
+            level += 1
+        elif token == ')':
+            level -= 1
+            if level == depth and form_start is not None:
+                head_match = HEAD_PATTERN.match(text, form_start)
+                head, name = None, None
+                if head_match is not None:
+                    head = head_match.group(1)
+                    if head_match.group(2) is not None:
+                        name = unescape(head_match.group(2))
+                    else:
+                        name = head_match.group(3)
+                yield head, name, form_start, match.end()
+                form_start = None
+            elif level < 0:
+                return
+
+
+def find_form(text, head, name=None, depth=1, start=0, end=None):
+    """
+    Find the first form with the given head (and name) at the given depth, in one pass.
+
+    Parameters:
+        text (str): The text to search.
+        head (str): The head of the form, eg: "symbol".
+        name (str, optional): The name of the form, eg: "R". Defaults to any name.
+        depth (int, optional): The nesting depth of the form. Defaults to 1 (children of the root form).
+        start (int, optional): The index to start at. Defaults to 0.
+        end (int, optional): The index to stop at. Defaults to the end of the text.
+
+    Returns:
+        tuple: (start, end) of the form, or None if it is not found.
+    """
+    for form_head, form_name, form_start, form_end_index in scan_forms(text, depth, start, end):
+        if form_head == head and (name is None or form_name == name):
+            return form_start, form_end_index
+    return None
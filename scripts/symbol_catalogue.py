@@ -0,0 +1,143 @@
+# Builds the symbol catalogue (the content of symbol_data.json) from a directory of .kicad_sym files.
+# Library files are parsed in a process pool, and a manifest records the mtime, size and symbol
+# names of every file, so a rebuild only re-parses the files which changed since the last build.
+
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+MANIFEST_VERSION = 1
+SYMBOL_NAME_PATTERN = re.compile(r'\(symbol\s+"([^"]+)"')
+
+
+def is_sub_unit(symbol_name, parent_name):
+    """
+    Check whether a symbol is a unit of the previous top-level symbol.
+    KiCad names units "<parent>_<unit>_<body style>", eg: R_0_1 and R_1_1 are units of R.
+
+    Parameters:
+        symbol_name (str): The name of the symbol.
+        parent_name (str): The name of the previous top-level symbol.
+
+    Returns:
+        bool: True if the symbol is a unit of the parent.
+    """
+    if not parent_name or not symbol_name.startswith(parent_name) or len(symbol_name) <= len(parent_name) + 1:
+        return False
+    if symbol_name[len(parent_name)] != "_":
+        return False
+    unit, _, style = symbol_name[len(parent_name) + 1:].partition("_")
+    return unit.isdigit() and style.isdigit()
+
+
+def extract_top_level_symbol_names(content):
+    """
+    Extract the names of the top-level symbols from the content of a .kicad_sym file, in one pass.
+
+    Parameters:
+        content (str): The content of the library file.
+
+    Returns:
+        list: The symbol names, in file order.
+    """
+    symbol_names = []
+    previous_symbol = ""
+    for symbol_match in SYMBOL_NAME_PATTERN.findall(content):
+        if is_sub_unit(symbol_match, previous_symbol):
+            continue
+        previous_symbol = symbol_match
+        symbol_names.append(symbol_match)
+    return symbol_names
+
+
+def scan_library_file(file_path):
+    """
+    Read a library file and extract its top-level symbol names. Runs in the worker processes.
+
+    Parameters:
+        file_path (str): The path to the .kicad_sym file.
+
+    Returns:
+        list: The symbol names.
+    """
+    with open(file_path, "r") as f:
+        return extract_top_level_symbol_names(f.read())
+
+
+def load_manifest(manifest_path, directory_path):
+    """
+    Load the manifest of a previous build.
+
+    Parameters:
+        manifest_path (str): The path to the manifest file.
+        directory_path (str): The symbol library directory the catalogue is built from.
+
+    Returns:
+        dict: {filename: {"mtime_ns": int, "size": int, "symbols": list}}, empty if there is no usable manifest.
+    """
+    if manifest_path is None or not os.path.exists(manifest_path):
+        return {}
+    try:
+        with open(manifest_path, "r") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if manifest.get("version") != MANIFEST_VERSION or manifest.get("directory") != os.path.abspath(directory_path):
+        return {}
+    return manifest.get("files", {})
+
+
+def save_manifest(manifest_path, directory_path, files):
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump({"version": MANIFEST_VERSION, "directory": os.path.abspath(directory_path), "files": files}, f)
+    os.replace(temp_path, manifest_path)
+
+
+def build_symbol_catalogue(directory_path, manifest_path=None, max_workers=None):
+    """
+    Build the symbol catalogue of a directory of KiCad symbol files.
+
+    Parameters:
+        directory_path (str): The path to the directory containing the KiCad symbol files.
+        manifest_path (str, optional): The path to the manifest of the previous build. Files whose mtime and
+            size did not change are not parsed again. The manifest is updated after the build.
+        max_workers (int, optional): The number of worker processes. Defaults to the number of CPUs.
+
+    Returns:
+        dict: The symbol data, {"symbols": [{"lib": lib_name, "symbols": [symbol names]}, ...]}, libraries sorted by name.
+    """
+    previous_files = load_manifest(manifest_path, directory_path)
+
+    files = {}
+    changed = []
+    for filename in sorted(os.listdir(directory_path)):
+        if not filename.endswith(".kicad_sym"):
+            continue
+        stat = os.stat(os.path.join(directory_path, filename))
+        entry = {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "symbols": None}
+        previous = previous_files.get(filename)
+        if previous is not None and previous["mtime_ns"] == entry["mtime_ns"] and previous["size"] == entry["size"]:
+            entry["symbols"] = previous["symbols"]
+        else:
+            changed.append(filename)
+        files[filename] = entry
+
+    paths = [os.path.join(directory_path, filename) for filename in changed]
+    if len(paths) > 1:
+        with ProcessPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(scan_library_file, paths, chunksize=4))
+    else:
+        # Not worth starting worker processes for a single file
+        results = [scan_library_file(path) for path in paths]
+    for filename, symbols in zip(changed, results):
+        files[filename]["symbols"] = symbols
+
+    print(f"Symbol catalogue: {len(files)} libraries, {len(changed)} parsed, {len(files) - len(changed)} unchanged")
+    if manifest_path is not None:
+        save_manifest(manifest_path, directory_path, files)
+
+    # Extract the library name from the file name
+    return {"symbols": [{"lib": filename.split(".")[0], "symbols": entry["symbols"]}
+                        for filename, entry in files.items() if entry["symbols"]]}
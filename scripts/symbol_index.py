@@ -0,0 +1,122 @@
+import heapq
+from rapidfuzz import process
+from rapidfuzz.distance import Levenshtein
+
+
+class SymbolIndex:
+    """
+    Fuzzy search index over the symbol catalogue.
+
+    Symbol names are lower-cased once and bucketed by length. The Levenshtein distance
+    between two strings is at least the difference of their lengths, so a query visits
+    the buckets closest in length first and stops as soon as no remaining bucket can
+    beat the current top-N. Every bucket is scanned in C with the current N-th best
+    distance as a cutoff.
+
+    Results are identical to a full scan sorted by distance: ties are broken by the
+    position of the symbol in the catalogue.
+    """
+
+    def __init__(self, symbol_data):
+        # "lib:symbol" strings in catalogue order
+        self.entries = []
+        # {name length: {entry index: lower-cased name}}
+        self.buckets = {}
+
+        for lib_data in symbol_data["symbols"]:
+            lib_name = lib_data["lib"]
+            for symbol in lib_data["symbols"]:
+                key = symbol.lower()
+                self.buckets.setdefault(len(key), {})[len(self.entries)] = key
+                self.entries.append(f"{lib_name}:{symbol}")
+
+        self.lengths = sorted(self.buckets)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find_closest_matches(self, term, top_n=3):
+        """
+        Find the closest matches for a given search term.
+
+        Parameters:
+            term (str): The search term to find matches for.
+            top_n (int, optional): The number of closest matches to return. Defaults to 3.
+
+        Returns:
+            list: The closest matches in "lib_name:symbol_name" format, best match first.
+        """
+        if top_n <= 0:
+            return []
+
+        term = term.lower()
+        term_length = len(term)
+
+        # Max-heap (negated) of the best (distance, entry index) pairs found so far
+        best = []
+        for length in sorted(self.lengths, key=lambda length: abs(length - term_length)):
+            cutoff = -best[0][0] if len(best) == top_n else None
+            if cutoff is not None and abs(length - term_length) > cutoff:
+                break
+
+            matches = process.extract(term, self.buckets[length], scorer=Levenshtein.distance,
+                                      limit=top_n, score_cutoff=cutoff)
+            for _, distance, entry_index in matches:
+                candidate = (-distance, -entry_index)
+                if len(best) < top_n:
+                    heapq.heappush(best, candidate)
+                elif candidate > best[0]:
+                    heapq.heapreplace(best, candidate)
+
+        best.sort(reverse=True)
+        return [self.entries[-entry_index] for _, entry_index in best]
+
+
+class SubstringIndex:
+    """
+    Case-insensitive substring search over a list of strings, for completion.
+
+    Every string is indexed by its trigrams. A query of three characters or more only
+    checks the strings containing its rarest trigram, shorter queries scan the list
+    until enough matches are found.
+
+    Results are in the order of the list, like a full scan.
+    """
+
+    def __init__(self, entries):
+        self.entries = list(entries)
+        self.keys = [entry.lower() for entry in self.entries]
+        # {trigram: [entry index, ...]} in list order
+        self.postings = {}
+        for entry_index, key in enumerate(self.keys):
+            for trigram in set(map("".join, zip(key, key[1:], key[2:]))):
+                self.postings.setdefault(trigram, []).append(entry_index)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def find_containing(self, term, limit=None):
+        """
+        Find the entries containing a search term, ignoring case.
+
+        Parameters:
+            term (str): The search term.
+            limit (int, optional): The maximum number of entries returned. Defaults to None, for all of them.
+
+        Returns:
+            list: The matching entries, in list order.
+        """
+        term = term.lower()
+        if len(term) < 3:
+            candidates = range(len(self.keys))
+        else:
+            trigrams = {term[i:i + 3] for i in range(len(term) - 2)}
+            candidates = min((self.postings.get(trigram, ()) for trigram in trigrams), key=len)
+
+        matches = []
+        for entry_index in candidates:
+            if term in self.keys[entry_index]:
+                matches.append(self.entries[entry_index])
+                if limit is not None and len(matches) >= limit:
+                    break
+        return matches
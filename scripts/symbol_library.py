@@ -0,0 +1,210 @@
+# Process-wide cache of parsed KiCad symbol libraries (.kicad_sym files).
+# Each library file is read once and indexed by symbol name. The span, pin count and
+# property values of a symbol are extracted on first use and memoized, so placing many
+# instances of the same part only touches the library file once.
+
+import os
+import re
+import threading
+from collections import OrderedDict
+
+from scripts import sexpr
+from scripts import tracing
+
+# Units are named "<parent>_<unit>_<body style>", unit 0 and body style 0 are shared by all units and styles
+UNIT_NAME_PATTERN = re.compile(r'_(\d+)_(\d+)$')
+
+
+def symbol_pins(symbol_node, unit=1, body_style=1):
+    """
+    List the pins of one unit of a parsed (symbol ...) definition.
+
+    Parameters:
+        symbol_node (sexpr.Node): The symbol definition, from a library or from the lib_symbols of a schematic.
+        unit (int, optional): The unit. Defaults to 1.
+        body_style (int, optional): The body style. Defaults to 1.
+
+    Returns:
+        list: (number, x, y, angle) tuples in definition order. Coordinates are in library coordinates,
+            relative to the symbol origin with the y axis pointing up.
+    """
+    pins = []
+    nodes = [symbol_node]
+    for sub_symbol in symbol_node.find_all("symbol"):
+        match = UNIT_NAME_PATTERN.search(sub_symbol.name or "")
+        if match is not None and int(match.group(1)) in (0, unit) and int(match.group(2)) in (0, body_style):
+            nodes.append(sub_symbol)
+    for node in nodes:
+        for pin in node.find_all("pin"):
+            at = pin.find("at")
+            number = pin.find("number")
+            if at is None or number is None or not number.atoms:
+                continue
+            coordinates = [float(value) for value in at.atoms[:3]]
+            coordinates += [0.0] * (3 - len(coordinates))
+            pins.append((number.atoms[0], *coordinates))
+    return pins
+
+
+class LibrarySymbol:
+    """A symbol definition inside a loaded library, with its derived values memoized."""
+
+    def __init__(self, library, name, start, end):
+        self.library = library
+        self.name = name
+        self.start = start
+        self.end = end
+        self._node = None
+        self._pin_count = None
+        self._pins = None
+        self._properties = None
+
+    @property
+    def definition(self):
+        """The (symbol ...) form as it appears in the library file."""
+        return self.library.content[self.start:self.end]
+
+    @property
+    def node(self):
+        """The parsed (symbol ...) form."""
+        if self._node is None:
+            self._node = sexpr.parse_form(self.library.content, self.start)
+        return self._node
+
+    @property
+    def pin_count(self):
+        if self._pin_count is None:
+            self._pin_count = sum(1 for _ in self.node.iter_all("pin"))
+        return self._pin_count
+
+    @property
+    def pins(self):
+        """list: (number, x, y, angle) of the pins of unit 1, see symbol_pins."""
+        if self._pins is None:
+            self._pins = symbol_pins(self.node)
+        return self._pins
+
+    @property
+    def properties(self):
+        """dict: {property name: (value, (x, y, angle))} for the first occurrence of each property."""
+        if self._properties is None:
+            self._properties = {}
+            for prop in self.node.find_all("property"):
+                atoms = prop.atoms
+                if len(atoms) < 2 or atoms[0] in self._properties:
+                    continue
+                at = prop.find("at")
+                coordinates = tuple(float(value) for value in at.atoms[:3]) if at is not None else None
+                self._properties[atoms[0]] = (atoms[1], coordinates)
+        return self._properties
+
+    def property_value(self, property_name):
+        prop = self.properties.get(property_name)
+        return prop[0] if prop is not None else None
+
+    def property_coordinates(self, property_name):
+        prop = self.properties.get(property_name)
+        return prop[1] if prop is not None else None
+
+
+class SymbolLibrary:
+    """The content of one .kicad_sym file and the index of the symbols it defines."""
+
+    def __init__(self, path, content, mtime, size):
+        self.path = path
+        self.content = content
+        self.mtime = mtime
+        self.size = size
+        # {symbol name: (start, end)} of the top-level (symbol "name" ...) forms, indexed in one pass
+        self.symbol_spans = {}
+        for head, name, start, end in sexpr.scan_forms(content, depth=1):
+            if head == "symbol" and name not in self.symbol_spans:
+                self.symbol_spans[name] = (start, end)
+        self._symbols = {}
+
+    def get_symbol(self, symbol_name):
+        """
+        Get a symbol of this library.
+
+        Parameters:
+            symbol_name (str): The name of the symbol, without the library prefix.
+
+        Returns:
+            LibrarySymbol: The symbol, or None if the library does not define it.
+        """
+        symbol = self._symbols.get(symbol_name)
+        if symbol is None:
+            span = self.symbol_spans.get(symbol_name)
+            if span is None:
+                return None
+            symbol = LibrarySymbol(self, symbol_name, *span)
+            self._symbols[symbol_name] = symbol
+        return symbol
+
+
+class SymbolLibraryCache:
+    """
+    Bounded LRU cache of loaded symbol libraries.
+
+    A library is re-read when the modification time or size of its file changes.
+    """
+
+    def __init__(self, max_libraries=16):
+        self.max_libraries = max_libraries
+        self._libraries = OrderedDict()
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.hits = 0
+
+    def get_library(self, path):
+        """
+        Get a loaded library, reading the file only if it is not cached or has changed on disk.
+
+        Parameters:
+            path (str): The path to the .kicad_sym file.
+
+        Returns:
+            SymbolLibrary: The loaded library.
+        """
+        stat = os.stat(path)
+        with self._lock:
+            library = self._libraries.get(path)
+            if library is not None and library.mtime == stat.st_mtime_ns and library.size == stat.st_size:
+                self._libraries.move_to_end(path)
+                self.hits += 1
+                return library
+
+        with tracing.span("symbol_library_load", library=os.path.basename(path)) as span:
+            with open(path, 'r') as file:
+                content = file.read()
+            library = SymbolLibrary(path, content, stat.st_mtime_ns, stat.st_size)
+            span.add("bytes_read", len(content))
+            span.add("symbols", len(library.symbol_spans))
+
+        with self._lock:
+            self.reads += 1
+            self._libraries[path] = library
+            self._libraries.move_to_end(path)
+            while len(self._libraries) > self.max_libraries:
+                self._libraries.popitem(last=False)
+        return library
+
+    def get_symbol(self, path, symbol_name):
+        """
+        Get a symbol from a library file.
+
+        Parameters:
+            path (str): The path to the .kicad_sym file.
+            symbol_name (str): The name of the symbol, without the library prefix.
+
+        Returns:
+            LibrarySymbol: The symbol, or None if the library does not define it.
+        """
+        return self.get_library(path).get_symbol(symbol_name)
+
+    def clear(self):
+        with self._lock:
+            self._libraries.clear()
+
+
+symbol_library_cache = SymbolLibraryCache()
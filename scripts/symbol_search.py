@@ -1,54 +1,131 @@
 import os
-import re
 import json
+import marshal
+import struct
+import threading
 import Levenshtein
-import yaml
 
-config_file_path = 'configuration.yaml'
+from scripts.symbol_catalogue import build_symbol_catalogue, scan_library_file
+from scripts.symbol_index import SubstringIndex, SymbolIndex
+from scripts.settings import get_settings
 
-# Read the YAML file
-with open(config_file_path, 'r') as file:
-    config = yaml.safe_load(file)
+symbol_library_path = get_settings().get('symbol_library_path', None)
 
-symbol_library_path = config.get('symbol_library_path', None)
+# Binary snapshot of symbol_data.json: magic, format version, marshal version, then the marshalled catalogue
+SYMBOL_INDEX_MAGIC = b"I2KSYM"
+SYMBOL_INDEX_VERSION = 1
+SYMBOL_INDEX_HEADER = struct.Struct("<6sHH")
 
 
 #--------------------------------Helper functions------------------------------
 def extract_top_level_symbol_names(file_path):
-    symbol_names = []
-    with open(file_path, "r") as f:
-        content = f.read()
-        symbol_matches = re.findall(r'\(symbol\s+"([^"]+)"', content)
-        previous_symbol = ""
-        for symbol_match in symbol_matches:
-            escaped_symbol = re.escape(previous_symbol) if previous_symbol else ""
-            if bool(re.search(fr'{escaped_symbol}_\d+', symbol_match)):
-                continue
-            else:
-                previous_symbol = symbol_match
-                symbol_names.append(symbol_match)
-
-    
-    return symbol_names
+    return scan_library_file(file_path)
 
 #--------------------------------Helper functions------------------------------
 
 class SymbolSearch:
+    """
+    Fuzzy search over the symbol catalogue.
+
+    The catalogue and its search indexes are loaded on first use, and shared with the GUI
+    through sorted_lib_ids() and find_containing() so the catalogue is only loaded once per process.
+    """
     def __init__(self, symbol_data_path):
-        self.symbol_data = load_symbol_data(symbol_data_path)
-    
+        self.symbol_data_path = symbol_data_path
+        self._lock = threading.Lock()
+        self._symbol_data = None
+        self._index = None
+        self._sorted_lib_ids = None
+        self._substring_index = None
+
+    @property
+    def symbol_data(self):
+        if self._symbol_data is None:
+            with self._lock:
+                if self._symbol_data is None:
+                    self._symbol_data = load_symbol_data(self.symbol_data_path)
+        return self._symbol_data
+
+    @property
+    def index(self):
+        if self._index is None:
+            symbol_data = self.symbol_data
+            with self._lock:
+                if self._index is None:
+                    # Build the search index once, queries no longer scan the whole catalogue
+                    self._index = SymbolIndex(symbol_data)
+        return self._index
+
+    @property
+    def substring_index(self):
+        if self._substring_index is None:
+            lib_ids = self.sorted_lib_ids()
+            with self._lock:
+                if self._substring_index is None:
+                    self._substring_index = SubstringIndex(lib_ids)
+        return self._substring_index
+
     def find_closest_matches(self, term, top_n=3):
-        return find_closest_matches(term, self.symbol_data, top_n)
+        return self.index.find_closest_matches(term, top_n)
+
+    def find_closest_matches_batch(self, terms, top_n=3):
+        """
+        Find the closest matches of several search terms, searching each distinct term once.
+
+        Parameters:
+            terms (list of str): The search terms.
+            top_n (int, optional): The number of closest matches per term. Defaults to 3.
+
+        Returns:
+            dict: {term: the closest matches in "lib_name:symbol_name" format, best match first}.
+        """
+        index = self.index
+        return {term: index.find_closest_matches(term, top_n) for term in dict.fromkeys(terms)}
+
+    def sorted_lib_ids(self):
+        """
+        Get all the symbols of the catalogue in "lib_name:symbol_name" format, sorted.
+
+        Returns:
+            list: The sorted lib_ids. The list is shared, callers must not modify it.
+        """
+        if self._sorted_lib_ids is None:
+            lib_ids = sorted(self.index.entries)
+            with self._lock:
+                if self._sorted_lib_ids is None:
+                    self._sorted_lib_ids = lib_ids
+        return self._sorted_lib_ids
+
+    def find_containing(self, term, limit=None):
+        """
+        Find the lib_ids containing a search term, ignoring case, for completion.
+
+        Parameters:
+            term (str): The search term, eg: "resis" or "device:r".
+            limit (int, optional): The maximum number of lib_ids returned. Defaults to None, for all of them.
+
+        Returns:
+            list: The matching lib_ids, sorted.
+        """
+        return self.substring_index.find_containing(term, limit)
 
     def load_symbol_data(self, file_path):
-        self.symbol_data = load_symbol_data(file_path)
+        with self._lock:
+            self.symbol_data_path = file_path
+            self._symbol_data = None
+            self._index = None
+            self._sorted_lib_ids = None
+            self._substring_index = None
 
     def create_symbol_data_json(self, directory_path, output_file):
         create_symbol_data_json(directory_path, output_file)
 
+
 def create_symbol_data_json(directory_path, output_file):
     """
     Creates a JSON file containing symbol data for the given directory of KiCad symbol files.
+    Library files are parsed in parallel, and only the files which changed since the last build are
+    parsed again (see symbol_catalogue.build_symbol_catalogue).
 
     Parameters:
         directory_path (str): The path to the directory containing the KiCad symbol files.
@@ -57,26 +134,91 @@ def create_symbol_data_json(directory_path, output_file):
     Returns:
         None
     """
+    symbol_data = build_symbol_catalogue(directory_path, manifest_path=symbol_manifest_path(output_file))
+
     with open(output_file, "w") as json_file:
         json_file.write('{"symbols": [')
         first_symbol = True
-        for filename in os.listdir(directory_path):
-            if filename.endswith(".kicad_sym"):
-                # Extract the library name from the file name
-                libname= filename.split(".")[0]
-                file_path = os.path.join(directory_path, filename)
-                symbols = extract_top_level_symbol_names(file_path)
-                if symbols:
-                    if not first_symbol:
-                        json_file.write(',')
-                    json.dump({"lib": libname, "symbols": symbols}, json_file, indent=2)
-                    first_symbol = False
+        for lib_data in symbol_data["symbols"]:
+            if not first_symbol:
+                json_file.write(',')
+            json.dump(lib_data, json_file, indent=2)
+            first_symbol = False
         json_file.write(']}')
 
+    write_symbol_index(symbol_data, symbol_index_path(output_file))
+
+
+def symbol_manifest_path(symbol_data_path):
+    """
+    Get the path of the manifest used for incremental rebuilds of a symbol data JSON file.
+
+    Parameters:
+        symbol_data_path (str): The path to the JSON file, eg: symbol_data.json
+
+    Returns:
+        str: The path to the manifest file, eg: symbol_data.manifest.json
+    """
+    return os.path.splitext(symbol_data_path)[0] + ".manifest.json"
+
+
+def symbol_index_path(symbol_data_path):
+    """
+    Get the path of the binary index built next to a symbol data JSON file.
+
+    Parameters:
+        symbol_data_path (str): The path to the JSON file, eg: symbol_data.json
+
+    Returns:
+        str: The path to the index file, eg: symbol_data.idx
+    """
+    return os.path.splitext(symbol_data_path)[0] + ".idx"
+
+
+def write_symbol_index(symbol_data, index_path):
+    """
+    Write the symbol data as a binary index which loads faster than the JSON file.
+
+    Parameters:
+        symbol_data (dict): The symbol data, in the same structure as symbol_data.json.
+        index_path (str): The path to the index file.
+
+    Returns:
+        None
+    """
+    payload = marshal.dumps([(lib_data["lib"], tuple(lib_data["symbols"])) for lib_data in symbol_data["symbols"]])
+    header = SYMBOL_INDEX_HEADER.pack(SYMBOL_INDEX_MAGIC, SYMBOL_INDEX_VERSION, marshal.version)
+    # Write to a temporary file first, so a reader never sees a partial index
+    temp_path = f"{index_path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as index_file:
+        index_file.write(header + payload)
+    os.replace(temp_path, index_path)
+
+
+def read_symbol_index(index_path):
+    """
+    Read a binary index written by write_symbol_index.
+
+    Parameters:
+        index_path (str): The path to the index file.
+
+    Returns:
+        dict: The symbol data, or None if the file was written by an incompatible version.
+    """
+    with open(index_path, "rb") as index_file:
+        content = index_file.read()
+    if len(content) < SYMBOL_INDEX_HEADER.size:
+        return None
+    magic, version, marshal_version = SYMBOL_INDEX_HEADER.unpack_from(content)
+    if magic != SYMBOL_INDEX_MAGIC or version != SYMBOL_INDEX_VERSION or marshal_version != marshal.version:
+        return None
+    libraries = marshal.loads(content[SYMBOL_INDEX_HEADER.size:])
+    return {"symbols": [{"lib": lib_name, "symbols": list(symbols)} for lib_name, symbols in libraries]}
+
 
 def load_symbol_data(file_path):
     """
-    Load symbol data from a JSON file.
+    Load symbol data from a JSON file, or from the binary index built next to it.
 
     Parameters:
         file_path (str): The path to the JSON file.
@@ -84,16 +226,31 @@ def load_symbol_data(file_path):
     Returns:
         dict: The symbol data loaded from the JSON file.
     """
+    index_path = symbol_index_path(file_path)
+
+    # Use the binary index unless the JSON file was edited after it was built
+    if os.path.exists(index_path) and (not os.path.exists(file_path) or
+                                       os.path.getmtime(index_path) >= os.path.getmtime(file_path)):
+        symbol_data = read_symbol_index(index_path)
+        if symbol_data is not None:
+            return symbol_data
+
+    # No JSON file, and no index this version can read
     if not os.path.exists(file_path):
         create_symbol_data_json(directory_path= symbol_library_path, output_file= file_path)
 
     with open(file_path, "r") as f:
         symbol_data = json.load(f)
+    try:
+        write_symbol_index(symbol_data, index_path)
+    except OSError as e:
+        print(f"Could not write symbol index {index_path}: {e}")
     return symbol_data
 
 def find_closest_matches(term, symbol_data, top_n=3):
     """
     Find the closest matches for a given search term in a symbol data.
+    This is a full scan of the catalogue, SymbolSearch uses the indexed SymbolIndex instead.
 
     Parameters:
         term (str): The search term to find matches for.
@@ -121,6 +278,7 @@ def find_closest_matches(term, symbol_data, top_n=3):
     top_matches_list = [f"{match[0]}:{match[1]}" for match in top_matches]
     return top_matches_list
 
+# The catalogue is loaded on the first query, not on import
 symbol_search = SymbolSearch("symbol_data.json")
 
 
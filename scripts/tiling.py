@@ -0,0 +1,299 @@
+# Tiled conversion of large schematics.
+# The image is split into overlapping tiles which are converted by separate, concurrent model calls, so
+# each answer stays within the output token limit and the wall-clock time is that of the slowest tile.
+# The tile results are merged into one result: positions are moved to sheet coordinates, the parts seen
+# by two tiles in their overlap are merged, references are renumbered and connections are remapped.
+# merge_tile_results only works on dictionaries, so it can be run offline on canned tile responses.
+
+import math
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from scripts.image_preprocessing import PreparedImage, encode_for_model, flatten
+
+DEFAULT_TILE_SIZE = 1024
+DEFAULT_OVERLAP = 0.15
+# Tile positions are percentages of the tile size, which do not depend on how the model scales the image
+POSITION_RANGE = 100
+# Parts of two tiles closer than this share of the tile size are the same part
+DUPLICATE_DISTANCE = 0.04
+
+
+def tile_grid(width, height, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_OVERLAP):
+    """
+    Get the number of tile rows and columns needed to keep the tiles under tile_size pixels.
+
+    Returns:
+        tuple: (rows, cols)
+    """
+    step = tile_size * (1 - overlap)
+    cols = max(1, math.ceil((width - tile_size) / step) + 1) if width > tile_size else 1
+    rows = max(1, math.ceil((height - tile_size) / step) + 1) if height > tile_size else 1
+    return rows, cols
+
+
+def _spans(length, count, overlap):
+    if count == 1:
+        return [(0, length)]
+    # count tiles of size s, consecutive tiles sharing overlap * s: length = s * (count - (count - 1) * overlap)
+    size = length / (count - (count - 1) * overlap)
+    step = size * (1 - overlap)
+    return [(round(i * step), length if i == count - 1 else round(i * step + size)) for i in range(count)]
+
+
+def tile_boxes(width, height, rows, cols, overlap=DEFAULT_OVERLAP):
+    """
+    Split an image area into rows x cols overlapping tiles.
+
+    Parameters:
+        width (int): The width of the image, in pixels.
+        height (int): The height of the image, in pixels.
+        rows (int): The number of tile rows.
+        cols (int): The number of tile columns.
+        overlap (float, optional): The share of a tile also covered by its neighbour. Defaults to 0.15.
+
+    Returns:
+        list of tuples: The (left, top, right, bottom) boxes, row by row.
+    """
+    return [(left, top, right, bottom)
+            for top, bottom in _spans(height, rows, overlap)
+            for left, right in _spans(width, cols, overlap)]
+
+
+def split_image(image_path, rows=None, cols=None, tile_size=DEFAULT_TILE_SIZE, overlap=DEFAULT_OVERLAP):
+    """
+    Cut an image file into overlapping tiles, encoded for the model.
+
+    Parameters:
+        image_path (str): The path to the image.
+        rows (int, optional): The number of tile rows. Defaults to what tile_size needs.
+        cols (int, optional): The number of tile columns. Defaults to what tile_size needs.
+        tile_size (int, optional): The maximum tile size, in pixels, when rows or cols is not given.
+        overlap (float, optional): The share of a tile also covered by its neighbour. Defaults to 0.15.
+
+    Returns:
+        list of tuples: (box, PreparedImage) of each tile.
+    """
+    with Image.open(image_path) as source:
+        image = flatten(source)
+    auto_rows, auto_cols = tile_grid(image.width, image.height, tile_size, overlap)
+    tiles = []
+    for box in tile_boxes(image.width, image.height, rows or auto_rows, cols or auto_cols, overlap):
+        # Tiles are not cropped or scaled: positions in the tile must map back to the same box
+        data, mime_type, steps = encode_for_model(image.crop(box))
+        tiles.append((box, PreparedImage(data, mime_type, 0, [f"tile {box}"] + steps)))
+    return tiles
+
+
+def convert_tiles(tiles, convert_tile, max_workers=None):
+    """
+    Convert all tiles concurrently.
+
+    Parameters:
+        tiles (list of tuples): (box, PreparedImage) of each tile, see split_image.
+        convert_tile (function): Takes a PreparedImage and returns the SchematicsInformation of the tile.
+        max_workers (int, optional): The maximum number of calls in flight. Defaults to one per tile.
+
+    Returns:
+        list of dicts: The results, in the order of the tiles.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers or len(tiles) or 1) as executor:
+        return list(executor.map(lambda tile: convert_tile(tile[1]), tiles))
+
+
+def reference_prefix(reference):
+    match = re.match(r'[A-Za-z_#]+', reference or '')
+    return match.group(0).upper() if match else 'U'
+
+
+class _Parts:
+    """Union-find over the parts of all tiles."""
+
+    def __init__(self, count):
+        self.parent = list(range(count))
+
+    def find(self, i):
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, i, j):
+        self.parent[self.find(j)] = self.find(i)
+
+
+def _estimate_cell_size(positions, chunk=512):
+    # The median distance between neighbouring parts, which is one grid cell in the relative coordinates
+    points = np.array(positions, dtype=np.float64).reshape(-1, 2)
+    nearest = []
+    for start in range(0, len(points), chunk):
+        distances = np.hypot(*(points[start:start + chunk, None, :] - points[None, :, :]).transpose(2, 0, 1))
+        # Parts at the same place are not neighbours
+        distances[distances == 0] = np.inf
+        nearest.append(distances.min(axis=1))
+    nearest = np.concatenate(nearest) if nearest else np.empty(0)
+    nearest = nearest[np.isfinite(nearest)]
+    return float(np.median(nearest)) if len(nearest) else 1.0
+
+
+def _grid_indices(values, cell_size):
+    """
+    Turn pixel coordinates into cell indices. Values less than half a cell apart are in the same cell, and
+    each step between cells is rounded on its own, so the noise of the positions does not add up.
+    """
+    order = sorted(range(len(values)), key=lambda i: values[i])
+    indices = [0] * len(values)
+    index = 0
+    cluster = []
+    previous_center = None
+    for i in order + [None]:
+        if i is not None and (not cluster or values[i] - values[cluster[-1]] <= cell_size / 2):
+            cluster.append(i)
+            continue
+        center = sum(values[j] for j in cluster) / len(cluster)
+        if previous_center is not None:
+            index += max(1, round((center - previous_center) / cell_size))
+        for j in cluster:
+            indices[j] = index
+        previous_center = center
+        cluster = [i]
+    return indices
+
+
+def merge_tile_results(tile_results, boxes, duplicate_distance=None, cell_size=None):
+    """
+    Merge the results of the tiles of an image into one result.
+
+    Parameters:
+        tile_results (list of dicts): The SchematicsInformation of each tile. Component positions are
+            percentages (0-100) of the tile width and height.
+        boxes (list of tuples): The (left, top, right, bottom) box of each tile in the image.
+        duplicate_distance (float, optional): Parts of the same lib_id from different tiles closer than this,
+            in pixels, are the same part. Defaults to 4% of a tile, at most half the smallest overlap between tiles.
+        cell_size (float, optional): The size in pixels of one cell of the relative coordinates of the merged
+            result. Defaults to the median distance between neighbouring parts.
+
+    Returns:
+        tuple: The merged SchematicsInformation, in relative coordinates with references renumbered per
+            prefix (R1, R2, ... from top left to bottom right), and a report dict with the number of parts
+            and connections found, merged and dropped.
+    """
+    if duplicate_distance is None:
+        duplicate_distance = _default_duplicate_distance(boxes)
+
+    # All the parts of all tiles, in image pixels
+    parts = []
+    for tile_index, (result, (left, top, right, bottom)) in enumerate(zip(tile_results, boxes)):
+        width, height = right - left, bottom - top
+        for component in result.get("detected_components", []):
+            x = min(max(float(component.get("x", 0)), 0), POSITION_RANGE) / POSITION_RANGE * width
+            y = min(max(float(component.get("y", 0)), 0), POSITION_RANGE) / POSITION_RANGE * height
+            parts.append({"tile": tile_index, "component": component, "x": left + x, "y": top + y,
+                          # Parts far from the tile edges are seen whole, they are preferred when merging
+                          "visibility": min(x, y, width - x, height - y)})
+
+    # Parts of two tiles with the same lib_id at the same place in their overlap are the same part. They are
+    # matched one to one, closest pairs first, so two neighbouring parts of the same kind are not merged
+    merged = _Parts(len(parts))
+    parts_of_tile = [[] for _ in boxes]
+    for i, part in enumerate(parts):
+        parts_of_tile[part["tile"]].append(i)
+    for tile_a, box_a in enumerate(boxes):
+        for tile_b in range(tile_a + 1, len(boxes)):
+            box_b = boxes[tile_b]
+            in_b = [i for i in parts_of_tile[tile_a] if _inside(parts[i], box_b, duplicate_distance)]
+            in_a = [j for j in parts_of_tile[tile_b] if _inside(parts[j], box_a, duplicate_distance)]
+            pairs = sorted((math.hypot(parts[i]["x"] - parts[j]["x"], parts[i]["y"] - parts[j]["y"]), i, j)
+                           for i in in_b for j in in_a
+                           if parts[i]["component"].get("lib_id") == parts[j]["component"].get("lib_id"))
+            matched = set()
+            for distance, i, j in pairs:
+                if distance > duplicate_distance:
+                    break
+                if i not in matched and j not in matched:
+                    matched.update((i, j))
+                    merged.union(i, j)
+    groups = {}
+    for i in range(len(parts)):
+        groups.setdefault(merged.find(i), []).append(i)
+    # The part seen best represents its group
+    representatives = []
+    part_group = {}
+    for members in groups.values():
+        best = max(members, key=lambda i: parts[i]["visibility"])
+        representatives.append(best)
+        for i in members:
+            part_group[i] = best
+
+    # New references, numbered per prefix from top left to bottom right
+    references = {}
+    counters = {}
+    for i in sorted(representatives, key=lambda i: (parts[i]["y"], parts[i]["x"])):
+        prefix = reference_prefix(parts[i]["component"].get("reference"))
+        counters[prefix] = counters.get(prefix, 0) + 1
+        references[i] = f"{prefix}{counters[prefix]}"
+    tile_references = {}
+    for i, part in enumerate(parts):
+        tile_references.setdefault((part["tile"], part["component"].get("reference")), references[part_group[i]])
+
+    if cell_size is None:
+        cell_size = _estimate_cell_size([(parts[i]["x"], parts[i]["y"]) for i in representatives])
+    ordered = sorted(representatives, key=lambda i: (parts[i]["y"], parts[i]["x"]))
+    if ordered:
+        columns = _grid_indices([parts[i]["x"] for i in ordered], cell_size)
+        rows = _grid_indices([parts[i]["y"] for i in ordered], cell_size)
+    detected_components = []
+    for position, i in enumerate(ordered):
+        component = dict(parts[i]["component"])
+        component["reference"] = references[i]
+        component["x"] = columns[position]
+        component["y"] = rows[position]
+        detected_components.append(component)
+
+    # Connections between the new references, each one once
+    component_connections = []
+    seen = set()
+    dropped = 0
+    for tile_index, result in enumerate(tile_results):
+        for connection in result.get("component_connections", []):
+            a_ref = tile_references.get((tile_index, connection.get("A_ref")))
+            b_ref = tile_references.get((tile_index, connection.get("B_ref")))
+            if a_ref is None or b_ref is None:
+                dropped += 1
+                continue
+            ends = frozenset([(a_ref, str(connection.get("A_pin"))), (b_ref, str(connection.get("B_pin")))])
+            if len(ends) == 1 or ends in seen:
+                continue
+            seen.add(ends)
+            component_connections.append({**connection, "A_ref": a_ref, "B_ref": b_ref})
+
+    report = {
+        "tiles": len(tile_results),
+        "tile_components": len(parts),
+        "components": len(detected_components),
+        "merged_duplicates": len(parts) - len(detected_components),
+        "connections": len(component_connections),
+        "dropped_connections": dropped,
+        "cell_size": cell_size,
+    }
+    return {"detected_components": detected_components, "component_connections": component_connections}, report
+
+
+def _inside(part, box, margin):
+    left, top, right, bottom = box
+    return left - margin <= part["x"] <= right + margin and top - margin <= part["y"] <= bottom + margin
+
+
+def _default_duplicate_distance(boxes):
+    # A few percent of a tile, the precision of the positions given by the models, at most half the overlap
+    distance = DUPLICATE_DISTANCE * min((min(right - left, bottom - top) for left, top, right, bottom in boxes), default=100)
+    for i, (left, top, right, bottom) in enumerate(boxes):
+        for other_left, other_top, other_right, other_bottom in boxes[i + 1:]:
+            overlap_x = min(right, other_right) - max(left, other_left)
+            overlap_y = min(bottom, other_bottom) - max(top, other_top)
+            if overlap_x > 0 and overlap_y > 0:
+                distance = min(distance, min(overlap_x, overlap_y) / 2)
+    return distance
@@ -0,0 +1,252 @@
+# Lightweight tracing of the conversion pipeline.
+# Each stage (image encoding, model call, JSON parsing, lib_id matching, symbol library loading, placement,
+# wire routing, schematic writing) runs in a span, which records its duration and counters such as bytes
+# uploaded, tokens, components, wires and cache hits. Finished spans are appended to a JSON-lines file, and
+# the totals per stage are written to a file in the Prometheus text format.
+#
+# Tracing is off unless `tracing: true` is set in the configuration file, or enable() is called. span() then
+# returns a shared span which does nothing, so the instrumented code only pays for a function call.
+
+import atexit
+import contextvars
+import itertools
+import json
+import os
+import threading
+import time
+
+from scripts.settings import get_settings
+
+DEFAULT_JSONL_PATH = 'traces.jsonl'
+DEFAULT_PROMETHEUS_PATH = 'metrics.prom'
+METRIC_PREFIX = 'image2kicad'
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_tracer = None
+
+
+class NoopSpan:
+    """The span returned when tracing is off."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+    def add(self, counter, value=1):
+        pass
+
+    def set(self, key, value):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    """
+    One timed stage, used as a context manager. Spans opened inside it, in the same thread, are its children.
+
+    Parameters:
+        tracer (Tracer): The tracer which records the span.
+        name (str): The stage, eg: "model_call".
+        attributes (dict): Labels of the span, eg: the model name or the image file.
+    """
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.counters = {}
+        self.id = next(tracer.ids)
+        self.parent_id = None
+        self.start = None
+        self.duration = None
+        self.error = None
+        self._token = None
+
+    def __enter__(self):
+        parent = _current_span.get()
+        self.parent_id = parent.id if parent is not None else None
+        self._token = _current_span.set(self)
+        self.start = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        if exc_type is not None:
+            self.error = exc_type.__name__
+        self.tracer.finish(self)
+        return False
+
+    def add(self, counter, value=1):
+        """Add to a counter of the span, eg: span.add("components", 12)."""
+        self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def set(self, key, value):
+        """Set an attribute of the span."""
+        self.attributes[key] = value
+
+    def to_dict(self):
+        return {"id": self.id, "parent_id": self.parent_id, "name": self.name, "start": self.start,
+                "duration_ms": round(self.duration * 1000, 3), "thread": threading.current_thread().name,
+                "attributes": self.attributes, "counters": self.counters, "error": self.error}
+
+
+class Tracer:
+    """
+    Records the spans of the pipeline.
+
+    Parameters:
+        jsonl_path (str, optional): The JSON-lines file each finished span is appended to. None to keep no log.
+        prometheus_path (str, optional): The file the totals per stage are written to by write_prometheus.
+    """
+
+    def __init__(self, jsonl_path=DEFAULT_JSONL_PATH, prometheus_path=DEFAULT_PROMETHEUS_PATH):
+        self.jsonl_path = jsonl_path
+        self.prometheus_path = prometheus_path
+        self.ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._file = open(jsonl_path, 'a') if jsonl_path is not None else None
+        # {stage: {"count": n, "errors": n, "seconds": s, "counters": {counter: total}}}
+        self.stages = {}
+
+    def span(self, name, **attributes):
+        return Span(self, name, attributes)
+
+    def finish(self, span):
+        line = json.dumps(span.to_dict(), default=str) if self._file is not None else None
+        with self._lock:
+            stage = self.stages.get(span.name)
+            if stage is None:
+                stage = self.stages[span.name] = {"count": 0, "errors": 0, "seconds": 0.0, "counters": {}}
+            stage["count"] += 1
+            stage["seconds"] += span.duration
+            if span.error is not None:
+                stage["errors"] += 1
+            for counter, value in span.counters.items():
+                stage["counters"][counter] = stage["counters"].get(counter, 0) + value
+            if self._file is not None:
+                self._file.write(line + "\n")
+                self._file.flush()
+
+    def prometheus_text(self):
+        """
+        The totals per stage in the Prometheus text format.
+
+        Returns:
+            str: One counter per metric, labelled by stage, eg: image2kicad_stage_seconds_total{stage="model_call"}.
+        """
+        with self._lock:
+            stages = {name: {**stage, "counters": dict(stage["counters"])} for name, stage in self.stages.items()}
+        metrics = {
+            "stage_calls_total": ("Number of times each pipeline stage ran", "count"),
+            "stage_errors_total": ("Number of times each pipeline stage failed", "errors"),
+            "stage_seconds_total": ("Time spent in each pipeline stage, in seconds", "seconds"),
+        }
+        lines = []
+        for metric, (help_text, key) in metrics.items():
+            lines += [f"# HELP {METRIC_PREFIX}_{metric} {help_text}", f"# TYPE {METRIC_PREFIX}_{metric} counter"]
+            lines += [f'{METRIC_PREFIX}_{metric}{{stage="{name}"}} {stage[key]:g}' for name, stage in sorted(stages.items())]
+        counters = sorted({counter for stage in stages.values() for counter in stage["counters"]})
+        for counter in counters:
+            metric = f"{METRIC_PREFIX}_{counter}_total"
+            lines += [f"# HELP {metric} Total {counter.replace('_', ' ')} counted by each pipeline stage",
+                      f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{stage="{name}"}} {stage["counters"][counter]:g}'
+                      for name, stage in sorted(stages.items()) if counter in stage["counters"]]
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path=None):
+        """
+        Write the totals per stage, replacing the file atomically so a scraper never reads a partial file.
+
+        Parameters:
+            path (str, optional): The file. Defaults to the prometheus_path of the tracer.
+
+        Returns:
+            str: The path to the file, or None if there is none.
+        """
+        path = path or self.prometheus_path
+        if path is None:
+            return None
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(temp_path, path)
+        return path
+
+    def close(self):
+        self.write_prometheus()
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+
+def span(name, **attributes):
+    """
+    Open a span for a stage of the pipeline: `with tracing.span("json_parse") as span: ... span.add("components", n)`.
+
+    Parameters:
+        name (str): The stage.
+        **attributes: Labels of the span, eg: model="gpt-4-vision-preview".
+
+    Returns:
+        Span: The span, or NOOP_SPAN when tracing is off.
+    """
+    tracer = _tracer
+    if tracer is None:
+        return NOOP_SPAN
+    return Span(tracer, name, attributes)
+
+
+def current_span():
+    """The innermost open span of this thread, or NOOP_SPAN, eg: to add a counter from a helper."""
+    return _current_span.get() or NOOP_SPAN
+
+
+def get_tracer():
+    """The tracer, or None when tracing is off."""
+    return _tracer
+
+
+def enable(jsonl_path=DEFAULT_JSONL_PATH, prometheus_path=DEFAULT_PROMETHEUS_PATH):
+    """
+    Start recording spans. The Prometheus file is written when disable() is called, or at exit.
+
+    Parameters:
+        jsonl_path (str, optional): The JSON-lines file the spans are appended to. None to keep no log.
+        prometheus_path (str, optional): The file the totals per stage are written to. None to write none.
+
+    Returns:
+        Tracer: The tracer.
+    """
+    global _tracer
+    disable()
+    _tracer = Tracer(jsonl_path, prometheus_path)
+    atexit.register(_tracer.close)
+    return _tracer
+
+
+def disable():
+    """Stop recording spans, and write the Prometheus file of the spans recorded so far."""
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        atexit.unregister(tracer.close)
+        tracer.close()
+
+
+# Set tracing: true in the configuration file to record the spans of every conversion
+try:
+    _settings = get_settings()
+except FileNotFoundError:
+    # Parts of the pipeline, like the symbol library, are also used without a configuration file
+    _settings = {}
+if _settings.get('tracing', False):
+    enable(_settings.get('tracing_jsonl', DEFAULT_JSONL_PATH),
+           _settings.get('tracing_prometheus', DEFAULT_PROMETHEUS_PATH))
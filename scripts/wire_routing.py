@@ -0,0 +1,164 @@
+# Turns the component_connections of a conversion result into wires.
+# The symbols and pin locations of the schematic are indexed once, by reference and by
+# (reference, pin number), so routing is a single pass over the connections. Connections which cannot be
+# drawn are returned as diagnostics instead of being dropped silently.
+# Pin locations are computed from the symbol definitions embedded in the schematic, with the same
+# transform as KiCad, so the schematic does not need to be written and loaded again with kicad-skip.
+
+import math
+
+import numpy as np
+
+from scripts import geometry, sexpr
+from scripts.symbol_library import symbol_pins
+
+ROTATIONS = geometry.ROTATION_MATRICES
+
+
+def pin_location(pin_x, pin_y, symbol_x, symbol_y, angle=0, mirror=None):
+    """
+    Compute where a pin of a placed symbol is on the sheet. geometry.pin_locations does the same for many pins.
+
+    Parameters:
+        pin_x (float): The x coordinate of the pin in the symbol definition.
+        pin_y (float): The y coordinate of the pin in the symbol definition (library coordinates, y pointing up).
+        symbol_x (float): The x coordinate of the symbol instance.
+        symbol_y (float): The y coordinate of the symbol instance.
+        angle (float, optional): The rotation of the symbol instance, in degrees. Defaults to 0.
+        mirror (str, optional): 'x' or 'y' if the symbol instance is mirrored. Defaults to None.
+
+    Returns:
+        tuple: The (x, y) location of the pin on the sheet, rounded to 4 decimals.
+    """
+    x, y = pin_x, -pin_y
+    angle = angle % 360
+    if angle in ROTATIONS:
+        a, b, c, d = ROTATIONS[angle]
+        x, y = a * x + b * y, c * x + d * y
+    else:
+        radians = math.radians(angle)
+        x, y = x * math.cos(radians) + y * math.sin(radians), -x * math.sin(radians) + y * math.cos(radians)
+    if mirror == 'x':
+        y = -y
+    elif mirror == 'y':
+        x = -x
+    return round(symbol_x + x, 4), round(symbol_y + y, 4)
+
+
+def index_document(document):
+    """
+    Index the symbol instances of a schematic document and the locations of their pins.
+
+    Parameters:
+        document (SchematicDocument): The schematic, including the symbols added to it.
+
+    Returns:
+        tuple: ({reference: lib_id}, {(reference, pin number): (x, y)}, {(reference, pin number): error}).
+            Pin numbers are strings, as in the symbol library. The units of a multi-unit part share their
+            reference, so the pins of all its units are indexed. An error keyed by (reference, None) applies
+            to all the pins of the reference.
+    """
+    references = {}
+    pin_errors = {}
+    unit_pins = {}
+    # One row per pin of every instance, transformed in one batch at the end
+    pin_keys = []
+    pin_offsets = []
+    symbol_positions = []
+    angles = []
+    mirrors = []
+    for instance in document.iter_symbol_instances():
+        # Only the few forms needed are parsed, not the whole instance
+        reference, lib_id, at, unit, mirror = None, None, [0.0, 0.0, 0.0], 1, None
+        for head, name, start, end in sexpr.scan_forms(instance, depth=1):
+            if head == "lib_id":
+                lib_id = name
+            elif head == "at":
+                at = [float(value) for value in sexpr.parse(instance, start, end)[0].atoms[:3]]
+                at += [0.0] * (3 - len(at))
+            elif head == "unit":
+                unit = int(name)
+            elif head == "mirror":
+                mirror = name
+            elif head == "property" and name == "Reference" and reference is None:
+                atoms = sexpr.parse(instance, start, end)[0].atoms
+                reference = atoms[1] if len(atoms) >= 2 else None
+        if reference is None or lib_id is None:
+            continue
+        references.setdefault(reference, lib_id)
+
+        # Parse each definition once, however many instances use it
+        key = (lib_id, unit)
+        if key not in unit_pins:
+            definition = document.lib_symbols.get(lib_id)
+            if definition is None:
+                unit_pins[key] = None
+            else:
+                unit_pins[key] = symbol_pins(sexpr.parse_form(definition, definition.index("(")), unit=unit)
+        pins = unit_pins[key]
+        if pins is None:
+            pin_errors.setdefault((reference, None), f"lib_symbols has no definition for {lib_id}")
+            continue
+        for number, pin_x, pin_y, _ in pins:
+            pin_keys.append((reference, number))
+            pin_offsets.append((pin_x, pin_y))
+            symbol_positions.append(at[:2])
+            angles.append(at[2])
+            mirrors.append(geometry.MIRROR_CODES.get(mirror, 0))
+
+    pin_locations = {}
+    if pin_keys:
+        locations = geometry.pin_locations(np.array(pin_offsets), np.array(symbol_positions),
+                                           np.array(angles), np.array(mirrors))
+        for key, location in zip(pin_keys, locations):
+            pin_locations.setdefault(key, location)
+    return references, pin_locations, pin_errors
+
+
+def route_connections(connections, references, pin_locations, pin_errors=None):
+    """
+    Create one wire per connection, from the location of pin A to the location of pin B.
+
+    Parameters:
+        connections (list of dicts): The connections, eg: {'A_ref': 'R1', 'A_pin': 1, 'B_ref': 'R2', 'B_pin': 2}
+        references (set or dict): The references of the symbols in the schematic.
+        pin_locations (dict): {(reference, pin number): (x, y)}, see index_document.
+        pin_errors (dict, optional): {(reference, pin number): error} of the pins whose location is unknown.
+
+    Returns:
+        tuple: The wires ({"x", "y", "end_x", "end_y"} dicts) and the diagnostics of the skipped connections,
+            {"connection": index in connections, "reference": str, "pin": str, "reason": str} dicts.
+    """
+    if pin_errors is None:
+        pin_errors = {}
+    wires = []
+    diagnostics = []
+    for index, connection in enumerate(connections):
+        ends = []
+        for side in ("A", "B"):
+            reference = connection.get(f"{side}_ref")
+            pin = str(connection.get(f"{side}_pin"))
+            location = pin_locations.get((reference, pin))
+            if location is None:
+                error = pin_errors.get((reference, pin)) or pin_errors.get((reference, None))
+                if reference not in references:
+                    reason = f"no symbol with reference {reference}"
+                elif error is not None:
+                    reason = f"location of pin {pin} of {reference} failed: {error}"
+                else:
+                    reason = f"{reference} has no pin {pin}"
+                diagnostics.append({"connection": index, "reference": reference, "pin": pin, "reason": reason})
+                break
+            ends.append(location)
+        else:
+            (x, y), (end_x, end_y) = ends
+            wires.append({"x": x, "y": y, "end_x": end_x, "end_y": end_y})
+    return wires, diagnostics
+
+
+def print_diagnostics(diagnostics, connection_count):
+    if not diagnostics:
+        return
+    print(f"Skipped {len(diagnostics)} of {connection_count} connections:")
+    for diagnostic in diagnostics:
+        print(f"  connection {diagnostic['connection']}: {diagnostic['reason']}")